@@ -0,0 +1,108 @@
+"""
+Бенчмарк движка матчинга: построчная проверка vs автомат Ахо-Корасик,
+разбор фильтров на каждом сообщении vs скомпилированные фильтры
+
+Запуск:
+    python benchmark_matching.py
+"""
+import os
+import random
+import timeit
+
+# Модели тянут за собой конфиг - для бенчмарка достаточно заглушек
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('DATABASE_URL', 'postgresql+asyncpg://benchmark@localhost/benchmark')
+
+from database.models import Keyword, KeywordType
+from userbot.matching import MatchingEngine, FilterContext
+
+WORDS = [
+    'нужна', 'виза', 'ищу', 'кто', 'делает', 'помогите', 'оформить', 'сколько', 'стоит',
+    'посоветуйте', 'квартиру', 'сниму', 'срочно', 'разработчика', 'дизайнера', 'сайт',
+    'бот', 'телеграм', 'ремонт', 'под', 'ключ', 'перевод', 'документов', 'юрист',
+]
+
+MESSAGES = [
+    'Всем привет! Подскажите, кто делает визы в Испанию? Нужна помощь с документами',
+    'Продаю iPhone 13, состояние отличное, писать в личку',
+    'Ищу разработчика телеграм бота для интернет-магазина, бюджет обсуждаем',
+    'Сниму квартиру в центре на длительный срок, без посредников',
+    'Добрый вечер, сколько стоит перевод документов с нотариальным заверением?',
+] * 4
+
+
+def make_keywords(count: int, keyword_type: KeywordType) -> list:
+    """Сгенерировать набор фраз из 2-3 слов"""
+    rnd = random.Random(count)
+    return [
+        Keyword(text=' '.join(rnd.sample(WORDS, rnd.randint(2, 3))) + str(i), type=keyword_type)
+        for i in range(count)
+    ]
+
+
+def run(count: int, repeat: int = 5, number: int = 20):
+    """Сравнить оба пути для заданного количества ключевых слов"""
+    include = make_keywords(count, KeywordType.INCLUDE)
+    exclude = make_keywords(max(1, count // 10), KeywordType.EXCLUDE)
+    matcher = MatchingEngine.compile_keywords(include, exclude)
+
+    def naive():
+        for text in MESSAGES:
+            MatchingEngine.process_message(text, include, exclude)
+
+    def compiled():
+        for text in MESSAGES:
+            MatchingEngine.process_message(text, include, exclude, matcher=matcher)
+
+    naive_time = min(timeit.repeat(naive, repeat=repeat, number=number))
+    compiled_time = min(timeit.repeat(compiled, repeat=repeat, number=number))
+    per_message = number * len(MESSAGES)
+
+    print(
+        f"{count:>6} | {naive_time / per_message * 1e6:>12.1f} | "
+        f"{compiled_time / per_message * 1e6:>12.1f} | {naive_time / compiled_time:>6.1f}x"
+    )
+
+
+FILTERS = [
+    'ищу + разработчика | дизайнера',
+    'сниму + квартиру',
+    'виза | визы | документов',
+    'сколько + стоит + перевод',
+    'срочно | помогите',
+]
+
+
+def run_filters(repeat: int = 5, number: int = 200):
+    """Сравнить разбор фильтров регулярками и скомпилированные фильтры"""
+    compiled_filters = [MatchingEngine.compile_filter(logic) for logic in FILTERS]
+
+    def naive():
+        for text in MESSAGES:
+            for logic in FILTERS:
+                MatchingEngine.check_filter(text, MatchingEngine.parse_filter(logic))
+
+    def compiled():
+        for text in MESSAGES:
+            context = FilterContext(MatchingEngine.normalize_text(text))
+            for compiled_filter in compiled_filters:
+                compiled_filter.evaluate(context)
+
+    naive_time = min(timeit.repeat(naive, repeat=repeat, number=number))
+    compiled_time = min(timeit.repeat(compiled, repeat=repeat, number=number))
+    per_message = number * len(MESSAGES)
+
+    print(
+        f"{len(FILTERS):>6} | {naive_time / per_message * 1e6:>12.1f} | "
+        f"{compiled_time / per_message * 1e6:>12.1f} | {naive_time / compiled_time:>6.1f}x"
+    )
+
+
+if __name__ == '__main__':
+    print(f"{'слов':>6} | {'in, мкс/сообщ':>12} | {'А-К, мкс/сообщ':>12} | ускорение")
+    for keywords_count in (10, 100, 1000):
+        run(keywords_count)
+
+    print()
+    print(f"{'фильтр':>6} | {'regex, мкс/сообщ':>12} | {'компил., мкс/сообщ':>12} | ускорение")
+    run_filters()
@@ -1,8 +1,9 @@
 """Административные команды для управления юзерботами"""
 import logging
+from html import escape
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 
 from config import settings
 from database.database import async_session_maker
@@ -35,36 +36,58 @@ async def admin_stats(message: Message):
             text += f"   📱 Телефон: <code>{bot['phone']}</code>\n"
             text += f"   💬 Чатов: {bot['total_chats']}/{UserbotLoadBalancer.MAX_CHATS_PER_USERBOT}\n"
             text += f"   👥 Пользователей: {bot['active_users']}\n"
-            text += f"   📈 Загрузка: {bot['load_percent']:.1f}%\n\n"
+            text += f"   📈 Загрузка: {bot['load_percent']:.1f}%\n"
+            text += f"   📨 Сообщений/сек: {bot['messages_per_sec']:.2f}\n"
+            text += f"   ⚙️ CPU мс/сек: {bot['cpu_ms_per_sec']:.1f}\n\n"
         
         # Общая статистика
         total_chats = sum(b['total_chats'] for b in stats)
         total_users = sum(b['active_users'] for b in stats)
         avg_load = sum(b['load_percent'] for b in stats) / len(stats)
+        total_rate = sum(b['messages_per_sec'] for b in stats)
         
         text += "📈 <b>Общая статистика:</b>\n"
         text += f"   Всего юзерботов: {len(stats)}\n"
         text += f"   Всего чатов: {total_chats}\n"
         text += f"   Всего пользователей: {total_users}\n"
         text += f"   Средняя загрузка: {avg_load:.1f}%\n"
+        text += f"   Сообщений/сек: {total_rate:.2f}\n"
+        text += f"   Размещение чатов: {settings.USERBOT_PLACEMENT_MODE}\n"
         
         await message.answer(text, parse_mode="HTML")
 
 
 @router.message(Command("admin_rebalance"))
-async def admin_rebalance(message: Message):
-    """Перебалансировать чаты между юзерботами"""
+async def admin_rebalance(message: Message, command: CommandObject):
+    """Перебалансировать чаты между юзерботами (/admin_rebalance dry - только план)"""
     
     if message.from_user.id not in settings.admin_ids_list:
         await message.answer("❌ Доступ запрещен")
         return
     
-    await message.answer("🔄 Запуск перебалансировки...")
+    dry_run = (command.args or "").strip().lower() == "dry"
+    await message.answer("🔄 Расчёт плана перебалансировки..." if dry_run else "🔄 Запуск перебалансировки...")
     
     async with async_session_maker() as session:
-        await UserbotLoadBalancer.rebalance_chats(session)
+        moves = await UserbotLoadBalancer.rebalance_chats(session, dry_run=dry_run)
     
-    await message.answer("✅ Перебалансировка завершена! Используйте /admin_stats для просмотра результата")
+    if not moves:
+        await message.answer("✅ Распределение уже сбалансировано, переносить нечего")
+        return
+    
+    text = f"📋 <b>{'План' if dry_run else 'Перенесено'}: {len(moves)} чатов</b>\n\n"
+    for move in moves[:30]:
+        title = escape(move['title'] or f"#{move['chat_id']}")
+        text += f"   • {title}: {move['from'] or '—'} → {move['to']}\n"
+    if len(moves) > 30:
+        text += f"   ... и ещё {len(moves) - 30}\n"
+    
+    if dry_run:
+        text += "\nПрименить: /admin_rebalance"
+    else:
+        text += "\n✅ Перебалансировка завершена! Используйте /admin_stats для просмотра результата"
+    
+    await message.answer(text, parse_mode="HTML")
 
 
 @router.message(Command("admin_limits"))
@@ -12,6 +12,7 @@ from database.models import User, Chat
 from bot.states import ChatStates
 from bot.texts import get_text
 from bot.keyboards import chats_menu_kb, cancel_kb, main_menu_kb, chats_list_kb, confirm_delete_chat_kb
+from utils.cache import CacheService
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -30,6 +31,15 @@ async def show_chats_menu(callback: CallbackQuery, user: User):
     text = get_text('chats_menu', user.language)
     text += f'\n\n📁 Проект: <b>{active_project.name}</b>'
     
+    # Прогресс сканирования истории (пишут юзерботы)
+    progress = await CacheService.get_backfill_progress(active_project.id)
+    if progress and progress.get('chats_total'):
+        status = '✅' if progress.get('chats_done', 0) >= progress['chats_total'] else '⏳'
+        text += (
+            f"\n{status} История: чатов {progress.get('chats_done', 0)}/{progress['chats_total']}, "
+            f"сообщений {progress.get('scanned', 0)}, лидов {progress.get('leads', 0)}"
+        )
+    
     if active_project.chats:
         text += f'\n\n💬 <b>Ваши чаты ({len(active_project.chats)}):</b>\n'
         for chat in active_project.chats[:10]:
@@ -102,12 +112,14 @@ async def process_chat_link(message: Message, user: User, state: FSMContext):
             logger.info(f"✅ Переназначен юзербот для чата {link}")
             
             text = get_text('chat_exists', user.language)
+            chat_id = existing_chat.id
         else:
             # Создаем новый чат
             logger.info(f"🆕 Создаём новый чат: {link}")
             chat = await ChatCRUD.add(session, link)
             await ChatCRUD.assign_to_project(session, chat.id, active_project.id)
             text = get_text('chat_added', user.language, chat_link=link)
+            chat_id = chat.id
         
         # Всегда уведомляем юзербота о новом/обновленном чате через Redis
         try:
@@ -119,6 +131,9 @@ async def process_chat_link(message: Message, user: User, state: FSMContext):
             logger.info(f"📡 Отправлен сигнал reload_chats в Redis")
         except Exception as e:
             logger.warning(f"❌ Не удалось уведомить юзербота: {e}")
+        
+        # Юзербот просканирует историю чата, как только подключится к нему
+        await CacheService.request_backfill(active_project.id, chat_id)
     
     await state.clear()
     await message.answer(text, reply_markup=main_menu_kb(user.language))
@@ -199,15 +214,8 @@ async def confirm_delete_chat(callback: CallbackQuery, user: User):
         success = await ChatCRUD.remove_from_project(session, chat_id, active_project.id)
         
         if success:
-            # Отправляем сигнал reload юзерботу
-            try:
-                import redis.asyncio as redis
-                from config import settings
-                redis_client = redis.from_url(settings.REDIS_URL)
-                await redis_client.publish('userbot_control', 'reload')
-                await redis_client.close()
-            except Exception as e:
-                logger.warning(f'Failed to send reload signal: {e}')
+            # Отправляем сигнал reload юзерботу (обновит таблицу маршрутизации)
+            await CacheService.publish_reload_chats()
             
             if user.language == 'ru':
                 await callback.answer('✅ Чат удалён из мониторинга!', show_alert=True)
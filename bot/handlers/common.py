@@ -3,9 +3,9 @@ from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import update
 
 from database.database import async_session_maker
+from database.crud import UserCRUD
 from database.models import User
 from bot.texts import get_text
 from bot.keyboards import main_menu_kb, back_to_main_kb, language_selection_kb
@@ -45,12 +45,7 @@ async def set_initial_language(callback: CallbackQuery, user: User):
     new_lang = callback.data.split(':')[1]
     
     async with async_session_maker() as session:
-        await session.execute(
-            update(User)
-            .where(User.id == user.id)
-            .values(language=new_lang)
-        )
-        await session.commit()
+        await UserCRUD.set_language(session, user.id, new_lang)
     
     # Обновляем язык
     user.language = new_lang
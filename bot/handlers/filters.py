@@ -1,4 +1,6 @@
-"""Обработчики для работы с фильтрами (логические операторы AND/OR)"""
+"""Обработчики для работы с фильтрами (логические операторы AND/OR/NOT)"""
+from html import escape
+
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
@@ -9,6 +11,8 @@ from database.models import User, Filter
 from bot.states import FilterStates
 from bot.texts import get_text
 from bot.keyboards import filters_menu_kb, cancel_kb, main_menu_kb, back_to_main_kb
+from userbot.matching import MatchingEngine, FilterSyntaxError
+from utils.cache import CacheService
 from sqlalchemy import select, delete
 
 router = Router()
@@ -76,11 +80,17 @@ async def start_add_filter(callback: CallbackQuery, user: User, state: FSMContex
 <b>Операторы:</b>
 • <code>+</code> — И (оба слова обязательны)
 • <code>|</code> — ИЛИ (любое из слов)
+• <code>!</code> — НЕ (слова не должно быть)
+• <code>( )</code> — группировка
+
+<code>|</code> связывает сильнее, чем <code>+</code>
 
 <b>Примеры:</b>
 • <code>ищу + программиста</code>
 • <code>react | vue | angular</code>
-• <code>срочно + backend | frontend</code>"""
+• <code>срочно + backend | frontend</code>
+• <code>ищу + дизайнера + !бесплатно</code>
+• <code>(сниму + квартиру) | аренда</code>"""
     else:
         text = """🔧 <b>Add Filter</b>
 
@@ -89,11 +99,17 @@ Enter a logical filter:
 <b>Operators:</b>
 • <code>+</code> — AND (both words required)
 • <code>|</code> — OR (any of the words)
+• <code>!</code> — NOT (the word must be absent)
+• <code>( )</code> — grouping
+
+<code>|</code> binds tighter than <code>+</code>
 
 <b>Examples:</b>
 • <code>looking + developer</code>
 • <code>react | vue | angular</code>
-• <code>urgent + backend | frontend</code>"""
+• <code>urgent + backend | frontend</code>
+• <code>looking + designer + !free</code>
+• <code>(rent + apartment) | lease</code>"""
     
     await callback.message.answer(text, reply_markup=cancel_kb(lang), parse_mode='HTML')
     await callback.answer()
@@ -115,12 +131,14 @@ async def process_filter(message: Message, user: User, state: FSMContext):
     
     filter_string = message.text.strip()
     
-    # Проверяем что фильтр содержит операторы
-    if '+' not in filter_string and '|' not in filter_string:
+    # Проверяем синтаксис: фильтр должен компилироваться так же, как в юзерботе
+    try:
+        MatchingEngine.compile_filter(filter_string)
+    except FilterSyntaxError as e:
         if lang == 'ru':
-            err_msg = '❌ Фильтр должен содержать операторы + или |\n\nПример: <code>ищу + разработчика</code>'
+            err_msg = f'❌ Ошибка в фильтре: {escape(str(e))}\n\nПример: <code>ищу + разработчика</code>'
         else:
-            err_msg = '❌ Filter must contain + or | operators\n\nExample: <code>looking + developer</code>'
+            err_msg = f'❌ Invalid filter: {escape(str(e))}\n\nExample: <code>looking + developer</code>'
         await message.answer(err_msg, parse_mode='HTML')
         return
     
@@ -138,6 +156,9 @@ async def process_filter(message: Message, user: User, state: FSMContext):
         session.add(new_filter)
         await session.commit()
     
+    # Юзерботы пересоберут индексы чатов с новым фильтром
+    await CacheService.invalidate_project_keywords(active_project.id)
+    
     await state.clear()
     
     added_text = 'Фильтр добавлен' if lang == 'ru' else 'Filter added'
@@ -198,6 +219,8 @@ async def clear_filters(callback: CallbackQuery, user: User):
         )
         await session.commit()
     
+    await CacheService.invalidate_project_keywords(active_project.id)
+    
     msg = '🗑 Все фильтры удалены' if lang == 'ru' else '🗑 All filters cleared'
     await callback.answer(msg)
     
@@ -10,6 +10,7 @@ from database.models import User, KeywordType
 from bot.states import KeywordStates, ExcludeStates
 from bot.texts import get_text
 from bot.keyboards import keywords_menu_kb, exclude_menu_kb, cancel_kb, main_menu_kb, ai_keywords_selection_kb
+from utils.cache import CacheService
 
 logger = logging.getLogger(__name__)
 
@@ -81,6 +82,10 @@ async def process_keywords(message: Message, user: User, state: FSMContext):
         for keyword in keywords:
             await KeywordCRUD.add(session, active_project.id, keyword, KeywordType.INCLUDE)
     
+    # Ищем лиды по новым словам в уже накопленной истории чатов
+    if keywords:
+        await CacheService.request_backfill(active_project.id)
+    
     await state.clear()
     
     text = f'✅ Добавлено ключевых слов: {len(keywords)}'
@@ -330,11 +335,13 @@ async def add_all_ai_keywords(callback: CallbackQuery, user: User, state: FSMCon
         
         # Инвалидируем кэш
         try:
-            from utils.cache import CacheService
             await CacheService.invalidate_project_keywords(active_project.id)
         except Exception:
             pass
     
+    if added_count:
+        await CacheService.request_backfill(active_project.id)
+    
     await state.clear()
     
     lang = user.language
@@ -358,6 +365,12 @@ async def finish_ai_keywords(callback: CallbackQuery, user: User, state: FSMCont
     lang = user.language
     count = len(added)
     
+    if count > 0:
+        async with async_session_maker() as session:
+            active_project = await ProjectCRUD.get_active(session, user.id)
+        if active_project:
+            await CacheService.request_backfill(active_project.id)
+    
     if count > 0:
         text = f'✅ Добавлено {count} ключевых слов!' if lang == 'ru' else f'✅ Added {count} keywords!'
     else:
@@ -4,11 +4,11 @@ from datetime import datetime, timedelta
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
-from sqlalchemy import select, func, update
+from sqlalchemy import select, func
 
 from database.database import async_session_maker
-from database.models import User, Project, LeadMatch, Chat, SubscriptionPlan
-from database.crud import ProjectCRUD
+from database.models import User, Project, LeadMatch, Chat, SubscriptionPlan, NotificationMode
+from database.crud import ProjectCRUD, UserCRUD
 from bot.keyboards import profile_menu_kb, stats_period_kb, back_to_main_kb, settings_menu_kb
 from bot.texts import get_text
 from utils.subscription_helpers import get_subscription_limits
@@ -16,6 +16,16 @@ from utils.subscription_helpers import get_subscription_limits
 router = Router()
 
 
+def get_notification_mode_label(mode: str, lang: str) -> str:
+    """Название режима уведомлений"""
+    labels = {
+        NotificationMode.ALL.value: 'notifications_all',
+        NotificationMode.DIGEST.value: 'notifications_digest',
+        NotificationMode.OFF.value: 'notifications_off',
+    }
+    return get_text(labels.get(mode, 'notifications_all'), lang)
+
+
 async def get_profile_text(user: User) -> str:
     """Получить текст профиля пользователя"""
     lang = user.language
@@ -334,7 +344,7 @@ async def show_settings(callback: CallbackQuery, user: User):
 
 {get_text('settings_language', lang)} {lang_display}
 
-{get_text('settings_notifications', lang)} {get_text('notifications_enabled', lang)}
+{get_text('settings_notifications', lang)} {get_notification_mode_label(user.notification_mode, lang)}
 
 {get_text('settings_integrations', lang)}
 • AmoCRM: {amocrm_status}
@@ -381,14 +391,7 @@ async def change_language(callback: CallbackQuery, user: User):
     new_lang = callback.data.split(':')[1]
     
     async with async_session_maker() as session:
-        from database.models import User as UserModel
-        
-        await session.execute(
-            update(UserModel)
-            .where(UserModel.id == user.id)
-            .values(language=new_lang)
-        )
-        await session.commit()
+        await UserCRUD.set_language(session, user.id, new_lang)
     
     # Обновляем язык в объекте user для текущего запроса
     user.language = new_lang
@@ -401,47 +404,53 @@ async def change_language(callback: CallbackQuery, user: User):
 
 
 @router.callback_query(F.data == 'settings:notifications')
-async def show_notifications_settings(callback: CallbackQuery, user: User):
-    """Показать настройки уведомлений"""
+async def show_notifications_settings(callback: CallbackQuery, user: User, answer: bool = True):
+    """Показать настройки уведомлений (answer=False - callback уже отвечен)"""
     lang = user.language
     from aiogram.utils.keyboard import InlineKeyboardBuilder
     
     builder = InlineKeyboardBuilder()
-    builder.button(text=get_text('btn_notif_all', lang), callback_data='notif:all')
-    builder.button(text=get_text('btn_notif_important', lang), callback_data='notif:important')
-    builder.button(text=get_text('btn_notif_off', lang), callback_data='notif:off')
+    builder.button(text=get_text('btn_notif_all', lang), callback_data=f'notif:{NotificationMode.ALL.value}')
+    builder.button(text=get_text('btn_notif_digest', lang), callback_data=f'notif:{NotificationMode.DIGEST.value}')
+    builder.button(text=get_text('btn_notif_off', lang), callback_data=f'notif:{NotificationMode.OFF.value}')
     builder.button(text=get_text('btn_back', lang), callback_data='profile:settings')
     builder.adjust(1)
     
     text = f"""{get_text('notifications_title', lang)}
 
-{get_text('notifications_current', lang)} <b>{get_text('notifications_all', lang)}</b>
-
-{get_text('notifications_desc', lang)}
+{get_text('notifications_current', lang)} <b>{get_notification_mode_label(user.notification_mode, lang)}</b>
 
-⚠️ {'Функция в разработке' if lang == 'ru' else 'Feature in development'}"""
+{get_text('notifications_desc', lang)}"""
     
     await callback.message.edit_text(
         text,
         reply_markup=builder.as_markup(),
         parse_mode='HTML'
     )
-    await callback.answer()
+    if answer:
+        await callback.answer()
 
 
 @router.callback_query(F.data.startswith('notif:'))
 async def change_notifications(callback: CallbackQuery, user: User):
-    """Сменить режим уведомлений (заглушка)"""
+    """Сменить режим уведомлений"""
     lang = user.language
-    mode = callback.data.split(':')[1]
     
-    modes = {
-        'all': get_text('notifications_all', lang),
-        'important': get_text('notifications_important', lang),
-        'off': get_text('notifications_off', lang)
-    }
+    try:
+        mode = NotificationMode(callback.data.split(':')[1])
+    except ValueError:
+        await callback.answer()
+        return
+    
+    changed = user.notification_mode != mode.value
+    if changed:
+        async with async_session_maker() as session:
+            await UserCRUD.set_notification_mode(session, user.id, mode)
+        user.notification_mode = mode.value
+    
+    await callback.answer(get_text('notif_mode_set', lang).format(get_notification_mode_label(mode.value, lang)))
     
-    # TODO: Сохранить настройку в БД (нужно добавить поле в модель User)
-    msg = get_text('notif_mode_set', lang).format(modes.get(mode, '')) + (' Функция в разработке.' if lang == 'ru' else ' Feature in development.')
-    await callback.answer(msg, show_alert=True)
+    # Обновляем экран настроек уведомлений (тот же режим - текст не изменился бы)
+    if changed:
+        await show_notifications_settings(callback, user, answer=False)
 
@@ -146,6 +146,10 @@ async def confirm_delete_project(message: Message, user: User, state: FSMContext
     async with async_session_maker() as session:
         await ProjectCRUD.delete(session, project_id)
     
+    # Юзерботы должны убрать проект из таблицы маршрутизации
+    from utils.cache import CacheService
+    await CacheService.publish_reload_chats()
+    
     await state.clear()
     
     text = get_text('project_deleted', user.language)
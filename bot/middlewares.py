@@ -1,6 +1,5 @@
 """Middleware для проверки подписки"""
 from typing import Callable, Dict, Any, Awaitable
-from datetime import datetime
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 
@@ -9,10 +8,17 @@ from database.database import async_session_maker
 from database.crud import UserCRUD
 from database.models import SubscriptionPlan
 from bot.texts import get_text
+from utils.user_cache import UserProfile, user_cache
 
 
 class SubscriptionMiddleware(BaseMiddleware):
-    """Middleware для проверки активной подписки пользователя"""
+    """
+    Middleware для проверки активной подписки пользователя
+    
+    Профиль берётся из кэша (user_cache), в БД - только при промахе,
+    поэтому навигация по меню не ходит в Postgres. В хендлеры
+    передаётся UserProfile.
+    """
     
     # Команды, доступные без подписки
     FREE_COMMANDS = ['/start', 'menu:main', 'menu:payment', 'payment:', 'pay:']
@@ -25,60 +31,56 @@ class SubscriptionMiddleware(BaseMiddleware):
     ) -> Any:
         """Проверка подписки"""
         
-        # Получаем пользователя
-        async with async_session_maker() as session:
-            user = await UserCRUD.get_or_create(
-                session,
-                telegram_id=event.from_user.id,
-                username=event.from_user.username
-            )
-            
-            # Сохраняем пользователя в данных для использования в хендлерах
-            data['user'] = user
-            
-            # Проверяем, является ли пользователь администратором
-            if event.from_user.id in settings.admin_ids_list:
-                # Админы имеют полный доступ без проверки подписки
-                return await handler(event, data)
-            
-            # Проверяем, является ли это бесплатной командой
-            command_text = ''
-            if isinstance(event, Message):
-                command_text = event.text or ''
-            elif isinstance(event, CallbackQuery):
-                command_text = event.data or ''
-            
-            is_free_command = any(
-                cmd in command_text for cmd in self.FREE_COMMANDS
-            )
-            
-            # Если бесплатная команда, пропускаем проверку
-            if is_free_command:
-                return await handler(event, data)
-            
-            # Проверяем подписку
+        # Получаем пользователя (кэш, затем БД)
+        user = await user_cache.get(event.from_user.id)
+        if user is None:
+            async with async_session_maker() as session:
+                db_user = await UserCRUD.get_or_create(
+                    session,
+                    telegram_id=event.from_user.id,
+                    username=event.from_user.username
+                )
+            user = UserProfile.from_user(db_user)
+            await user_cache.set(user)
+        
+        # Сохраняем пользователя в данных для использования в хендлерах
+        data['user'] = user
+        
+        # Проверяем, является ли пользователь администратором
+        if event.from_user.id in settings.admin_ids_list:
+            # Админы имеют полный доступ без проверки подписки
+            return await handler(event, data)
+        
+        # Проверяем, является ли это бесплатной командой
+        command_text = ''
+        if isinstance(event, Message):
+            command_text = event.text or ''
+        elif isinstance(event, CallbackQuery):
+            command_text = event.data or ''
+        
+        is_free_command = any(
+            cmd in command_text for cmd in self.FREE_COMMANDS
+        )
+        
+        # Если бесплатная команда, пропускаем проверку
+        if is_free_command:
+            return await handler(event, data)
+        
+        # Проверяем подписку (по закэшированному профилю)
+        if not user.has_active_subscription:
             if user.subscription_plan == SubscriptionPlan.FREE:
                 # Нет подписки
                 text = get_text('no_subscription', user.language)
-                
-                if isinstance(event, Message):
-                    await event.answer(text)
-                elif isinstance(event, CallbackQuery):
-                    await event.answer(text, show_alert=True)
-                
-                return
-            
-            # Проверяем срок действия подписки
-            if user.subscription_end_date and user.subscription_end_date < datetime.utcnow():
+            else:
                 # Подписка истекла
                 text = get_text('subscription_expired', user.language)
-                
-                if isinstance(event, Message):
-                    await event.answer(text)
-                elif isinstance(event, CallbackQuery):
-                    await event.answer(text, show_alert=True)
-                
-                return
             
-            # Подписка активна, продолжаем обработку
-            return await handler(event, data)
+            if isinstance(event, Message):
+                await event.answer(text)
+            elif isinstance(event, CallbackQuery):
+                await event.answer(text, show_alert=True)
+            
+            return
+        
+        # Подписка активна, продолжаем обработку
+        return await handler(event, data)
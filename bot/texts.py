@@ -114,15 +114,15 @@ Choose the language you want to continue with:""",
         'notifications_title': '🔔 <b>Настройки уведомлений</b>',
         'notifications_current': 'Текущий статус:',
         'notifications_all': 'Все уведомления включены',
-        'notifications_important': 'Только важные',
+        'notifications_digest': 'Сводка',
         'notifications_off': 'Отключены',
         'notifications_desc': """Выберите режим уведомлений:
 
-• <b>Все уведомления</b> — получать уведомления о каждом найденном лиде
-• <b>Только важные</b> — уведомления раз в час со сводкой
+• <b>Все уведомления</b> — уведомление о каждом найденном лиде (совпадения в нескольких проектах приходят одним сообщением)
+• <b>Сводка</b> — все лиды за период одним сообщением
 • <b>Отключить</b> — не получать уведомления (лиды сохраняются)""",
         'btn_notif_all': '✅ Все уведомления',
-        'btn_notif_important': '🔕 Только важные',
+        'btn_notif_digest': '📬 Сводка',
         'btn_notif_off': '❌ Отключить',
         'notif_mode_set': '✅ Режим: {}',
         
@@ -161,7 +161,11 @@ Choose the language you want to continue with:""",
 <b>| (ИЛИ)</b> — хотя бы одно слово
 Пример: <code>аренда | съём</code>
 
-Комбинируйте: <code>купить + квартиру | дом</code>""",
+<b>! (НЕ)</b> — слова не должно быть
+Пример: <code>ищу + !бесплатно</code>
+
+Комбинируйте: <code>купить + квартиру | дом</code>
+Скобки: <code>(купить + квартиру) | аренда</code>""",
         'btn_add_filter': '➕ Добавить фильтр',
         'btn_show_filters': '📋 Показать все',
         'btn_clear_filters': '🗑 Удалить все',
@@ -322,15 +326,15 @@ Start by creating a project and setting up keywords!""",
         'notifications_title': '🔔 <b>Notification Settings</b>',
         'notifications_current': 'Current status:',
         'notifications_all': 'All notifications enabled',
-        'notifications_important': 'Important only',
+        'notifications_digest': 'Digest',
         'notifications_off': 'Disabled',
         'notifications_desc': """Choose notification mode:
 
-• <b>All notifications</b> — receive notification for every lead found
-• <b>Important only</b> — hourly summary notifications
+• <b>All notifications</b> — a notification for every lead found (matches in several projects arrive as one message)
+• <b>Digest</b> — all leads for a period in one message
 • <b>Disable</b> — no notifications (leads are still saved)""",
         'btn_notif_all': '✅ All Notifications',
-        'btn_notif_important': '🔕 Important Only',
+        'btn_notif_digest': '📬 Digest',
         'btn_notif_off': '❌ Disable',
         'notif_mode_set': '✅ Mode: {}',
         
@@ -369,7 +373,11 @@ Example: <code>buy + apartment</code>
 <b>| (OR)</b> — at least one word
 Example: <code>rent | lease</code>
 
-Combine: <code>buy + apartment | house</code>""",
+<b>! (NOT)</b> — the word must be absent
+Example: <code>looking + !free</code>
+
+Combine: <code>buy + apartment | house</code>
+Parentheses: <code>(buy + apartment) | rent</code>""",
         'btn_add_filter': '➕ Add Filter',
         'btn_show_filters': '📋 Show All',
         'btn_clear_filters': '🗑 Clear All',
@@ -1,7 +1,12 @@
 """Конфигурация приложения"""
+import json
+import logging
+import os
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import List
 
+logger = logging.getLogger(__name__)
+
 
 class Settings(BaseSettings):
     """Основные настройки приложения"""
@@ -38,8 +43,63 @@ class Settings(BaseSettings):
     USERBOT_3_PHONE: str = ""
     USERBOT_3_SESSION_NAME: str = "userbot_3"
     
+    # Любое число юзерботов: JSON-файл со списком
+    # [{"session_name": "...", "api_id": 123, "api_hash": "...", "phone": "+7..."}, ...]
+    USERBOTS_FILE: str = ""
+    USERBOTS_PER_PROCESS: int = 0  # Юзерботов на процесс run_userbot.py (0 - все в одном процессе)
+    
+    # Очередь обработки сообщений юзербота
+    USERBOT_QUEUE_WORKERS: int = 4  # Количество обработчиков очереди
+    USERBOT_QUEUE_MAXSIZE: int = 1000  # Максимальная глубина очереди
+    USERBOT_QUEUE_OVERFLOW: str = "drop_oldest"  # drop_oldest | redis
+    USERBOT_EVENT_FILTER: bool = True  # Отбирать сообщения по чату на уровне Telethon
+    USERBOT_CATCHUP_CONCURRENCY: int = 3  # Чатов, догружаемых одновременно после перезапуска
+    USERBOT_CATCHUP_LIMIT: int = 500  # Максимум догружаемых сообщений на чат
+    USERBOT_LOAD_INTERVAL: int = 60  # Период замера нагрузки чатов, сек
+    USERBOT_PLACEMENT_MODE: str = "chats"  # chats - по числу чатов | load - по измеренной нагрузке
+    USERBOT_LEASE_TTL: int = 60  # Аренда юзербота в Redis, сек (продлевается каждые TTL/3)
+    USERBOT_SUPERVISOR_INTERVAL: int = 30  # Период проверки аренд, сек
+    USERBOT_FLOOD_FAILOVER: int = 900  # FloodWait дольше этого - чаты переносятся на другие юзерботы, сек
+    
+    # Сканирование истории после добавления чата или ключевых слов
+    BACKFILL_DAYS: int = 7  # Глубина истории в днях
+    BACKFILL_MESSAGE_LIMIT: int = 2000  # Максимум сообщений на чат
+    BACKFILL_PAGE_SIZE: int = 100  # Сообщений за один запрос к Telegram (максимум 100)
+    BACKFILL_PAGE_DELAY: float = 1.0  # Пауза между страницами, сек
+    
+    # Запись лидов пачками
+    LEAD_WRITER_BATCH_SIZE: int = 50  # Сбрасывать буфер при таком числе лидов
+    LEAD_WRITER_FLUSH_MS: int = 200  # ...или через столько мс после первого лида
+    
+    # Доставка лидов в CRM (очередь crm_outbox)
+    CRM_OUTBOX_POLL_INTERVAL: float = 2.0  # Проверка очереди, сек
+    CRM_OUTBOX_BATCH_SIZE: int = 50  # Записей за один проход
+    CRM_MAX_ATTEMPTS: int = 8  # Попыток до отказа
+    CRM_RETRY_BASE_DELAY: float = 30.0  # Первая задержка повтора (дальше удваивается), сек
+    CRM_ACCOUNT_RPS: float = 5.0  # Запросов в секунду на аккаунт AmoCRM (лимит API - 7)
+    CRM_MAX_CONNECTIONS: int = 20  # Размер пула HTTP-соединений на аккаунт AmoCRM
+    
+    # Уведомления пользователям (лимиты Bot API)
+    NOTIFY_GLOBAL_RATE: float = 25  # Сообщений в секунду на бота (лимит Telegram ~30)
+    NOTIFY_PER_CHAT_INTERVAL: float = 1.0  # Секунд между сообщениями в один чат
+    NOTIFY_WORKERS: int = 4  # Параллельных отправителей
+    NOTIFY_MAX_ATTEMPTS: int = 5  # Попыток при сетевых ошибках до сохранения в Redis
+    NOTIFY_DIGEST_INTERVAL: int = 3600  # Период сводки для режима digest, секунды
+    
     # OpenAI
     OPENAI_API_KEY: str = ""
+    OPENAI_MAX_CONCURRENCY: int = 8  # Запросов в полёте одновременно
+    OPENAI_RPM_LIMIT: int = 0  # Запросов в минуту (0 - без ограничения)
+    OPENAI_TPM_LIMIT: int = 0  # Токенов в минуту (0 - без ограничения)
+    OPENAI_MAX_CONNECTIONS: int = 20  # Размер keep-alive пула
+    OPENAI_TIMEOUT: float = 30.0  # Таймаут запроса, секунды
+    AI_BATCH_WINDOW_MS: int = 300  # Окно сбора кандидатов для пакетной валидации
+    AI_BATCH_MAX_SIZE: int = 10  # Максимум кандидатов в пачке (1 - без батчинга)
+    
+    # Локальный пред-классификатор (очевидные лиды/не-лиды без LLM)
+    PRECLASSIFIER_ENABLED: bool = True
+    PRECLASSIFIER_NEGATIVE_THRESHOLD: float = -3.0  # score <= порога - не лид
+    PRECLASSIFIER_POSITIVE_THRESHOLD: float = 4.0  # score >= порога - лид
     
     # Payment Systems
     YOOKASSA_SHOP_ID: str = ""
@@ -70,7 +130,7 @@ class Settings(BaseSettings):
     
     @property
     def userbots_config(self) -> List[dict]:
-        """Конфигурация юзерботов"""
+        """Конфигурация юзерботов (USERBOT_1..3 из .env и USERBOTS_FILE)"""
         bots = []
         
         if self.USERBOT_1_API_ID:
@@ -97,7 +157,70 @@ class Settings(BaseSettings):
                 'session_name': self.USERBOT_3_SESSION_NAME
             })
         
+        # Юзерботы из файла; при совпадении session_name файл важнее
+        if self.USERBOTS_FILE:
+            from_file = load_userbots_file(self.USERBOTS_FILE)
+            names = {bot['session_name'] for bot in from_file}
+            bots = [bot for bot in bots if bot['session_name'] not in names] + from_file
+        
         return bots
 
 
+_userbots_file_cache: dict = {}  # путь -> (mtime, юзерботы)
+_userbots_file_errors: dict = {}  # путь -> (mtime, ошибка) последней неудачной загрузки
+
+
+def load_userbots_file(path: str) -> List[dict]:
+    """
+    Прочитать список юзерботов из JSON-файла
+    
+    Файл перечитывается только при изменении - его можно править
+    без перезапуска бота (новые юзерботы запускает run_userbot.py).
+    Если файл пропал или испорчен, ошибка логируется один раз и
+    возвращается последний удачно прочитанный список.
+    """
+    cached = _userbots_file_cache.get(path)
+    last_good = [dict(bot) for bot in cached[1]] if cached else []
+    mtime = None
+    
+    try:
+        mtime = os.path.getmtime(path)
+        if cached and cached[0] == mtime:
+            return last_good
+        if _userbots_file_errors.get(path, (None,))[0] == mtime:
+            return last_good
+        bots = _read_userbots_file(path)
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        failure = (mtime, str(e))
+        if _userbots_file_errors.get(path) != failure:
+            _userbots_file_errors[path] = failure
+            logger.error(f"❌ Не удалось прочитать {path}: {e!r}; используется прежний список ({len(last_good)} юзерботов)")
+        return last_good
+    
+    _userbots_file_errors.pop(path, None)
+    _userbots_file_cache[path] = (mtime, bots)
+    return [dict(bot) for bot in bots]
+
+
+def _read_userbots_file(path: str) -> List[dict]:
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    
+    bots = []
+    for entry in entries:
+        if entry.get('enabled', True) is False:
+            continue
+        bots.append({
+            'api_id': int(entry['api_id']),
+            'api_hash': str(entry['api_hash']),
+            'phone': str(entry['phone']),
+            'session_name': str(entry['session_name'])
+        })
+    
+    names = [bot['session_name'] for bot in bots]
+    if len(names) != len(set(names)):
+        raise ValueError(f"{path}: повторяющиеся session_name")
+    return bots
+
+
 settings = Settings()
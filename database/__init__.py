@@ -1,14 +1,14 @@
 """Инициализация пакета database"""
 from database.database import Base, engine, async_session_maker, init_db, get_session
 from database.models import (
-    User, Project, Keyword, Filter, Chat, PackedChatGroup,
-    SubscriptionPlan, KeywordType
+    User, Project, Keyword, Filter, Chat, ChatTombstone, PackedChatGroup,
+    SubscriptionPlan, KeywordType, NotificationMode, CRMOutbox, CRMOutboxStatus
 )
 from database.crud import UserCRUD, ProjectCRUD, KeywordCRUD, ChatCRUD
 
 __all__ = [
     'Base', 'engine', 'async_session_maker', 'init_db', 'get_session',
-    'User', 'Project', 'Keyword', 'Filter', 'Chat', 'PackedChatGroup',
-    'SubscriptionPlan', 'KeywordType',
+    'User', 'Project', 'Keyword', 'Filter', 'Chat', 'ChatTombstone', 'PackedChatGroup',
+    'SubscriptionPlan', 'KeywordType', 'NotificationMode', 'CRMOutbox', 'CRMOutboxStatus',
     'UserCRUD', 'ProjectCRUD', 'KeywordCRUD', 'ChatCRUD'
 ]
@@ -1,11 +1,11 @@
 """CRUD операции для работы с базой данных"""
 from typing import List, Optional
-from datetime import datetime
-from sqlalchemy import select, update, delete, func
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, delete, func, and_, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
-from database.models import User, Project, Keyword, Filter, Chat, KeywordType, SubscriptionPlan, LeadMatch, AmoCRMIntegration
+from database.models import User, Project, Keyword, Filter, Chat, ChatTombstone, KeywordType, SubscriptionPlan, NotificationMode, LeadMatch, AmoCRMIntegration, CRMOutbox, CRMOutboxStatus
 
 
 class UserCRUD:
@@ -43,7 +43,44 @@ class UserCRUD:
         await session.commit()
         
         result = await session.execute(select(User).where(User.id == user_id))
-        return result.scalar_one()
+        user = result.scalar_one()
+        await UserCRUD._invalidate(user.telegram_id)
+        return user
+    
+    @staticmethod
+    async def set_language(session: AsyncSession, user_id: int, language: str):
+        """Сохранить язык интерфейса"""
+        result = await session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(language=language)
+            .returning(User.telegram_id)
+        )
+        telegram_id = result.scalar_one()
+        await session.commit()
+        await UserCRUD._invalidate(telegram_id)
+    
+    @staticmethod
+    async def set_notification_mode(session: AsyncSession, user_id: int, mode: NotificationMode):
+        """Сохранить режим уведомлений и сообщить юзерботам"""
+        result = await session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(notification_mode=mode.value)
+            .returning(User.telegram_id)
+        )
+        telegram_id = result.scalar_one()
+        await session.commit()
+        await UserCRUD._invalidate(telegram_id)
+        
+        from utils.cache import CacheService
+        await CacheService.publish_user_settings_changed(user_id, mode.value)
+    
+    @staticmethod
+    async def _invalidate(telegram_id: int):
+        """Сбросить кэш профиля (middleware перечитает пользователя из БД)"""
+        from utils.user_cache import user_cache
+        await user_cache.invalidate(telegram_id)
 
 
 class ProjectCRUD:
@@ -96,6 +133,16 @@ class ProjectCRUD:
     @staticmethod
     async def delete(session: AsyncSession, project_id: int):
         """Удалить проект"""
+        # Чаты проекта теряют связь - отмечаем их для синхронизации юзерботов
+        from database.models import chat_project_association
+        await session.execute(
+            update(Chat)
+            .where(Chat.id.in_(
+                select(chat_project_association.c.chat_id)
+                .where(chat_project_association.c.project_id == project_id)
+            ))
+            .values(updated_at=datetime.utcnow())
+        )
         await session.execute(delete(Project).where(Project.id == project_id))
         await session.commit()
 
@@ -110,6 +157,7 @@ class KeywordCRUD:
         session.add(keyword)
         await session.commit()
         await session.refresh(keyword)
+        await KeywordCRUD._invalidate(project_id)
         return keyword
     
     @staticmethod
@@ -132,10 +180,13 @@ class KeywordCRUD:
     @staticmethod
     async def delete(session: AsyncSession, keyword_id: int):
         """Удалить ключевое слово по ID"""
-        await session.execute(
-            delete(Keyword).where(Keyword.id == keyword_id)
+        result = await session.execute(
+            delete(Keyword).where(Keyword.id == keyword_id).returning(Keyword.project_id)
         )
+        project_id = result.scalar_one_or_none()
         await session.commit()
+        if project_id is not None:
+            await KeywordCRUD._invalidate(project_id)
     
     @staticmethod
     async def delete_all(session: AsyncSession, project_id: int, keyword_type: KeywordType):
@@ -145,6 +196,14 @@ class KeywordCRUD:
             .where(Keyword.project_id == project_id, Keyword.type == keyword_type)
         )
         await session.commit()
+        await KeywordCRUD._invalidate(project_id)
+    
+    @staticmethod
+    async def _invalidate(project_id: int):
+        """Сбросить кэш слов проекта (юзерботы пересоберут индексы чатов)"""
+        # Импорт здесь чтобы избежать циклической зависимости
+        from utils.cache import CacheService
+        await CacheService.invalidate_project_keywords(project_id)
 
 
 class ChatCRUD:
@@ -198,6 +257,7 @@ class ChatCRUD:
         
         if chat not in project.chats:
             project.chats.append(chat)
+            chat.updated_at = datetime.utcnow()  # Юзерботы подхватят новую связь
             await session.commit()
     
     @staticmethod
@@ -208,6 +268,62 @@ class ChatCRUD:
         )
         return result.scalar_one_or_none()
     
+    @staticmethod
+    async def claim_unassigned(session: AsyncSession, session_name: str) -> List[int]:
+        """Забрать все неназначенные чаты одним UPDATE (возвращает их ID)"""
+        result = await session.execute(
+            update(Chat)
+            .where(Chat.assigned_userbot.is_(None))
+            .values(assigned_userbot=session_name, updated_at=datetime.utcnow())
+            .returning(Chat.id)
+        )
+        chat_ids = list(result.scalars().all())
+        await session.commit()
+        return chat_ids
+    
+    @staticmethod
+    async def get_changed_since(
+        session: AsyncSession,
+        session_name: str,
+        since: Optional[datetime] = None
+    ) -> List[Chat]:
+        """
+        Чаты для синхронизации юзербота
+        
+        since=None - все чаты юзербота (полная загрузка);
+        иначе все чаты, изменённые после since (включая переназначенные другим),
+        и чаты юзербота, в которые он ещё не вступил (повтор вступления).
+        """
+        query = select(Chat)
+        if since is None:
+            query = query.where(Chat.assigned_userbot == session_name)
+        else:
+            query = query.where(or_(
+                Chat.updated_at > since,
+                and_(Chat.assigned_userbot == session_name, Chat.is_joined.is_(False))
+            ))
+        result = await session.execute(query.order_by(Chat.updated_at))
+        return list(result.scalars().all())
+    
+    @staticmethod
+    async def get_tombstones_since(session: AsyncSession, since: datetime) -> List[ChatTombstone]:
+        """Чаты, удалённые после since"""
+        result = await session.execute(
+            select(ChatTombstone)
+            .where(ChatTombstone.deleted_at > since)
+            .order_by(ChatTombstone.deleted_at)
+        )
+        return list(result.scalars().all())
+    
+    @staticmethod
+    async def purge_tombstones(session: AsyncSession, older_than: datetime) -> int:
+        """Удалить старые записи об удалённых чатах"""
+        result = await session.execute(
+            delete(ChatTombstone).where(ChatTombstone.deleted_at < older_than)
+        )
+        await session.commit()
+        return result.rowcount or 0
+    
     @staticmethod
     async def remove_from_project(session: AsyncSession, chat_id: int, project_id: int) -> bool:
         """Удалить чат из проекта. Если чат больше не привязан ни к одному проекту - удаляем из БД"""
@@ -237,6 +353,7 @@ class ChatCRUD:
             
             if chat in project.chats:
                 project.chats.remove(chat)
+                chat.updated_at = datetime.utcnow()  # Юзерботы подхватят изменение связей
                 await session.commit()
                 
                 # Перезагружаем чат с projects чтобы проверить есть ли ещё связи
@@ -248,6 +365,11 @@ class ChatCRUD:
                 # Если чат больше не привязан ни к одному проекту - удаляем из БД
                 if chat and not chat.projects:
                     logger.info(f"Чат {chat.telegram_link} больше не привязан к проектам, удаляем из БД")
+                    session.add(ChatTombstone(
+                        chat_id=chat.id,
+                        telegram_id=chat.telegram_id,
+                        assigned_userbot=chat.assigned_userbot
+                    ))
                     await session.delete(chat)
                     await session.commit()
                     logger.info(f"Чат удалён из БД")
@@ -276,7 +398,8 @@ class LeadMatchCRUD:
         matched_keywords: str,
         telegram_message_id: int = None,
         sender_username: str = None,
-        sender_id: int = None
+        sender_id: int = None,
+        is_historical: bool = False
     ) -> LeadMatch:
         """Создать запись о найденном лиде"""
         lead_match = LeadMatch(
@@ -288,13 +411,49 @@ class LeadMatchCRUD:
             matched_keywords=matched_keywords,
             telegram_message_id=telegram_message_id,
             sender_username=sender_username,
-            sender_id=sender_id
+            sender_id=sender_id,
+            is_historical=is_historical
         )
         session.add(lead_match)
         await session.commit()
         await session.refresh(lead_match)
         return lead_match
     
+    @staticmethod
+    async def create_many(session: AsyncSession, rows: List[dict]) -> List[int]:
+        """
+        Вставить пачку лидов одним INSERT ... RETURNING (без commit)
+        
+        Возвращает id в порядке rows.
+        """
+        if not rows:
+            return []
+        result = await session.scalars(
+            insert(LeadMatch).returning(LeadMatch.id, sort_by_parameter_order=True),
+            rows
+        )
+        return list(result.all())
+    
+    @staticmethod
+    async def get_existing_message_ids(
+        session: AsyncSession,
+        project_id: int,
+        chat_id: int,
+        telegram_message_ids: List[int]
+    ) -> set:
+        """Какие из сообщений чата уже сохранены лидами проекта"""
+        if not telegram_message_ids:
+            return set()
+        result = await session.execute(
+            select(LeadMatch.telegram_message_id)
+            .where(
+                LeadMatch.project_id == project_id,
+                LeadMatch.chat_id == chat_id,
+                LeadMatch.telegram_message_id.in_(telegram_message_ids)
+            )
+        )
+        return set(result.scalars().all())
+    
     @staticmethod
     async def get_user_leads(
         session: AsyncSession,
@@ -410,6 +569,7 @@ class AmoCRMCRUD:
             )
             await session.commit()
             await session.refresh(existing)
+            await AmoCRMCRUD._invalidate(user_id)
             return existing
         
         integration = AmoCRMIntegration(
@@ -425,6 +585,7 @@ class AmoCRMCRUD:
         session.add(integration)
         await session.commit()
         await session.refresh(integration)
+        await AmoCRMCRUD._invalidate(user_id)
         return integration
     
     @staticmethod
@@ -434,4 +595,109 @@ class AmoCRMCRUD:
             delete(AmoCRMIntegration).where(AmoCRMIntegration.user_id == user_id)
         )
         await session.commit()
+        await AmoCRMCRUD._invalidate(user_id)
         return True
+    
+    @staticmethod
+    async def _invalidate(user_id: int):
+        """Сбросить кэш интеграции в процессах доставки"""
+        from utils.cache import CacheService
+        await CacheService.publish_amocrm_integration_changed(user_id)
+
+
+class CRMOutboxCRUD:
+    """Очередь доставки лидов в CRM"""
+    
+    @staticmethod
+    async def enqueue_for_leads(session: AsyncSession, lead_ids: List[int]) -> int:
+        """
+        Поставить лиды в очередь CRM (без commit - в транзакции записи лидов)
+        
+        В очередь попадают только живые лиды пользователей с активной
+        интеграцией - одним INSERT ... SELECT.
+        """
+        if not lead_ids:
+            return 0
+        result = await session.execute(
+            insert(CRMOutbox).from_select(
+                ['lead_match_id', 'user_id'],
+                select(LeadMatch.id, LeadMatch.user_id)
+                .join(AmoCRMIntegration, AmoCRMIntegration.user_id == LeadMatch.user_id)
+                .where(
+                    LeadMatch.id.in_(lead_ids),
+                    LeadMatch.is_historical == False,
+                    AmoCRMIntegration.is_active == True
+                )
+            )
+        )
+        return result.rowcount or 0
+    
+    @staticmethod
+    async def claim_due(session: AsyncSession, limit: int, lease_seconds: int) -> List[tuple]:
+        """
+        Забрать готовые к отправке записи (с commit)
+        
+        Запись «арендуется» на lease_seconds: другие процессы её пропускают
+        (SKIP LOCKED), а если доставщик упал - она вернётся после аренды.
+        
+        Returns:
+            [(id, lead_match_id, user_id, attempts)]
+        """
+        now = datetime.utcnow()
+        due = (
+            select(CRMOutbox.id)
+            .where(
+                CRMOutbox.status == CRMOutboxStatus.PENDING.value,
+                CRMOutbox.next_attempt_at <= now
+            )
+            .order_by(CRMOutbox.next_attempt_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        result = await session.execute(
+            update(CRMOutbox)
+            .where(CRMOutbox.id.in_(due))
+            .values(
+                attempts=CRMOutbox.attempts + 1,
+                next_attempt_at=now + timedelta(seconds=lease_seconds)
+            )
+            .returning(CRMOutbox.id, CRMOutbox.lead_match_id, CRMOutbox.user_id, CRMOutbox.attempts)
+        )
+        rows = [tuple(row) for row in result.all()]
+        await session.commit()
+        return rows
+    
+    @staticmethod
+    async def mark_sent(session: AsyncSession, outbox_ids: List[int], lead_ids: List[int]):
+        """Отметить доставленными записи очереди и их лиды"""
+        if not outbox_ids:
+            return
+        await session.execute(
+            update(CRMOutbox)
+            .where(CRMOutbox.id.in_(outbox_ids))
+            .values(status=CRMOutboxStatus.SENT.value, sent_at=datetime.utcnow(), last_error=None)
+        )
+        await session.execute(
+            update(LeadMatch)
+            .where(LeadMatch.id.in_(lead_ids))
+            .values(is_sent_to_crm=True)
+        )
+        await session.commit()
+    
+    @staticmethod
+    async def mark_failed(
+        session: AsyncSession,
+        outbox_id: int,
+        error: str,
+        retry_at: Optional[datetime] = None
+    ):
+        """Записать ошибку: повтор в retry_at или окончательный отказ (retry_at=None)"""
+        values = {'last_error': error[:1000]}
+        if retry_at is None:
+            values['status'] = CRMOutboxStatus.FAILED.value
+        else:
+            values['next_attempt_at'] = retry_at
+        await session.execute(
+            update(CRMOutbox).where(CRMOutbox.id == outbox_id).values(**values)
+        )
+        await session.commit()
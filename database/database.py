@@ -1,4 +1,5 @@
 """Инициализация базы данных"""
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from config import settings
@@ -23,10 +24,20 @@ class Base(DeclarativeBase):
     pass
 
 
+# create_all не добавляет колонки в существующие таблицы - досоздаём их явно
+SCHEMA_PATCHES = [
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS notification_mode VARCHAR(20) NOT NULL DEFAULT 'all'",
+    "CREATE INDEX IF NOT EXISTS ix_chats_updated_at ON chats (updated_at)",
+    "ALTER TABLE lead_matches ADD COLUMN IF NOT EXISTS is_historical BOOLEAN NOT NULL DEFAULT FALSE",
+]
+
+
 async def init_db():
     """Инициализация базы данных"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        for statement in SCHEMA_PATCHES:
+            await conn.execute(text(statement))
 
 
 async def get_session() -> AsyncSession:
@@ -0,0 +1,114 @@
+"""Отложенная запись лидов: накопление в памяти и вставка пачкой"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import settings
+from database.database import async_session_maker
+from database.crud import LeadMatchCRUD, CRMOutboxCRUD
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LeadWriter:
+    """
+    Write-behind буфер для LeadMatch
+
+    write() кладёт строку в буфер и ждёт её id. Буфер сбрасывается одним
+    INSERT ... RETURNING в одной короткой транзакции, как только набралось
+    max_batch строк или прошло flush_ms с первой строки пачки. В той же
+    транзакции лиды ставятся в очередь доставки в CRM. Если пачка
+    не записалась, строки пробуются по одной - ошибка в одной строке не
+    теряет остальные.
+    """
+
+    def __init__(self, max_batch: int = 50, flush_ms: int = 200):
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = max(0, flush_ms) / 1000
+
+        self._pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._writes: Set[asyncio.Task] = set()
+
+    @classmethod
+    def from_settings(cls) -> 'LeadWriter':
+        return cls(
+            max_batch=settings.LEAD_WRITER_BATCH_SIZE,
+            flush_ms=settings.LEAD_WRITER_FLUSH_MS
+        )
+
+    async def write(self, **fields: Any) -> int:
+        """Записать лид (поля LeadMatchCRUD.create) и вернуть его id"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((fields, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush_now()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_interval())
+
+        return await future
+
+    async def stop(self):
+        """Записать всё накопленное (при остановке процесса)"""
+        self._flush_now()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    async def _flush_after_interval(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        self._flush_now()
+
+    def _flush_now(self):
+        """Забрать накопленную пачку и записать её в фоне"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._process(batch))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _process(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        rows = [fields for fields, _ in batch]
+        metrics.observe('leads.write_batch', len(rows))
+
+        started_at = time.monotonic()
+        try:
+            ids = await self._insert(rows)
+        except Exception as e:
+            metrics.incr('leads.write_errors')
+            logger.error(f"❌ Ошибка записи пачки лидов ({len(rows)} шт.): {e}")
+            if len(batch) == 1:
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # Пробуем по одной строке
+            for item in batch:
+                await self._process([item])
+            return
+        finally:
+            metrics.observe('leads.write_ms', (time.monotonic() - started_at) * 1000)
+
+        metrics.incr('leads.written', len(ids))
+        for (_, future), lead_id in zip(batch, ids):
+            if not future.done():
+                future.set_result(lead_id)
+
+    @staticmethod
+    async def _insert(rows: List[Dict[str, Any]]) -> List[int]:
+        async with async_session_maker() as session:
+            ids = await LeadMatchCRUD.create_many(session, rows)
+            await CRMOutboxCRUD.enqueue_for_leads(session, ids)
+            await session.commit()
+        return ids
+
+
+# Общий буфер процесса
+lead_writer = LeadWriter.from_settings()
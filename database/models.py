@@ -17,6 +17,20 @@ class SubscriptionPlan(str, enum.Enum):
     COMPANY = "company"        # 50 чатов
 
 
+class NotificationMode(str, enum.Enum):
+    """Режим уведомлений о лидах"""
+    ALL = "all"        # Сразу, одно сообщение на сообщение чата
+    DIGEST = "digest"  # Периодическая сводка
+    OFF = "off"        # Не уведомлять (лиды сохраняются)
+
+
+class CRMOutboxStatus(str, enum.Enum):
+    """Статус доставки лида в CRM"""
+    PENDING = "pending"  # Ждёт отправки (в том числе повторной)
+    SENT = "sent"        # Доставлен
+    FAILED = "failed"    # Попытки исчерпаны
+
+
 class KeywordType(str, enum.Enum):
     """Тип ключевого слова"""
     INCLUDE = "include"  # Ключевые слова
@@ -40,6 +54,11 @@ class User(Base):
     telegram_id: Mapped[int] = mapped_column(BigInteger, unique=True, index=True)
     username: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     language: Mapped[str] = mapped_column(String(10), default='ru')
+    notification_mode: Mapped[str] = mapped_column(
+        String(20),
+        default=NotificationMode.ALL.value,
+        server_default=NotificationMode.ALL.value
+    )
     
     # Подписка
     subscription_plan: Mapped[SubscriptionPlan] = mapped_column(
@@ -142,15 +161,29 @@ class Chat(Base):
     # Какой юзербот отвечает за этот чат
     assigned_userbot: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
     
-    # Даты
+    # Даты (updated_at - метка для инкрементальной синхронизации юзерботов)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Связи
     projects: Mapped[List["Project"]] = relationship(
         secondary=chat_project_association,
         back_populates="chats"
     )
+    
+    def __repr__(self):
+        return f"<Chat {self.telegram_link}>"
+
+
+class ChatTombstone(Base):
+    """Удалённые чаты (чтобы юзерботы при синхронизации сняли их с мониторинга)"""
+    __tablename__ = 'chat_tombstones'
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    chat_id: Mapped[int] = mapped_column(index=True)
+    telegram_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    assigned_userbot: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    deleted_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
 
 
 class LeadMatch(Base):
@@ -176,6 +209,7 @@ class LeadMatch(Base):
     is_sent_to_crm: Mapped[bool] = mapped_column(Boolean, default=False)
     is_contacted: Mapped[bool] = mapped_column(Boolean, default=False)  # Связались с лидом
     is_converted: Mapped[bool] = mapped_column(Boolean, default=False)  # Конвертирован в клиента
+    is_historical: Mapped[bool] = mapped_column(Boolean, default=False)  # Найден сканированием истории
     
     # Даты
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
@@ -219,9 +253,28 @@ class AmoCRMIntegration(Base):
     
     def __repr__(self):
         return f"<AmoCRMIntegration {self.subdomain}>"
+
+
+class CRMOutbox(Base):
+    """Очередь доставки лидов в CRM (пишется в одной транзакции с лидом)"""
+    __tablename__ = 'crm_outbox'
+    
+    id: Mapped[int] = mapped_column(primary_key=True)
+    lead_match_id: Mapped[int] = mapped_column(ForeignKey('lead_matches.id', ondelete='CASCADE'), index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey('users.id', ondelete='CASCADE'), index=True)
+    
+    # Доставка
+    status: Mapped[str] = mapped_column(String(20), default=CRMOutboxStatus.PENDING.value)
+    attempts: Mapped[int] = mapped_column(default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    
+    # Даты
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     
     def __repr__(self):
-        return f"<Chat {self.telegram_link}>"
+        return f"<CRMOutbox {self.id} lead={self.lead_match_id} {self.status}>"
 
 
 class PackedChatGroup(Base):
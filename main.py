@@ -10,6 +10,8 @@ from config import settings
 from bot.handlers import register_all_handlers
 from bot.middlewares import SubscriptionMiddleware
 from database.database import init_db
+from utils.ai_client import ai_client
+from utils.amocrm import amocrm_pool
 
 # Настройка логирования
 logging.basicConfig(
@@ -97,6 +99,8 @@ async def main():
     finally:
         await bot.session.close()
         await redis.close()
+        await ai_client.close()
+        await amocrm_pool.close()
 
 
 if __name__ == '__main__':
@@ -1,8 +1,24 @@
-"""Запуск юзерботов для мониторинга чатов"""
+"""
+Запуск юзерботов для мониторинга чатов
+
+    python run_userbot.py                      # все юзерботы (или по USERBOTS_PER_PROCESS на процесс)
+    python run_userbot.py --per-process 2      # по 2 юзербота на процесс, с перезапуском упавших
+    python run_userbot.py --sessions a,b       # только указанные юзерботы в этом процессе
+"""
+import argparse
 import asyncio
 import logging
+import os
+from typing import List, Optional
 from config import settings
+from database.lead_writer import lead_writer
+from userbot.launcher import UserbotLauncher
+from userbot.supervisor import supervisor
 from userbot.worker import UserbotWorker
+from utils.ai_client import ai_client
+from utils.crm_delivery import crm_delivery
+from utils.metrics import report_metrics_periodically
+from utils.notifier import notifier
 
 logging.basicConfig(
     level=settings.LOG_LEVEL,
@@ -11,12 +27,19 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def main():
-    """Запуск всех юзерботов из конфигурации"""
+async def main(sessions: Optional[List[str]] = None):
+    """Запуск юзерботов из конфигурации в текущем процессе (sessions - только указанные)"""
     
     workers = []
     
-    for bot_config in settings.userbots_config:
+    configs = settings.userbots_config
+    if sessions:
+        unknown = set(sessions) - {bot['session_name'] for bot in configs}
+        if unknown:
+            logger.error(f"Юзерботы не найдены в конфигурации: {', '.join(sorted(unknown))}")
+        configs = [bot for bot in configs if bot['session_name'] in sessions]
+    
+    for bot_config in configs:
         worker = UserbotWorker(
             api_id=bot_config['api_id'],
             api_hash=bot_config['api_hash'],
@@ -31,11 +54,51 @@ async def main():
     
     logger.info(f"Запуск {len(workers)} юзерботов...")
     
+    # Периодическая выгрузка метрик (глубина очередей, время ожидания и т.д.)
+    asyncio.create_task(report_metrics_periodically())
+    
+    # Перенос чатов юзерботов с истёкшей арендой (действует один процесс кластера)
+    asyncio.create_task(supervisor.run())
+    
+    # Один Bot и общая очередь уведомлений на все юзерботы процесса
+    await notifier.start()
+    
+    # Доставка лидов в CRM из очереди - отдельно от матчинга
+    await crm_delivery.start()
+    
     # Запускаем всех воркеров параллельно
     # Используем gather с return_exceptions=True для обработки ошибок
     tasks = [worker.start() for worker in workers]
-    await asyncio.gather(*tasks, return_exceptions=True)
+    try:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await lead_writer.stop()
+        await crm_delivery.stop()
+        await notifier.stop()
+        await ai_client.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Запуск юзерботов GetLead")
+    parser.add_argument('--sessions', help="session_name юзерботов через запятую (только они в этом процессе)")
+    parser.add_argument(
+        '--per-process', type=int, default=settings.USERBOTS_PER_PROCESS,
+        help="Юзерботов на процесс; 0 - все в одном процессе"
+    )
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    args = parse_args()
+    
+    if args.sessions:
+        asyncio.run(main([name.strip() for name in args.sessions.split(',') if name.strip()]))
+    elif args.per_process > 0:
+        launcher = UserbotLauncher(
+            lambda: [bot['session_name'] for bot in settings.userbots_config],
+            args.per_process,
+            os.path.abspath(__file__)
+        )
+        asyncio.run(launcher.run())
+    else:
+        asyncio.run(main())
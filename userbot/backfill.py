@@ -0,0 +1,255 @@
+"""Сканирование истории чатов после добавления чата или ключевых слов"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from html import escape
+from typing import Dict, List, Set, Tuple
+
+from telethon.errors import FloodWaitError
+
+from config import settings
+from database.database import async_session_maker
+from database.crud import LeadMatchCRUD
+from database.models import NotificationMode
+from userbot.matching import ChatMatchIndex
+from userbot.routing import ChatRoute, ProjectRoute
+from utils.cache import CacheKeys, CacheService, get_redis
+from utils.metrics import metrics
+from utils.notifier import notifier
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryBackfill:
+    """
+    Фоновое сканирование истории чатов проекта одним юзерботом
+
+    Запросы приходят по pub/sub (CacheService.request_backfill), каждый
+    юзербот сканирует только свои чаты, по одному заданию за раз.
+    История читается страницами (один запрос к Telegram на страницу) с
+    паузой между страницами. Совпадения проходят ту же проверку, что и живые
+    сообщения, и сохраняются лидами с пометкой is_historical. Прогресс
+    пишется в Redis-хэш, бот показывает его в меню чатов.
+    """
+
+    # Сколько ждать подключения чата, который ещё не в мониторинге
+    DEFERRED_TTL = 3600
+    # Сколько лидов перечислить в итоговом сообщении
+    SUMMARY_LEADS = 10
+
+    def __init__(self, worker):
+        self.worker = worker
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._queued: Set[Tuple[int, int]] = set()
+        self._deferred: Dict[int, Tuple[float, Set[int]]] = {}
+
+    def request(self, project_id: int, chat_id: int = 0):
+        """Поставить задание в очередь (повторный запрос того же задания не дублируется)"""
+        key = (project_id, chat_id)
+        if key in self._queued or (project_id, 0) in self._queued:
+            return
+        self._queued.add(key)
+        self._queue.put_nowait(key)
+
+    def resume_deferred(self):
+        """После синхронизации чатов: запустить задания по чатам, которые стали доступны"""
+        if not self._deferred:
+            return
+
+        now = time.monotonic()
+        routed = {route.id for route in self.worker.routes}
+        for chat_id, (deferred_at, project_ids) in list(self._deferred.items()):
+            if chat_id in routed:
+                del self._deferred[chat_id]
+                for project_id in project_ids:
+                    self.request(project_id, chat_id)
+            elif now - deferred_at > self.DEFERRED_TTL:
+                del self._deferred[chat_id]
+
+    async def listen(self):
+        """Слушаем Redis: запросы на сканирование истории"""
+        import redis.asyncio as redis
+
+        while True:
+            try:
+                redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+                pubsub = redis_client.pubsub()
+                await pubsub.subscribe(CacheKeys.backfill_channel())
+
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    project_id, chat_id = message['data'].split(':', 1)
+                    self.request(int(project_id), int(chat_id))
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка Redis pubsub (backfill): {e}, переподключаюсь через 5 сек...")
+                await asyncio.sleep(5)
+
+    async def run(self):
+        """Выполнять задания по одному (не нагружаем аккаунт параллельными чтениями истории)"""
+        while True:
+            try:
+                key = await self._queue.get()
+                self._queued.discard(key)
+                await self.run_job(*key)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка сканирования истории: {e}")
+
+    async def run_job(self, project_id: int, chat_id: int = 0):
+        """Просканировать историю чатов проекта, которые мониторит этот юзербот"""
+        chats = self.worker.routes.chats_for_project(project_id)
+        if chat_id:
+            chats = [chat for chat in chats if chat.id == chat_id]
+            if not chats:
+                # Чат ещё не подключён (или его ведёт другой юзербот) - ждём синхронизации
+                _, project_ids = self._deferred.setdefault(chat_id, (time.monotonic(), set()))
+                project_ids.add(project_id)
+                return
+        if not chats:
+            return
+
+        project = next(project for project in chats[0].projects if project.id == project_id)
+        # Запрос приходит сразу после изменения слов - не полагаемся на порядок сигналов
+        self.worker.project_keywords.pop(project_id, None)
+        index = await self.worker.build_match_index([project_id])
+        started_at = time.monotonic()
+        logger.info(f"📜 {self.worker.session_name}: сканирую историю {len(chats)} чатов проекта '{project.name}'")
+        await self._progress(project_id, chats_total=len(chats))
+
+        scanned_total = 0
+        leads = []
+        for chat in chats:
+            try:
+                scanned, chat_leads = await self.scan_chat(chat, project, index)
+            except Exception as e:
+                logger.error(f"❌ Ошибка сканирования истории чата {chat.telegram_link}: {e}")
+                scanned, chat_leads = 0, []
+            scanned_total += scanned
+            leads.extend(chat_leads)
+            await self._progress(project_id, chats_done=1, leads=len(chat_leads))
+
+        metrics.incr('backfill.jobs')
+        metrics.incr('backfill.leads', len(leads))
+        logger.info(
+            f"📜 История проекта '{project.name}': {scanned_total} сообщений, {len(leads)} лидов "
+            f"за {time.monotonic() - started_at:.1f} сек"
+        )
+        self.notify_summary(project, len(chats), scanned_total, leads)
+
+    async def scan_chat(self, chat: ChatRoute, project: ProjectRoute, index: ChatMatchIndex) -> Tuple[int, List[tuple]]:
+        """
+        Пройти историю чата от новых сообщений к старым
+
+        Returns:
+            (просмотрено сообщений, [(чат, текст, данные лида)])
+        """
+        since = datetime.now(timezone.utc) - timedelta(days=settings.BACKFILL_DAYS)
+        peer = self.worker.to_peer_id(chat.telegram_id)
+        offset_id = 0
+        scanned = 0
+        leads = []
+
+        while scanned < settings.BACKFILL_MESSAGE_LIMIT:
+            limit = min(settings.BACKFILL_PAGE_SIZE, settings.BACKFILL_MESSAGE_LIMIT - scanned)
+            try:
+                page = await self.worker.client.get_messages(peer, limit=limit, offset_id=offset_id)
+            except FloodWaitError as e:
+                logger.warning(f"⏳ FloodWait при сканировании истории {chat.telegram_link}: {e.seconds} сек")
+                self.worker.note_flood_wait(e.seconds)
+                await asyncio.sleep(e.seconds)
+                continue
+
+            if not page:
+                break
+
+            scanned += len(page)
+            offset_id = page[-1].id
+            metrics.incr('backfill.pages')
+            metrics.incr('backfill.messages', len(page))
+            await self._progress(project.id, scanned=len(page))
+
+            candidates = []
+            for message in page:
+                if message.out or not message.message or message.date < since:
+                    continue
+                found_keywords = index.scan(message.message).get(project.id)
+                if found_keywords:
+                    candidates.append((message, found_keywords))
+            if candidates:
+                leads.extend(await self.check_candidates(chat, project, candidates))
+
+            if page[-1].date < since or len(page) < limit:
+                break
+            await asyncio.sleep(settings.BACKFILL_PAGE_DELAY)
+
+        return scanned, leads
+
+    async def check_candidates(self, chat: ChatRoute, project: ProjectRoute, candidates: list) -> List[tuple]:
+        """Проверить совпадения страницы (уже сохранённые лиды пропускаются)"""
+        async with async_session_maker() as session:
+            existing = await LeadMatchCRUD.get_existing_message_ids(
+                session, project.id, chat.id, [message.id for message, _ in candidates]
+            )
+
+        checks = []
+        texts = []
+        for message, found_keywords in candidates:
+            if message.id in existing:
+                continue
+            precheck = None
+            if self.worker.preclassifier:
+                precheck = self.worker.preclassifier.classify(message.message)
+            texts.append(message.message)
+            checks.append(self.worker.check_project_match(
+                message, message.message, project, chat, found_keywords, precheck, historical=True
+            ))
+
+        results = await asyncio.gather(*checks)
+        return [(chat, text, hit) for text, hit in zip(texts, results) if hit]
+
+    async def _progress(self, project_id: int, **increments: int):
+        """Увеличить счётчики прогресса в Redis"""
+        try:
+            redis = await get_redis()
+            key = CacheKeys.backfill_progress(project_id)
+            async with redis.pipeline(transaction=False) as pipe:
+                for field, amount in increments.items():
+                    pipe.hincrby(key, field, amount)
+                pipe.expire(key, CacheService.TTL_BACKFILL_PROGRESS)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось обновить прогресс сканирования истории: {e}")
+
+    def notify_summary(self, project: ProjectRoute, chats_count: int, scanned: int, leads: List[tuple]):
+        """Одно итоговое сообщение вместо уведомления на каждый исторический лид"""
+        user = project.user
+        if (user.notification_mode or NotificationMode.ALL.value) == NotificationMode.OFF.value:
+            return
+
+        lines = [
+            "📜 <b>История просканирована</b>",
+            f"📁 Проект: {escape(project.name)}",
+            f"💬 Чатов: {chats_count}, сообщений: {scanned}",
+            f"🎯 Найдено лидов: {len(leads)}",
+        ]
+        if leads:
+            lines.append('')
+        for chat, text, hit in leads[:self.SUMMARY_LEADS]:
+            short_text = text if len(text) <= 100 else text[:100] + '...'
+            chat_title = escape(chat.title or chat.telegram_link or '')
+            lines.append(f"• <a href=\"{hit['message_link']}\">{chat_title}</a>: {escape(short_text)}")
+        if len(leads) > self.SUMMARY_LEADS:
+            lines.append(f"... и ещё {len(leads) - self.SUMMARY_LEADS}")
+
+        notifier.enqueue(
+            chat_id=user.telegram_id,
+            text='\n'.join(lines),
+            parse_mode='HTML',
+            disable_web_page_preview=True
+        )
@@ -0,0 +1,93 @@
+"""Позиции чтения чатов и защита от повторной обработки сообщений"""
+import asyncio
+import logging
+from typing import Dict, Iterable
+
+from utils.cache import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class MessageCursor:
+    """
+    Последний обработанный message_id по каждому чату
+
+    Хранится в Redis-хэше (telegram_id -> message_id), общем для всех
+    юзерботов: после переназначения чата новый юзербот продолжит с того же
+    места. Запись в Redis - пачкой раз в flush_interval секунд.
+    """
+
+    LAST_IDS_KEY = "userbot:last_message_ids"
+    PROCESSED_KEY = "userbot:processed:{chat_id}:{message_id}"
+    PROCESSED_TTL = 3 * 24 * 3600
+
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        self._last_ids: Dict[int, int] = {}
+        self._dirty: set = set()
+
+    def advance(self, chat_id: int, message_id: int):
+        """Отметить сообщение обработанным (позиция только растёт)"""
+        if message_id > self._last_ids.get(chat_id, 0):
+            self._last_ids[chat_id] = message_id
+            self._dirty.add(chat_id)
+
+    async def load(self, chat_ids: Iterable[int]) -> Dict[int, int]:
+        """Позиции чатов из Redis (чаты без позиции не возвращаются)"""
+        chat_ids = list(chat_ids)
+        if not chat_ids:
+            return {}
+
+        redis = await get_redis()
+        values = await redis.hmget(self.LAST_IDS_KEY, chat_ids)
+
+        positions = {}
+        for chat_id, value in zip(chat_ids, values):
+            if value is None:
+                continue
+            message_id = max(int(value), self._last_ids.get(chat_id, 0))
+            self._last_ids[chat_id] = message_id
+            positions[chat_id] = message_id
+        return positions
+
+    async def flush(self):
+        """Записать изменившиеся позиции в Redis"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        try:
+            redis = await get_redis()
+            await redis.hset(
+                self.LAST_IDS_KEY,
+                mapping={chat_id: self._last_ids[chat_id] for chat_id in dirty}
+            )
+        except Exception:
+            self._dirty |= dirty
+            raise
+
+    async def run_flush_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка сохранения позиций чатов: {e}")
+
+    @classmethod
+    async def claim(cls, chat_id: int, message_id: int) -> bool:
+        """
+        Атомарно «занять» сообщение для обработки совпадений
+
+        False - сообщение уже обрабатывалось (живое событие и догрузка
+        пересеклись, либо повтор после перезапуска).
+        """
+        try:
+            redis = await get_redis()
+            key = cls.PROCESSED_KEY.format(chat_id=chat_id, message_id=message_id)
+            return bool(await redis.set(key, 1, nx=True, ex=cls.PROCESSED_TTL))
+        except Exception as e:
+            # Без Redis лучше возможный дубль, чем потерянный лид
+            logger.error(f"❌ Ошибка проверки дубля сообщения {chat_id}/{message_id}: {e}")
+            return True
@@ -0,0 +1,156 @@
+"""Измеренная нагрузка чатов: сообщения в секунду и время матчинга"""
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+from utils.cache import CacheKeys, get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class ChatLoadTracker:
+    """
+    Скользящие (EWMA) счётчики нагрузки по чатам юзербота
+
+    Воркер считает сообщения и миллисекунды матчинга по каждому чату,
+    раз в interval секунд счётчики превращаются в скорости и
+    сглаживаются. Результат пишется в Redis:
+    - CacheKeys.chat_rates(): '<telegram_id>:msgs' / '<telegram_id>:cpu'
+      (общий для юзерботов - после переназначения чата новый владелец
+      продолжает с той же оценки)
+    - CacheKeys.userbot_rates(): '<session_name>:msgs' / '<session_name>:cpu'
+      - сумма по чатам юзербота, по ней размещаются новые чаты
+    """
+
+    # Вес нового интервала в EWMA (~5 интервалов памяти)
+    ALPHA = 0.3
+
+    def __init__(self, session_name: str, interval: float = 60.0):
+        self.session_name = session_name
+        self.interval = interval
+
+        self._messages: Dict[int, int] = {}
+        self._cpu_ms: Dict[int, float] = {}
+        self._rates: Dict[int, List[float]] = {}  # telegram_id -> [msgs/сек, cpu-мс/сек]
+        self._measured_at = time.monotonic()
+
+    def count(self, chat_id: int):
+        """Учесть сообщение чата"""
+        self._messages[chat_id] = self._messages.get(chat_id, 0) + 1
+
+    def spend(self, chat_id: int, cpu_ms: float):
+        """Учесть время обработки сообщения чата"""
+        self._cpu_ms[chat_id] = self._cpu_ms.get(chat_id, 0.0) + cpu_ms
+
+    async def flush(self, chat_ids: Iterable[int]):
+        """Обновить скорости мониторимых чатов и записать их в Redis"""
+        chat_ids = set(chat_ids)
+        now = time.monotonic()
+        elapsed = max(now - self._measured_at, 1e-3)
+        self._measured_at = now
+        messages, self._messages = self._messages, {}
+        cpu_ms, self._cpu_ms = self._cpu_ms, {}
+
+        redis = await get_redis()
+
+        # Снятые с мониторинга чаты больше не наши
+        self._rates = {chat_id: rate for chat_id, rate in self._rates.items() if chat_id in chat_ids}
+
+        # Новые чаты начинаем с оценки прежнего владельца
+        unseen = [chat_id for chat_id in chat_ids if chat_id not in self._rates]
+        if unseen:
+            fields = [f"{chat_id}:{metric}" for chat_id in unseen for metric in ('msgs', 'cpu')]
+            values = await redis.hmget(CacheKeys.chat_rates(), fields)
+            for i, chat_id in enumerate(unseen):
+                msgs, cpu = values[2 * i], values[2 * i + 1]
+                self._rates[chat_id] = [float(msgs or 0), float(cpu or 0)]
+
+        for chat_id, rate in self._rates.items():
+            rate[0] += self.ALPHA * (messages.get(chat_id, 0) / elapsed - rate[0])
+            rate[1] += self.ALPHA * (cpu_ms.get(chat_id, 0.0) / elapsed - rate[1])
+
+        chat_mapping = {}
+        for chat_id, (msgs, cpu) in self._rates.items():
+            chat_mapping[f"{chat_id}:msgs"] = round(msgs, 4)
+            chat_mapping[f"{chat_id}:cpu"] = round(cpu, 4)
+
+        async with redis.pipeline(transaction=False) as pipe:
+            if chat_mapping:
+                pipe.hset(CacheKeys.chat_rates(), mapping=chat_mapping)
+            pipe.hset(CacheKeys.userbot_rates(), mapping={
+                f"{self.session_name}:msgs": round(sum(rate[0] for rate in self._rates.values()), 4),
+                f"{self.session_name}:cpu": round(sum(rate[1] for rate in self._rates.values()), 4),
+            })
+            await pipe.execute()
+
+    async def run_flush_loop(self, chat_ids_getter):
+        while True:
+            try:
+                await asyncio.sleep(self.interval)
+                await self.flush(chat_ids_getter())
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка сохранения нагрузки чатов {self.session_name}: {e}")
+
+    @staticmethod
+    async def get_chat_rate(telegram_id: Optional[int]) -> Optional[List[float]]:
+        """[msgs/сек, cpu-мс/сек] чата или None, если чат ещё не измерялся"""
+        if telegram_id is None:
+            return None
+        rates = await ChatLoadTracker.get_chat_rates([telegram_id])
+        return rates.get(telegram_id)
+
+    @staticmethod
+    async def get_chat_rates(telegram_ids: Iterable[int]) -> Dict[int, List[float]]:
+        """[msgs/сек, cpu-мс/сек] по измеренным чатам (одним HMGET)"""
+        telegram_ids = [telegram_id for telegram_id in telegram_ids if telegram_id is not None]
+        if not telegram_ids:
+            return {}
+        try:
+            redis = await get_redis()
+            fields = [f"{telegram_id}:{metric}" for telegram_id in telegram_ids for metric in ('msgs', 'cpu')]
+            values = await redis.hmget(CacheKeys.chat_rates(), fields)
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения нагрузки чатов: {e}")
+            return {}
+
+        rates = {}
+        for i, telegram_id in enumerate(telegram_ids):
+            msgs, cpu = values[2 * i], values[2 * i + 1]
+            if msgs is not None or cpu is not None:
+                rates[telegram_id] = [float(msgs or 0), float(cpu or 0)]
+        return rates
+
+    @staticmethod
+    async def get_userbot_rates() -> Dict[str, float]:
+        """Нагрузка юзерботов: {'<session_name>:msgs': ..., '<session_name>:cpu': ...}"""
+        try:
+            redis = await get_redis()
+            rates = await redis.hgetall(CacheKeys.userbot_rates())
+            return {field: float(value) for field, value in rates.items()}
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения нагрузки юзерботов: {e}")
+            return {}
+
+    @staticmethod
+    async def move_chat(rate: List[float], new_userbot: str, old_userbot: Optional[str] = None):
+        """
+        Перенести оценку чата между юзерботами до следующего замера
+
+        Иначе несколько чатов, добавленных за один интервал, уйдут
+        одному и тому же юзерботу.
+        """
+        try:
+            redis = await get_redis()
+            key = CacheKeys.userbot_rates()
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.hincrbyfloat(key, f"{new_userbot}:msgs", rate[0])
+                pipe.hincrbyfloat(key, f"{new_userbot}:cpu", rate[1])
+                if old_userbot:
+                    pipe.hincrbyfloat(key, f"{old_userbot}:msgs", -rate[0])
+                    pipe.hincrbyfloat(key, f"{old_userbot}:cpu", -rate[1])
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"❌ Ошибка переноса нагрузки чата: {e}")
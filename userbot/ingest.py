@@ -0,0 +1,180 @@
+"""Очередь входящих сообщений юзербота с пулом обработчиков"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional
+
+from utils.cache import get_redis
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MessageQueue:
+    """
+    Ограниченная очередь сообщений + N обработчиков
+
+    Обработчик Telethon только кладёт сообщение в очередь и сразу
+    возвращается; тяжёлая обработка (БД, OpenAI, CRM, Bot API) идёт
+    в фоновых задачах. При переполнении:
+    - drop_oldest: вытесняется самое старое сообщение
+    - redis: в Redis уходят (chat_id, message_id), сообщения
+      дочитываются через fetch_spilled, когда очередь освободится
+    """
+
+    DROP_OLDEST = 'drop_oldest'
+    SPILL_REDIS = 'redis'
+
+    # Дочитываем из Redis, когда очередь заполнена меньше чем наполовину
+    REFILL_BATCH = 100
+    REFILL_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[None]],
+        workers: int = 4,
+        maxsize: int = 1000,
+        overflow: str = DROP_OLDEST,
+        fetch_spilled: Optional[Callable[[int, List[int]], Awaitable[list]]] = None
+    ):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.maxsize = max(1, maxsize)
+        self.overflow = overflow
+        self.fetch_spilled = fetch_spilled
+
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks: List[asyncio.Task] = []
+        self._spill_key = f"userbot:spill:{name}"
+
+        if self.overflow == self.SPILL_REDIS and self.fetch_spilled is None:
+            logger.warning(f"⚠️ {name}: overflow=redis без fetch_spilled, используем drop_oldest")
+            self.overflow = self.DROP_OLDEST
+
+    def _metric(self, suffix: str) -> str:
+        return f"queue.{self.name}.{suffix}"
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        """Запустить обработчики (и дочитывание из Redis)"""
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._consume(i)))
+        if self.overflow == self.SPILL_REDIS:
+            self._tasks.append(asyncio.create_task(self._refill_from_redis()))
+        logger.info(
+            f"📥 Очередь {self.name}: {self.workers} обработчиков, "
+            f"maxsize={self.maxsize}, overflow={self.overflow}"
+        )
+
+    async def stop(self):
+        """Остановить обработчики"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def put_nowait(self, message: Any) -> bool:
+        """
+        Положить сообщение в очередь без ожидания
+
+        Returns:
+            True если сообщение принято в очередь в памяти
+        """
+        item = (time.monotonic(), message)
+
+        if self._queue.full():
+            if self.overflow == self.SPILL_REDIS:
+                self._spill(message)
+                return False
+
+            # drop_oldest: освобождаем место за счёт самого старого
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                metrics.incr(self._metric('dropped'))
+            except asyncio.QueueEmpty:
+                pass
+
+        self._queue.put_nowait(item)
+        metrics.incr(self._metric('enqueued'))
+        metrics.gauge(self._metric('depth'), self._queue.qsize())
+        return True
+
+    async def put(self, message: Any):
+        """Положить сообщение, дождавшись места (догрузка истории не вытесняет живые сообщения)"""
+        await self._queue.put((time.monotonic(), message))
+        metrics.incr(self._metric('enqueued'))
+        metrics.gauge(self._metric('depth'), self._queue.qsize())
+
+    def _spill(self, message: Any):
+        """Отправить ссылку на сообщение в Redis (сам текст дочитаем позже)"""
+        payload = json.dumps({'chat_id': message.chat_id, 'message_id': message.id})
+        metrics.incr(self._metric('spilled'))
+        asyncio.create_task(self._push_spilled(payload))
+
+    async def _push_spilled(self, payload: str):
+        try:
+            redis = await get_redis()
+            await redis.rpush(self._spill_key, payload)
+        except Exception as e:
+            metrics.incr(self._metric('dropped'))
+            logger.error(f"❌ {self.name}: не удалось выгрузить сообщение в Redis: {e}")
+
+    async def _refill_from_redis(self):
+        """Дочитывать выгруженные сообщения, когда в очереди есть место"""
+        while True:
+            try:
+                await asyncio.sleep(self.REFILL_INTERVAL)
+                if self._queue.qsize() >= self.maxsize // 2:
+                    continue
+
+                redis = await get_redis()
+                free = min(self.REFILL_BATCH, self.maxsize - self._queue.qsize())
+                raw_items = await redis.lpop(self._spill_key, free)
+                if not raw_items:
+                    continue
+
+                # Группируем по чату - один запрос get_messages на чат
+                by_chat = {}
+                for raw in raw_items:
+                    item = json.loads(raw)
+                    by_chat.setdefault(item['chat_id'], []).append(item['message_id'])
+
+                for chat_id, message_ids in by_chat.items():
+                    messages = await self.fetch_spilled(chat_id, message_ids)
+                    for message in messages:
+                        if message is not None:
+                            # Пока ждали Telegram, очередь могли заполнить живые сообщения
+                            await self._queue.put((time.monotonic(), message))
+                            metrics.incr(self._metric('refilled'))
+
+                metrics.gauge(self._metric('depth'), self._queue.qsize())
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ {self.name}: ошибка дочитывания из Redis: {e}")
+
+    async def _consume(self, worker_id: int):
+        """Обработчик очереди"""
+        while True:
+            enqueued_at, message = await self._queue.get()
+            metrics.gauge(self._metric('depth'), self._queue.qsize())
+            metrics.observe(self._metric('wait_ms'), (time.monotonic() - enqueued_at) * 1000)
+
+            started_at = time.monotonic()
+            try:
+                await self.handler(message)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ {self.name}#{worker_id}: ошибка обработки сообщения: {e}")
+            finally:
+                metrics.observe(self._metric('handle_ms'), (time.monotonic() - started_at) * 1000)
+                metrics.incr(self._metric('processed'))
+                self._queue.task_done()
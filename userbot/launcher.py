@@ -0,0 +1,174 @@
+"""Запуск юзерботов отдельными процессами с перезапуском упавших"""
+import asyncio
+import logging
+import signal
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class UserbotProcess:
+    """Дочерний процесс run_userbot.py с группой юзерботов"""
+
+    def __init__(self, sessions: List[str]):
+        self.sessions = sessions
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.restart_requested = False  # Остановлен лаунчером намеренно (изменился состав группы)
+
+    @property
+    def name(self) -> str:
+        return ','.join(self.sessions)
+
+    async def spawn(self, script: str):
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, script, '--sessions', self.name
+        )
+        self.started_at = time.monotonic()
+        logger.info(f"🚀 Процесс {self.process.pid}: {self.name}")
+
+
+class UserbotLauncher:
+    """
+    Супервизор процессов юзерботов
+
+    Юзерботы делятся на группы по per_process, каждая группа - отдельный
+    процесс (свой event loop и ядро CPU). Упавший процесс перезапускается
+    независимо от остальных с экспоненциальной задержкой; задержка
+    сбрасывается, если процесс проработал дольше STABLE_AFTER секунд.
+
+    Конфигурация перечитывается раз в CONFIG_CHECK_INTERVAL секунд:
+    новые юзерботы запускаются новыми процессами, удалённые - останавливаются.
+    """
+
+    RESTART_BASE_DELAY = 5
+    RESTART_MAX_DELAY = 300
+    STABLE_AFTER = 600
+    STOP_TIMEOUT = 30
+    CONFIG_CHECK_INTERVAL = 60
+
+    def __init__(self, sessions_getter: Callable[[], List[str]], per_process: int, script: str):
+        self.sessions_getter = sessions_getter
+        self.per_process = max(1, per_process)
+        self.script = script
+        self.processes: List[UserbotProcess] = []
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    def add_sessions(self, sessions: List[str]):
+        """Запустить процессы для новых юзерботов"""
+        for i in range(0, len(sessions), self.per_process):
+            child = UserbotProcess(sessions[i:i + self.per_process])
+            self.processes.append(child)
+            self._tasks.append(asyncio.create_task(self._supervise(child)))
+
+    def remove_sessions(self, sessions: set):
+        """Остановить удалённые из конфигурации юзерботы (их группа перезапустится без них)"""
+        for child in self.processes:
+            if not sessions & set(child.sessions):
+                continue
+            child.sessions = [name for name in child.sessions if name not in sessions]
+            if child.process is not None and child.process.returncode is None:
+                child.restart_requested = True
+                child.process.terminate()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stopping.set)
+            except NotImplementedError:
+                pass  # Windows: остановка по Ctrl+C через KeyboardInterrupt
+
+        self.add_sessions(self.sessions_getter())
+        logger.info(f"Запуск {len(self.processes)} процессов юзерботов...")
+        try:
+            await self._watch_config()
+        finally:
+            await self.stop()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _watch_config(self):
+        """Подхватывать добавленные и удалённые юзерботы до остановки лаунчера"""
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.CONFIG_CHECK_INTERVAL)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                sessions = self.sessions_getter()
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения конфигурации юзерботов: {e}")
+                continue
+
+            running = {name for child in self.processes for name in child.sessions}
+            added = [name for name in sessions if name not in running]
+            removed = running - set(sessions)
+            if removed:
+                logger.info(f"➖ Юзерботы удалены из конфигурации: {', '.join(sorted(removed))}")
+                self.remove_sessions(removed)
+            if added:
+                logger.info(f"➕ Новые юзерботы в конфигурации: {', '.join(added)}")
+                self.add_sessions(added)
+
+    async def _supervise(self, child: UserbotProcess):
+        """Держать процесс группы запущенным до остановки лаунчера"""
+        while not self._stopping.is_set() and child.sessions:
+            child.restart_requested = False
+            await child.spawn(self.script)
+            waiter = asyncio.create_task(child.process.wait())
+            stopper = asyncio.create_task(self._stopping.wait())
+            await asyncio.wait({waiter, stopper}, return_when=asyncio.FIRST_COMPLETED)
+            stopper.cancel()
+            if self._stopping.is_set():
+                waiter.cancel()
+                return
+
+            if not child.sessions:
+                logger.info(f"Процесс {child.process.pid} остановлен: его юзерботы удалены из конфигурации")
+                return
+            if child.restart_requested:
+                # Намеренный перезапуск без удалённых юзерботов - не сбой, без задержки
+                logger.info(f"🔄 Процесс {child.process.pid} перезапускается с юзерботами: {child.name}")
+                continue
+
+            uptime = time.monotonic() - child.started_at
+            child.restarts = 0 if uptime > self.STABLE_AFTER else child.restarts + 1
+            delay = min(self.RESTART_BASE_DELAY * 2 ** child.restarts, self.RESTART_MAX_DELAY)
+            logger.error(
+                f"💥 Процесс {child.name} завершился с кодом {child.process.returncode} "
+                f"через {uptime:.0f} сек, перезапуск через {delay} сек"
+            )
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        """Остановить все процессы: SIGTERM, затем SIGKILL по таймауту"""
+        self._stopping.set()
+        running: Dict[int, asyncio.subprocess.Process] = {
+            child.process.pid: child.process for child in self.processes
+            if child.process is not None and child.process.returncode is None
+        }
+        for process in running.values():
+            process.terminate()
+        if not running:
+            return
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(process.wait() for process in running.values())),
+                timeout=self.STOP_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            for process in running.values():
+                if process.returncode is None:
+                    logger.warning(f"⚠️ Процесс {process.pid} не завершился, принудительная остановка")
+                    process.kill()
+        logger.info("Процессы юзерботов остановлены")
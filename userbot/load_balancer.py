@@ -1,11 +1,13 @@
 """Балансировщик нагрузки между юзерботами"""
 import logging
-from typing import Optional, List, Dict
-from sqlalchemy import select, func
+from typing import Optional, List, Dict, Tuple
+from sqlalchemy import case, select, func, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database.models import Chat, User, Project
 from config import settings
+from userbot.chat_load import ChatLoadTracker
+from utils.cache import CacheService
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +26,49 @@ class UserbotLoadBalancer:
         """Получить список доступных юзерботов из конфига"""
         return settings.userbots_config
     
+    @staticmethod
+    async def count_load(session: AsyncSession) -> Dict[str, int]:
+        """
+        Нагрузка всех юзерботов одним сгруппированным запросом
+        
+        Returns:
+            {'userbot_1:chats': 15, 'userbot_1:users': 8, ...}
+        """
+        from database.models import chat_project_association
+        result = await session.execute(
+            select(
+                Chat.assigned_userbot,
+                func.count(func.distinct(Chat.id)),
+                func.count(func.distinct(Project.user_id))
+            )
+            .select_from(Chat)
+            .outerjoin(chat_project_association, Chat.id == chat_project_association.c.chat_id)
+            .outerjoin(Project, chat_project_association.c.project_id == Project.id)
+            .where(Chat.assigned_userbot.isnot(None))
+            .group_by(Chat.assigned_userbot)
+        )
+        
+        load = {}
+        for session_name, total_chats, active_users in result.all():
+            load[f"{session_name}:chats"] = total_chats
+            load[f"{session_name}:users"] = active_users
+        return load
+    
+    @staticmethod
+    async def get_load(session: AsyncSession, userbots: List[Dict]) -> Dict[str, int]:
+        """Нагрузка юзерботов из Redis; при отсутствии или неполном кэше - пересчёт"""
+        load = await CacheService.get_userbot_load()
+        if load is not None and all(f"{bot['session_name']}:users" in load for bot in userbots):
+            return load
+        
+        load = await UserbotLoadBalancer.count_load(session)
+        # Юзерботы без чатов - явные нули, иначе кэш считался бы неполным
+        for bot in userbots:
+            load.setdefault(f"{bot['session_name']}:chats", 0)
+            load.setdefault(f"{bot['session_name']}:users", 0)
+        await CacheService.set_userbot_load(load)
+        return load
+    
     @staticmethod
     async def get_userbot_stats(session: AsyncSession) -> List[Dict]:
         """
@@ -41,29 +86,17 @@ class UserbotLoadBalancer:
             ]
         """
         userbots = UserbotLoadBalancer.get_available_userbots()
+        if not userbots:
+            return []
+        
+        load = await UserbotLoadBalancer.get_load(session, userbots)
+        rates = await ChatLoadTracker.get_userbot_rates()
         stats = []
         
         for bot in userbots:
             session_name = bot['session_name']
-            
-            # Количество чатов, закрепленных за юзерботом
-            result = await session.execute(
-                select(func.count(Chat.id))
-                .where(Chat.assigned_userbot == session_name)
-            )
-            total_chats = result.scalar() or 0
-            
-            # Количество уникальных пользователей, чьи чаты мониторит этот юзербот
-            # (подсчет через проекты)
-            from database.models import chat_project_association
-            result = await session.execute(
-                select(func.count(func.distinct(Project.user_id)))
-                .select_from(Chat)
-                .join(chat_project_association, Chat.id == chat_project_association.c.chat_id)
-                .join(Project, chat_project_association.c.project_id == Project.id)
-                .where(Chat.assigned_userbot == session_name)
-            )
-            active_users = result.scalar() or 0
+            total_chats = max(load.get(f"{session_name}:chats", 0), 0)
+            active_users = load.get(f"{session_name}:users", 0)
             
             # Процент загрузки (по чатам)
             load_percent = (total_chats / UserbotLoadBalancer.MAX_CHATS_PER_USERBOT) * 100
@@ -74,11 +107,24 @@ class UserbotLoadBalancer:
                 'total_chats': total_chats,
                 'active_users': active_users,
                 'load_percent': load_percent,
-                'is_overloaded': total_chats >= UserbotLoadBalancer.MAX_CHATS_PER_USERBOT
+                'is_overloaded': total_chats >= UserbotLoadBalancer.MAX_CHATS_PER_USERBOT,
+                'messages_per_sec': max(rates.get(f"{session_name}:msgs", 0.0), 0.0),
+                'cpu_ms_per_sec': max(rates.get(f"{session_name}:cpu", 0.0), 0.0)
             })
         
         return stats
     
+    @staticmethod
+    def estimate_chat_rate(stats: List[Dict]) -> List[float]:
+        """Оценка нагрузки ещё не измеренного чата - средняя по всем чатам"""
+        total_chats = sum(bot['total_chats'] for bot in stats)
+        if not total_chats:
+            return [0.0, 0.0]
+        return [
+            sum(bot['messages_per_sec'] for bot in stats) / total_chats,
+            sum(bot['cpu_ms_per_sec'] for bot in stats) / total_chats
+        ]
+    
     @staticmethod
     async def assign_userbot_for_chat(session: AsyncSession, chat_id: int) -> Optional[str]:
         """
@@ -97,8 +143,28 @@ class UserbotLoadBalancer:
             logger.error("❌ Нет доступных юзерботов в конфигурации!")
             return None
         
-        # Сортируем по загруженности (от меньшей к большей)
-        stats.sort(key=lambda x: x['total_chats'])
+        result = await session.execute(
+            select(Chat.assigned_userbot, Chat.telegram_id).where(Chat.id == chat_id)
+        )
+        previous_bot, telegram_id = result.one_or_none() or (None, None)
+        
+        chat_rate = None
+        if settings.USERBOT_PLACEMENT_MODE == "load":
+            chat_rate = await ChatLoadTracker.get_chat_rate(telegram_id)
+            if chat_rate is None:
+                chat_rate = UserbotLoadBalancer.estimate_chat_rate(stats)
+            
+            # Прогноз: нагрузка юзербота вместе с этим чатом (у текущего владельца он уже учтён)
+            def projected_load(bot: Dict) -> tuple:
+                cpu = bot['cpu_ms_per_sec']
+                if bot['session_name'] != previous_bot:
+                    cpu += chat_rate[1]
+                return (bot['is_overloaded'], cpu, bot['total_chats'])
+            
+            stats.sort(key=projected_load)
+        else:
+            # Сортируем по загруженности (от меньшей к большей)
+            stats.sort(key=lambda x: x['total_chats'])
         
         # Выбираем наименее загруженный
         best_bot = stats[0]
@@ -110,64 +176,236 @@ class UserbotLoadBalancer:
             )
         
         # Обновляем чат
-        from sqlalchemy import update
-        await session.execute(
-            update(Chat)
-            .where(Chat.id == chat_id)
-            .values(assigned_userbot=best_bot['session_name'])
-        )
-        await session.commit()
+        if previous_bot != best_bot['session_name']:
+            # Новый юзербот должен вступить в чат при синхронизации
+            await session.execute(
+                update(Chat)
+                .where(Chat.id == chat_id)
+                .values(assigned_userbot=best_bot['session_name'], is_joined=False)
+            )
+            await session.commit()
+            await CacheService.move_userbot_chat(best_bot['session_name'], previous_bot)
+            if chat_rate is not None:
+                await ChatLoadTracker.move_chat(chat_rate, best_bot['session_name'], previous_bot)
         
         logger.info(
             f"✅ Чат #{chat_id} назначен юзерботу {best_bot['session_name']} "
-            f"(загрузка: {best_bot['total_chats']}/{UserbotLoadBalancer.MAX_CHATS_PER_USERBOT})"
+            f"(загрузка: {best_bot['total_chats']}/{UserbotLoadBalancer.MAX_CHATS_PER_USERBOT}, "
+            f"{best_bot['cpu_ms_per_sec']:.1f} мс CPU/сек)"
         )
         
         return best_bot['session_name']
     
     @staticmethod
-    async def rebalance_chats(session: AsyncSession):
+    def plan_rebalance(
+        chats: List[Tuple[int, Optional[str], float]],
+        userbots: List[str],
+        tolerance: float = 0.1
+    ) -> Dict[int, str]:
+        """
+        Минимальный набор переносов чатов для выравнивания нагрузки
+        
+        Args:
+            chats: (chat_id, текущий юзербот, вес чата)
+            userbots: доступные юзерботы
+            tolerance: допустимый разброс нагрузки (доля от средней)
+            
+        Returns:
+            {chat_id: новый юзербот} - только чаты, которые нужно перенести
+        """
+        if not userbots:
+            return {}
+        
+        loads = {bot: 0.0 for bot in userbots}
+        owned: Dict[str, Dict[int, float]] = {bot: {} for bot in userbots}
+        orphans = []
+        for chat_id, current_bot, weight in chats:
+            if current_bot in loads:
+                loads[current_bot] += weight
+                owned[current_bot][chat_id] = weight
+            else:
+                orphans.append((weight, chat_id))
+        
+        target: Dict[int, str] = {}
+        
+        # Чаты без юзербота (или с удалённым из конфига) переносим обязательно:
+        # тяжёлые первыми, каждый - наименее загруженному
+        for weight, chat_id in sorted(orphans, reverse=True):
+            bot = min(userbots, key=lambda b: loads[b])
+            loads[bot] += weight
+            owned[bot][chat_id] = weight
+            target[chat_id] = bot
+        
+        # Переносим по одному чату с самого загруженного на самый свободный,
+        # пока перенос сокращает разброс. Вес ближе всего к половине
+        # разницы выравнивает пару за минимум переносов.
+        average = sum(loads.values()) / len(userbots)
+        slack = tolerance * average if average else 0.0
+        for _ in range(len(chats)):
+            busiest = max(userbots, key=lambda b: loads[b])
+            idlest = min(userbots, key=lambda b: loads[b])
+            gap = loads[busiest] - loads[idlest]
+            if gap <= slack:
+                break
+            
+            candidates = [(chat_id, weight) for chat_id, weight in owned[busiest].items() if 0 < weight < gap]
+            if not candidates:
+                break
+            chat_id, weight = min(candidates, key=lambda item: abs(gap / 2 - item[1]))
+            
+            del owned[busiest][chat_id]
+            owned[idlest][chat_id] = weight
+            loads[busiest] -= weight
+            loads[idlest] += weight
+            target[chat_id] = idlest
+        
+        original = {chat_id: current_bot for chat_id, current_bot, _ in chats}
+        return {chat_id: bot for chat_id, bot in target.items() if original[chat_id] != bot}
+    
+    @staticmethod
+    async def rebalance_chats(session: AsyncSession, dry_run: bool = False) -> List[Dict]:
         """
         Перебалансировать чаты между юзерботами
         Используется когда добавляется новый юзербот или нужно оптимизировать распределение
+        
+        Переносится минимум чатов (каждый перенос - вступление в чат новым
+        юзерботом и риск FloodWait). Вес чата - измеренная нагрузка
+        (cpu-мс/сек), если она есть, иначе все чаты равны.
+        
+        Returns:
+            План переносов: [{'chat_id', 'title', 'from', 'to'}, ...]
         """
         logger.info("🔄 Запуск ребалансировки чатов...")
         
-        userbots = UserbotLoadBalancer.get_available_userbots()
+        userbots = [bot['session_name'] for bot in UserbotLoadBalancer.get_available_userbots()]
         if not userbots:
             logger.error("❌ Нет доступных юзерботов!")
-            return
+            return []
         
-        # Получаем все активные чаты
-        result = await session.execute(
-            select(Chat).where(Chat.is_active == True)
+        chats, weights, measured = await UserbotLoadBalancer.get_weighted_chats(session)
+        plan = UserbotLoadBalancer.plan_rebalance(
+            [(chat.id, chat.assigned_userbot, weights[chat.id]) for chat in chats],
+            userbots
         )
-        chats = list(result.scalars().all())
-        
-        total_chats = len(chats)
-        chats_per_bot = total_chats // len(userbots)
         
         logger.info(
-            f"📊 Всего чатов: {total_chats}, "
+            f"📊 Всего чатов: {len(chats)}, "
             f"Юзерботов: {len(userbots)}, "
-            f"Чатов на бота: ~{chats_per_bot}"
+            f"Переносов: {len(plan)} "
+            f"(вес: {'нагрузка' if measured else 'число чатов'})"
         )
         
-        # Распределяем чаты равномерно
-        for idx, chat in enumerate(chats):
-            userbot_idx = idx % len(userbots)
-            assigned_bot = userbots[userbot_idx]['session_name']
-            
-            if chat.assigned_userbot != assigned_bot:
-                from sqlalchemy import update
-                await session.execute(
-                    update(Chat)
-                    .where(Chat.id == chat.id)
-                    .values(assigned_userbot=assigned_bot)
-                )
+        moves = [
+            {'chat_id': chat.id, 'title': chat.title, 'from': chat.assigned_userbot, 'to': plan[chat.id]}
+            for chat in chats if chat.id in plan
+        ]
+        
+        if not dry_run:
+            await UserbotLoadBalancer.apply_moves(session, plan)
+            logger.info("✅ Ребалансировка завершена!")
+        return moves
+    
+    @staticmethod
+    async def fail_over(session: AsyncSession, healthy_userbots: List[str]) -> List[Dict]:
+        """
+        Перенести активные чаты недоступных юзерботов на живые
         
+        Переносятся только чаты юзерботов не из healthy_userbots - каждый
+        на наименее загруженный живой юзербот (с учётом веса чата).
+        
+        Returns:
+            Выполненные переносы: [{'chat_id', 'title', 'from', 'to'}, ...]
+        """
+        if not healthy_userbots:
+            return []
+        
+        chats, weights, _ = await UserbotLoadBalancer.get_weighted_chats(session)
+        # Бесконечный допуск - только размещение «осиротевших» чатов, без выравнивания живых
+        plan = UserbotLoadBalancer.plan_rebalance(
+            [(chat.id, chat.assigned_userbot, weights[chat.id]) for chat in chats],
+            healthy_userbots,
+            tolerance=float('inf')
+        )
+        # Чаты без юзербота забирают сами юзерботы (ChatCRUD.claim_unassigned)
+        plan = {
+            chat.id: plan[chat.id] for chat in chats
+            if chat.id in plan and chat.assigned_userbot is not None
+        }
+        
+        await UserbotLoadBalancer.apply_moves(session, plan)
+        return [
+            {'chat_id': chat.id, 'title': chat.title, 'from': chat.assigned_userbot, 'to': plan[chat.id]}
+            for chat in chats if chat.id in plan
+        ]
+    
+    @staticmethod
+    async def reclaim_chats(session: AsyncSession, session_name: str, chat_ids: List[int]) -> int:
+        """Вернуть юзерботу его чаты, перенесённые на время недоступности (с повторным вступлением)"""
+        if not chat_ids:
+            return 0
+        
+        result = await session.execute(
+            update(Chat)
+            .where(
+                Chat.id.in_(chat_ids),
+                Chat.is_active == True,
+                Chat.assigned_userbot != session_name
+            )
+            .values(assigned_userbot=session_name, is_joined=False)
+        )
+        await session.commit()
+        
+        if result.rowcount:
+            await CacheService.invalidate_userbot_load()
+            await CacheService.publish_reload_chats()
+        return result.rowcount
+    
+    @staticmethod
+    async def get_weighted_chats(session: AsyncSession) -> Tuple[list, Dict[int, float], bool]:
+        """
+        Активные чаты и их веса для ребалансировки
+        
+        Вес - измеренный CPU чата; неизмеренным - среднее по измеренным.
+        Если измерений нет, все веса равны 1 (баланс по числу чатов).
+        
+        Returns:
+            (чаты, {chat_id: вес}, есть ли измерения)
+        """
+        result = await session.execute(
+            select(Chat.id, Chat.telegram_id, Chat.title, Chat.assigned_userbot)
+            .where(Chat.is_active == True)
+        )
+        chats = result.all()
+        
+        rates = await ChatLoadTracker.get_chat_rates(chat.telegram_id for chat in chats)
+        measured = [rate[1] for rate in rates.values() if rate[1] > 0]
+        default_weight = sum(measured) / len(measured) if measured else 1.0
+        
+        weights = {}
+        for chat in chats:
+            rate = rates.get(chat.telegram_id)
+            weights[chat.id] = rate[1] if measured and rate and rate[1] > 0 else default_weight
+        return chats, weights, bool(measured)
+    
+    @staticmethod
+    async def apply_moves(session: AsyncSession, plan: Dict[int, str]):
+        """
+        Применить переносы одним UPDATE и разослать юзерботам сигнал перезагрузки
+        
+        is_joined сбрасывается: новый юзербот вступает в чат при синхронизации,
+        иначе он не получал бы из него сообщений.
+        """
+        if not plan:
+            return
+        
+        await session.execute(
+            update(Chat)
+            .where(Chat.id.in_(list(plan)))
+            .values(assigned_userbot=case(plan, value=Chat.id), is_joined=False)
+        )
         await session.commit()
-        logger.info("✅ Ребалансировка завершена!")
+        await CacheService.invalidate_userbot_load()
+        await CacheService.publish_reload_chats()
     
     @staticmethod
     async def get_user_userbot(session: AsyncSession, user_id: int) -> Optional[str]:
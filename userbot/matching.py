@@ -1,9 +1,373 @@
 """Движок для мониторинга сообщений (матчинг)"""
 import re
-from typing import List, Dict, Set
+from collections import deque
+from functools import lru_cache
+from typing import Any, List, Dict, Set, Tuple
 from database.models import Keyword, KeywordType
 
 
+class KeywordAutomaton:
+    """
+    Автомат Ахо-Корасик для поиска множества подстрок за один проход
+
+    Паттерны добавляются через add(), затем автомат собирается через build().
+    Каждому паттерну можно привязать произвольное значение (payload) -
+    search() вернёт значения всех паттернов, встретившихся в тексте.
+    Семантика совпадает с `pattern in text` (частичное совпадение).
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+        self._payloads: List[List[Any]] = []
+        self._pattern_ids: Dict[str, int] = {}
+        self._built = False
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def add(self, pattern: str, payload: Any) -> None:
+        """Добавить паттерн (уже нормализованный) с привязанным значением"""
+        pattern_id = self._pattern_ids.get(pattern)
+        if pattern_id is not None:
+            # Дубликат паттерна - просто добавляем ещё одно значение
+            self._payloads[pattern_id].append(payload)
+            return
+
+        pattern_id = len(self._payloads)
+        self._pattern_ids[pattern] = pattern_id
+        self._payloads.append([payload])
+
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = next_state
+        self._out[state] = self._out[state] + (pattern_id,)
+        self._built = False
+
+    def build(self) -> 'KeywordAutomaton':
+        """Построить fail-ссылки (BFS) и объединить выходы по цепочке fail"""
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = deque()
+
+        for state in goto[0].values():
+            fail[state] = 0
+            queue.append(state)
+
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0)
+                if fail[next_state] == next_state:
+                    fail[next_state] = 0
+                # Выходы наследуются от fail-состояния, чтобы при поиске
+                # не ходить по output-ссылкам
+                out[next_state] = out[next_state] + out[fail[next_state]]
+
+        self._built = True
+        return self
+
+    def search_ids(self, text: str) -> Set[int]:
+        """Найти ID всех паттернов, встречающихся в тексте"""
+        if not self._built:
+            self.build()
+
+        goto, fail, out = self._goto, self._fail, self._out
+        # Пустой паттерн совпадает с любым текстом (как `'' in text`)
+        found: Set[int] = set(out[0])
+        state = 0
+
+        for char in text:
+            transitions = goto[state]
+            while char not in transitions and state:
+                state = fail[state]
+                transitions = goto[state]
+            state = transitions.get(char, 0)
+            if out[state]:
+                found.update(out[state])
+
+        return found
+
+    def search(self, text: str) -> List[Any]:
+        """Найти значения всех паттернов, встречающихся в тексте"""
+        return [
+            payload
+            for pattern_id in self.search_ids(text)
+            for payload in self._payloads[pattern_id]
+        ]
+
+
+class KeywordMatcher:
+    """
+    Скомпилированный набор ключевых и исключающих слов проекта
+
+    Собирается один раз на набор слов и за один проход по тексту
+    находит все совпадения ключевых и исключающих слов.
+    """
+
+    INCLUDE = 'include'
+    EXCLUDE = 'exclude'
+
+    def __init__(self, include_keywords: List[Keyword], exclude_keywords: List[Keyword]):
+        self.include_keywords = list(include_keywords)
+        self.exclude_keywords = list(exclude_keywords)
+        self.automaton = KeywordAutomaton()
+
+        for index, keyword in enumerate(self.include_keywords):
+            self.automaton.add(keyword.text.lower(), (self.INCLUDE, index))
+        for index, keyword in enumerate(self.exclude_keywords):
+            self.automaton.add(keyword.text.lower(), (self.EXCLUDE, index))
+
+        self.automaton.build()
+
+    def scan(self, text: str) -> Tuple[List[Keyword], List[Keyword]]:
+        """
+        Поиск всех совпадений в тексте за один проход
+
+        Args:
+            text: Текст сообщения (нормализуется внутри)
+
+        Returns:
+            (найденные ключевые слова, найденные исключающие слова)
+            в порядке исходных списков
+        """
+        normalized_text = MatchingEngine.normalize_text(text)
+        include_idx = []
+        exclude_idx = []
+
+        for kind, index in self.automaton.search(normalized_text):
+            if kind == self.INCLUDE:
+                include_idx.append(index)
+            else:
+                exclude_idx.append(index)
+
+        return (
+            [self.include_keywords[i] for i in sorted(include_idx)],
+            [self.exclude_keywords[i] for i in sorted(exclude_idx)],
+        )
+
+
+_WORD_RE = re.compile(r'\w+')
+
+
+class FilterSyntaxError(ValueError):
+    """Ошибка синтаксиса логического фильтра"""
+
+
+class FilterContext:
+    """
+    Данные сообщения для проверки фильтров
+
+    Нормализованный текст и множество слов считаются один раз на сообщение
+    и переиспользуются всеми фильтрами всех проектов чата.
+    """
+
+    __slots__ = ('text', '_tokens')
+
+    def __init__(self, normalized_text: str):
+        self.text = normalized_text
+        self._tokens = None
+
+    @property
+    def tokens(self) -> frozenset:
+        if self._tokens is None:
+            self._tokens = frozenset(_WORD_RE.findall(self.text))
+        return self._tokens
+
+
+class CompiledFilter:
+    """
+    Скомпилированный логический фильтр
+
+    Синтаксис (по убыванию приоритета):
+    - ( ... )  - группировка
+    - !слово   - отрицание
+    - а | б    - ИЛИ
+    - а + б    - И
+
+    `|` связывает сильнее `+`: "купить + квартиру | дом" означает
+    "купить И (квартиру ИЛИ дом)". Слова ищутся целиком (как \\bслово\\b).
+    """
+
+    _OPERATORS = '+|!()'
+
+    def __init__(self, logic_string: str):
+        self.logic_string = logic_string
+        self._tokens = self._tokenize(logic_string)
+        self._pos = 0
+        self.words: List[str] = []
+
+        if not self._tokens:
+            raise FilterSyntaxError('Пустой фильтр')
+
+        self._evaluate = self._parse_and()
+        if self._pos != len(self._tokens):
+            raise FilterSyntaxError(f"Лишний символ: '{self._tokens[self._pos]}'")
+
+    def __repr__(self):
+        return f"<CompiledFilter {self.logic_string!r}>"
+
+    def evaluate(self, context: FilterContext) -> bool:
+        """Проверить сообщение по фильтру"""
+        return self._evaluate(context)
+
+    # === Разбор выражения ===
+
+    @classmethod
+    def _tokenize(cls, logic_string: str) -> List[str]:
+        tokens = []
+        word = []
+        for char in logic_string:
+            if char in cls._OPERATORS:
+                term = ''.join(word).strip()
+                if term:
+                    tokens.append(term)
+                word = []
+                tokens.append(char)
+            else:
+                word.append(char)
+        term = ''.join(word).strip()
+        if term:
+            tokens.append(term)
+        return tokens
+
+    def _peek(self) -> str:
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else ''
+
+    def _take(self) -> str:
+        token = self._peek()
+        self._pos += 1
+        return token
+
+    def _parse_and(self):
+        operands = [self._parse_or()]
+        while self._peek() == '+':
+            self._take()
+            operands.append(self._parse_or())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda ctx: all(operand(ctx) for operand in operands)
+
+    def _parse_or(self):
+        operands = [self._parse_unary()]
+        while self._peek() == '|':
+            self._take()
+            operands.append(self._parse_unary())
+        if len(operands) == 1:
+            return operands[0]
+        return lambda ctx: any(operand(ctx) for operand in operands)
+
+    def _parse_unary(self):
+        token = self._take()
+
+        if token == '!':
+            operand = self._parse_unary()
+            return lambda ctx: not operand(ctx)
+
+        if token == '(':
+            node = self._parse_and()
+            if self._take() != ')':
+                raise FilterSyntaxError('Не закрыта скобка')
+            return node
+
+        if not token or token in self._OPERATORS:
+            raise FilterSyntaxError(f"Ожидалось слово, получено: '{token or 'конец строки'}'")
+
+        return self._compile_term(token.lower())
+
+    def _compile_term(self, term: str):
+        self.words.append(term)
+
+        # Одно слово - проверка по множеству слов сообщения
+        if _WORD_RE.fullmatch(term):
+            return lambda ctx: term in ctx.tokens
+
+        # Фраза или слово со спецсимволами - регулярка (скомпилирована один раз)
+        pattern = re.compile(r'\b' + re.escape(term) + r'\b')
+        return lambda ctx: pattern.search(ctx.text) is not None
+
+
+class ChatMatchIndex:
+    """
+    Объединённый автомат всех проектов, мониторящих один чат
+
+    Каждый паттерн помечен ID проекта, поэтому один проход по сообщению
+    даёт полный список совпавших проектов с их ключевыми словами.
+    """
+
+    def __init__(
+        self,
+        project_keywords: Dict[int, Tuple[List[Keyword], List[Keyword]]],
+        project_filters: Dict[int, List['CompiledFilter']] = None
+    ):
+        """
+        Args:
+            project_keywords: {project_id: (ключевые слова, исключающие слова)}
+            project_filters: {project_id: скомпилированные фильтры} (все должны пройти)
+        """
+        self.project_keywords = dict(project_keywords)
+        self.project_filters = {
+            project_id: filters
+            for project_id, filters in (project_filters or {}).items()
+            if filters
+        }
+        self.project_ids = frozenset(self.project_keywords)
+        self.automaton = KeywordAutomaton()
+
+        for project_id, (include_keywords, exclude_keywords) in self.project_keywords.items():
+            for index, keyword in enumerate(include_keywords):
+                self.automaton.add(keyword.text.lower(), (project_id, KeywordMatcher.INCLUDE, index))
+            for index, keyword in enumerate(exclude_keywords):
+                self.automaton.add(keyword.text.lower(), (project_id, KeywordMatcher.EXCLUDE, index))
+
+        self.automaton.build()
+
+    def scan(self, text: str) -> Dict[int, List[Keyword]]:
+        """
+        Поиск совпадений для всех проектов чата за один проход
+
+        Args:
+            text: Текст сообщения (нормализуется внутри)
+
+        Returns:
+            {project_id: найденные ключевые слова} - только для проектов,
+            у которых есть ключевые слова, нет исключающих и прошли фильтры
+        """
+        normalized_text = MatchingEngine.normalize_text(text)
+        context = FilterContext(normalized_text)
+        included: Dict[int, List[int]] = {}
+        excluded: Set[int] = set()
+
+        for project_id, kind, index in self.automaton.search(normalized_text):
+            if kind == KeywordMatcher.INCLUDE:
+                included.setdefault(project_id, []).append(index)
+            else:
+                excluded.add(project_id)
+
+        matches = {}
+        for project_id, indexes in included.items():
+            if project_id in excluded:
+                continue
+            filters = self.project_filters.get(project_id)
+            if filters and not all(f.evaluate(context) for f in filters):
+                continue
+            include_keywords = self.project_keywords[project_id][0]
+            matches[project_id] = [include_keywords[i] for i in sorted(indexes)]
+
+        return matches
+
+
 class MatchingEngine:
     """Движок для проверки совпадений в тексте"""
     
@@ -64,6 +428,17 @@ class MatchingEngine:
         
         return False
     
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def compile_filter(logic_string: str) -> CompiledFilter:
+        """
+        Скомпилировать логический фильтр (результат кэшируется по строке)
+        
+        Raises:
+            FilterSyntaxError: если фильтр записан с ошибкой
+        """
+        return CompiledFilter(logic_string)
+    
     @staticmethod
     def parse_filter(filter_string: str) -> Dict:
         """
@@ -80,10 +455,7 @@ class MatchingEngine:
         Returns:
             Словарь с распарсенным фильтром
         """
-        # TODO: Реализация парсинга сложных фильтров
-        # Пока упрощенная версия
-        
-        if '+' in filter_string and '|' in filter_string:
+        if any(op in filter_string for op in '!()') or ('+' in filter_string and '|' in filter_string):
             # Комбинированный фильтр
             return {'type': 'complex', 'filter': filter_string}
         elif '+' in filter_string:
@@ -135,17 +507,29 @@ class MatchingEngine:
             return False
         
         elif filter_type == 'complex':
-            # TODO: Реализация сложных фильтров
-            return True
+            try:
+                compiled = MatchingEngine.compile_filter(filter_dict['filter'])
+            except FilterSyntaxError:
+                return True  # Некорректный фильтр не блокирует сообщение
+            return compiled.evaluate(FilterContext(normalized_text))
         
         return False
     
+    @staticmethod
+    def compile_keywords(
+        include_keywords: List[Keyword],
+        exclude_keywords: List[Keyword]
+    ) -> KeywordMatcher:
+        """Собрать автомат для набора ключевых и исключающих слов"""
+        return KeywordMatcher(include_keywords, exclude_keywords)
+    
     @staticmethod
     def process_message(
         text: str,
         include_keywords: List[Keyword],
         exclude_keywords: List[Keyword],
-        filters: List = None
+        filters: List = None,
+        matcher: KeywordMatcher = None
     ) -> Dict:
         """
         Полная обработка сообщения
@@ -154,13 +538,21 @@ class MatchingEngine:
             text: Текст сообщения
             include_keywords: Ключевые слова для поиска
             exclude_keywords: Исключающие слова
-            filters: Логические фильтры
+            filters: Логические фильтры (Filter или CompiledFilter)
+            matcher: Скомпилированный автомат (если есть - один проход по тексту)
             
         Returns:
             Словарь с результатом: {'matched': bool, 'keywords': List, 'reason': str}
         """
+        if matcher is not None:
+            found_keywords, found_exclude = matcher.scan(text)
+            is_excluded = bool(found_exclude)
+        else:
+            found_keywords = None
+            is_excluded = bool(exclude_keywords) and MatchingEngine.check_exclude_words(text, exclude_keywords)
+        
         # 1. Проверка исключающих слов
-        if exclude_keywords and MatchingEngine.check_exclude_words(text, exclude_keywords):
+        if is_excluded:
             return {
                 'matched': False,
                 'keywords': [],
@@ -168,7 +560,8 @@ class MatchingEngine:
             }
         
         # 2. Проверка ключевых слов
-        found_keywords = MatchingEngine.check_keywords(text, include_keywords)
+        if found_keywords is None:
+            found_keywords = MatchingEngine.check_keywords(text, include_keywords)
         
         if not found_keywords:
             return {
@@ -179,9 +572,16 @@ class MatchingEngine:
         
         # 3. Проверка фильтров (если есть)
         if filters:
+            context = FilterContext(MatchingEngine.normalize_text(text))
             for filter_obj in filters:
-                filter_dict = MatchingEngine.parse_filter(filter_obj.logic_string)
-                if not MatchingEngine.check_filter(text, filter_dict):
+                if isinstance(filter_obj, CompiledFilter):
+                    compiled = filter_obj
+                else:
+                    try:
+                        compiled = MatchingEngine.compile_filter(filter_obj.logic_string)
+                    except FilterSyntaxError:
+                        continue  # Некорректный фильтр не блокирует сообщение
+                if not compiled.evaluate(context):
                     return {
                         'matched': False,
                         'keywords': found_keywords,
@@ -0,0 +1,176 @@
+"""Локальный пред-классификатор лидов: отсекает очевидные случаи до вызова LLM"""
+import logging
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Фразы клиента, который ИЩЕТ услугу
+SEEK_PHRASES = [
+    'ищу', 'ищем', 'нужен', 'нужна', 'нужно', 'нужны', 'требуется', 'требуются',
+    'подскажите', 'посоветуйте', 'порекомендуйте', 'помогите', 'кто может',
+    'кто делает', 'кто занимается', 'кто знает', 'где найти', 'где можно',
+    'сколько стоит', 'сколько будет стоить', 'есть ли кто', 'может кто',
+    'хочу заказать', 'хочу купить', 'кто оформлял', 'кто сталкивался',
+    'looking for', 'need', 'recommend', 'anyone know', 'can anyone',
+]
+
+# Фразы исполнителя/рекламы (конкуренты, спам)
+OFFER_PHRASES = [
+    'предлагаю', 'предлагаем', 'делаю', 'делаем', 'оказываю', 'оказываем',
+    'наши услуги', 'мои услуги', 'услуги по', 'выполню', 'выполняем', 'помогу',
+    'поможем', 'обращайтесь', 'пишите в лс', 'пишите в личку', 'пишите в личные',
+    'пиши в лс', 'в директ', 'скидка', 'скидки', 'акция', 'прайс', 'гарантия',
+    'гарантируем', 'без предоплаты', 'опыт работы', 'лет опыта', 'подписывайтесь',
+    'наш канал', 'переходи', 'заработок', 'пассивный доход', 'от 1000', 'доход от',
+    'we offer', 'dm me', 'contact us',
+]
+
+# Глаголы исполнителя от первого лица: сами по себе - уверенное предложение
+STRONG_OFFER_PHRASES = [
+    'предлагаю', 'предлагаем', 'делаю', 'делаем', 'оказываю', 'оказываем',
+    'выполню', 'выполняем', 'помогу', 'поможем', 'наши услуги', 'мои услуги',
+]
+
+_LINK_RE = re.compile(r'(https?://|www\.|t\.me/|@[A-Za-z0-9_]{5,})', re.IGNORECASE)
+_EMOJI_RE = re.compile(
+    '[\U0001F300-\U0001FAFF\U00002600-\U000027BF\U0001F000-\U0001F2FF\U00002B00-\U00002BFF]'
+)
+
+
+def _phrase_pattern(phrases: List[str]) -> re.Pattern:
+    """Одна регулярка на весь словарь (фразы - целыми словами)"""
+    alternatives = sorted((re.escape(phrase) for phrase in phrases), key=len, reverse=True)
+    return re.compile(r'(?<!\w)(?:' + '|'.join(alternatives) + r')(?!\w)', re.IGNORECASE)
+
+
+class LeadPreclassifier:
+    """
+    Дешёвая оценка сообщения до LLM
+
+    Складывает признаки в один score:
+    + фразы поиска, вопрос
+    - фразы предложения, ссылки, плотность эмодзи, длина «простыни»,
+      повторные сообщения одного отправителя
+
+    score <= negative_threshold - уверенный не-лид (глагол исполнителя без
+    фраз поиска добирает до порога сам),
+    score >= positive_threshold, минимум MIN_SEEK_HITS фраз поиска и без
+    признаков рекламы - уверенный лид (одно «нужна ли ...?» - ещё не лид),
+    иначе решение за LLM (classify возвращает None).
+    """
+
+    # Окно учёта повторных сообщений отправителя
+    SENDER_WINDOW = 3600
+    SENDER_REPEAT_LIMIT = 5
+
+    # Фраз поиска для уверенного лида без LLM
+    MIN_SEEK_HITS = 2
+
+    def __init__(self, negative_threshold: float = -3.0, positive_threshold: float = 4.0):
+        self.negative_threshold = negative_threshold
+        self.positive_threshold = positive_threshold
+
+        self._seek_re = _phrase_pattern(SEEK_PHRASES)
+        self._offer_re = _phrase_pattern(OFFER_PHRASES)
+        self._strong_offer_re = _phrase_pattern(STRONG_OFFER_PHRASES)
+        self._senders: Dict[int, Deque[float]] = {}
+
+    def observe_sender(self, sender_id: Optional[int]) -> int:
+        """Учесть сообщение отправителя; вернуть число его сообщений за окно"""
+        if sender_id is None:
+            return 0
+
+        now = time.monotonic()
+        history = self._senders.setdefault(sender_id, deque())
+        history.append(now)
+        while history and now - history[0] > self.SENDER_WINDOW:
+            history.popleft()
+
+        # Периодически чистим отправителей без свежих сообщений
+        if len(self._senders) > 50000:
+            self._senders = {
+                sid: times for sid, times in self._senders.items()
+                if times and now - times[-1] <= self.SENDER_WINDOW
+            }
+        return len(history)
+
+    def score(self, text: str, sender_messages: int = 0) -> Dict[str, Any]:
+        """Признаки и итоговый score сообщения"""
+        seek_hits = len(self._seek_re.findall(text))
+        offer_hits = len(self._offer_re.findall(text))
+        strong_offer = bool(self._strong_offer_re.search(text))
+        links = len(_LINK_RE.findall(text))
+        emojis = len(_EMOJI_RE.findall(text))
+        length = len(text)
+        emoji_density = emojis / max(length, 1)
+        lines = text.count('\n') + 1
+
+        score = 0.0
+        score += 2.0 * min(seek_hits, 3)
+        score += 1.0 if '?' in text else 0.0
+        score -= 2.5 * min(offer_hits, 4)
+        if strong_offer and not seek_hits:
+            score -= 1.0
+        score -= 1.5 * min(links, 4)
+        if emoji_density > 0.03:
+            score -= 2.0
+        if emojis >= 10:
+            score -= 1.0
+        if length > 600 or lines > 12:
+            score -= 2.0
+        elif length < 200 and seek_hits:
+            score += 1.0
+        if sender_messages > self.SENDER_REPEAT_LIMIT:
+            score -= 2.0
+
+        return {
+            'score': score,
+            'seek_hits': seek_hits,
+            'offer_hits': offer_hits,
+            'strong_offer': strong_offer,
+            'links': links,
+            'emojis': emojis,
+            'length': length,
+            'sender_messages': sender_messages,
+        }
+
+    def classify(self, text: str, sender_messages: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        Вердикт в формате validate_lead_intent или None (неоднозначно - нужен LLM)
+        """
+        features = self.score(text, sender_messages)
+        score = features['score']
+
+        if score <= self.negative_threshold:
+            metrics.incr('preclassifier.negative')
+            spam = features['links'] or features['emojis'] >= 10 or features['sender_messages'] > self.SENDER_REPEAT_LIMIT
+            return {
+                'is_lead': False,
+                'confidence': 0.8,
+                'intent': 'spam' if spam and not features['offer_hits'] else 'offering',
+                'reason': f"Локальный фильтр: score={score:.1f}, предложения={features['offer_hits']}, "
+                          f"ссылки={features['links']}, эмодзи={features['emojis']}",
+            }
+
+        if (
+            score >= self.positive_threshold
+            and features['seek_hits'] >= self.MIN_SEEK_HITS
+            and not features['offer_hits']
+            and not features['links']
+        ):
+            metrics.incr('preclassifier.positive')
+            return {
+                'is_lead': True,
+                'confidence': 0.7,
+                'intent': 'searching',
+                'reason': f"Локальный фильтр: score={score:.1f}, фразы поиска={features['seek_hits']}",
+            }
+
+        metrics.incr('preclassifier.ambiguous')
+        return None
@@ -0,0 +1,90 @@
+"""In-memory таблица маршрутизации: чат -> проекты -> пользователи"""
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from database.models import Chat, Project, User
+
+
+class UserRoute:
+    """Облегчённая запись пользователя (только то, что нужно воркеру)"""
+
+    __slots__ = ('id', 'telegram_id', 'notification_mode')
+
+    def __init__(self, user: User):
+        self.id = user.id
+        self.telegram_id = user.telegram_id
+        self.notification_mode = user.notification_mode
+
+
+class ProjectRoute:
+    """Облегчённая запись проекта"""
+
+    __slots__ = ('id', 'user_id', 'name', 'user')
+
+    def __init__(self, project: Project):
+        self.id = project.id
+        self.user_id = project.user_id
+        self.name = project.name
+        self.user = UserRoute(project.user)
+
+
+class ChatRoute:
+    """Облегчённая запись чата со списком проектов, которые его мониторят"""
+
+    __slots__ = ('id', 'telegram_id', 'telegram_link', 'title', 'projects')
+
+    def __init__(self, chat: Chat):
+        self.id = chat.id
+        self.telegram_id = chat.telegram_id
+        self.telegram_link = chat.telegram_link
+        self.title = chat.title
+        self.projects: List[ProjectRoute] = [ProjectRoute(project) for project in chat.projects]
+
+
+class ChatRoutingTable:
+    """
+    Таблица normalized chat_id -> ChatRoute
+
+    Строится из БД при загрузке чатов и обновляется по сигналу reload_chats,
+    чтобы обработка сообщений не ходила в Postgres.
+    """
+
+    def __init__(self):
+        self._routes: Dict[int, ChatRoute] = {}
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def __contains__(self, telegram_id: int) -> bool:
+        return telegram_id in self._routes
+
+    def __iter__(self) -> Iterator[ChatRoute]:
+        return iter(self._routes.values())
+
+    def get(self, telegram_id: int) -> Optional[ChatRoute]:
+        """Маршрут чата по нормализованному telegram_id"""
+        return self._routes.get(telegram_id)
+
+    def replace(self, chats: Iterable[Chat]):
+        """Атомарно заменить таблицу (chats загружены с projects и project.user)"""
+        self._routes = {
+            chat.telegram_id: ChatRoute(chat)
+            for chat in chats
+            if chat.telegram_id
+        }
+
+    def set_notification_mode(self, user_id: int, mode: str) -> int:
+        """Обновить режим уведомлений пользователя во всех маршрутах"""
+        updated = 0
+        for route in self._routes.values():
+            for project in route.projects:
+                if project.user.id == user_id:
+                    project.user.notification_mode = mode
+                    updated += 1
+        return updated
+
+    def chats_for_project(self, project_id: int) -> List[ChatRoute]:
+        """Мониторируемые чаты проекта"""
+        return [
+            route for route in self
+            if any(project.id == project_id for project in route.projects)
+        ]
@@ -0,0 +1,154 @@
+"""Аренды юзерботов (heartbeat) и перенос чатов недоступных юзерботов"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import List
+
+from config import settings
+from database.database import async_session_maker
+from userbot.load_balancer import UserbotLoadBalancer
+from utils.cache import CacheKeys, get_redis
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class UserbotSupervisor:
+    """
+    Контроль живости юзерботов
+
+    - живой юзербот раз в lease_ttl/3 секунд продлевает аренду в Redis;
+      без соединения или в долгом FloodWait - не продлевает
+    - супервизор (один на кластер благодаря блокировке в Redis) находит
+      юзерботы с истёкшей арендой и переносит их активные чаты на живые;
+      перенесённые ID запоминаются в CacheKeys.userbot_failover
+    - вернувшийся юзербот забирает свои чаты обратно
+    """
+
+    # Сколько хранить список перенесённых чатов недоступного юзербота
+    FAILOVER_TTL = 7 * 24 * 3600
+
+    def __init__(self, lease_ttl: int = 60, interval: int = 30, flood_threshold: int = 900):
+        self.lease_ttl = max(3, lease_ttl)
+        self.interval = interval
+        self.flood_threshold = flood_threshold
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._started_at = time.monotonic()
+
+    @classmethod
+    def from_settings(cls) -> 'UserbotSupervisor':
+        return cls(
+            lease_ttl=settings.USERBOT_LEASE_TTL,
+            interval=settings.USERBOT_SUPERVISOR_INTERVAL,
+            flood_threshold=settings.USERBOT_FLOOD_FAILOVER
+        )
+
+    def is_healthy(self, worker) -> bool:
+        """Юзербот может мониторить свои чаты"""
+        if worker.client is None or not worker.client.is_connected():
+            return False
+        return worker.flood_until - time.monotonic() < self.flood_threshold
+
+    async def renew_lease(self, worker) -> bool:
+        """Продлить аренду юзербота и забрать его перенесённые чаты (False - нездоров)"""
+        if not self.is_healthy(worker):
+            return False
+
+        redis = await get_redis()
+        await redis.set(CacheKeys.userbot_lease(worker.session_name), self.owner, ex=self.lease_ttl)
+        await self.reclaim(worker.session_name)
+        return True
+
+    async def keep_lease(self, worker):
+        """Цикл heartbeat юзербота"""
+        was_healthy = True
+        while True:
+            try:
+                await asyncio.sleep(self.lease_ttl / 3)
+                healthy = await self.renew_lease(worker)
+                if was_healthy and not healthy:
+                    logger.warning(f"💔 {worker.session_name}: аренда не продлевается (нет соединения или FloodWait)")
+                elif healthy and not was_healthy:
+                    logger.info(f"💚 {worker.session_name}: аренда снова продлевается")
+                was_healthy = healthy
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка продления аренды {worker.session_name}: {e}")
+
+    async def reclaim(self, session_name: str) -> int:
+        """Вернуть юзерботу чаты, перенесённые на время его недоступности"""
+        redis = await get_redis()
+        key = CacheKeys.userbot_failover(session_name)
+        chat_ids = [int(chat_id) for chat_id in await redis.smembers(key)]
+        if not chat_ids:
+            return 0
+
+        async with async_session_maker() as session:
+            reclaimed = await UserbotLoadBalancer.reclaim_chats(session, session_name, chat_ids)
+        await redis.srem(key, *chat_ids)
+
+        if reclaimed:
+            metrics.incr('userbot.reclaimed_chats', reclaimed)
+            logger.info(f"🔙 {session_name}: возвращено {reclaimed} чатов после восстановления")
+        return reclaimed
+
+    async def run(self):
+        """Цикл супервизора (в каждом процессе юзерботов; действует один)"""
+        while True:
+            try:
+                await asyncio.sleep(self.interval)
+                # Дадим юзерботам кластера запуститься и взять аренду
+                if time.monotonic() - self._started_at < self.lease_ttl:
+                    continue
+                await self.check_leases()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка супервизора юзерботов: {e}")
+
+    async def check_leases(self) -> int:
+        """Перенести чаты юзерботов с истёкшей арендой (возвращает число переносов)"""
+        redis = await get_redis()
+        if not await redis.set(CacheKeys.userbot_supervisor_lock(), self.owner, nx=True, ex=self.interval):
+            return 0
+
+        userbots = [bot['session_name'] for bot in settings.userbots_config]
+        if not userbots:
+            return 0
+        leases = await redis.mget([CacheKeys.userbot_lease(name) for name in userbots])
+        healthy: List[str] = [name for name, lease in zip(userbots, leases) if lease is not None]
+        metrics.gauge('userbot.healthy', len(healthy))
+
+        if not healthy:
+            logger.error("❌ Нет ни одного живого юзербота - переносить чаты некуда")
+            return 0
+        if len(healthy) == len(userbots):
+            return 0
+
+        async with async_session_maker() as session:
+            moves = await UserbotLoadBalancer.fail_over(session, healthy)
+        if not moves:
+            return 0
+
+        # Запоминаем, чьи чаты перенесли, - вернувшийся юзербот их заберёт
+        async with redis.pipeline(transaction=False) as pipe:
+            for move in moves:
+                key = CacheKeys.userbot_failover(move['from'])
+                pipe.sadd(key, move['chat_id'])
+                pipe.expire(key, self.FAILOVER_TTL)
+            await pipe.execute()
+
+        dead = sorted({move['from'] for move in moves})
+        metrics.incr('userbot.failover_chats', len(moves))
+        logger.warning(
+            f"🚑 Юзерботы без аренды: {', '.join(dead)} - "
+            f"{len(moves)} чатов перенесено на {', '.join(healthy)}"
+        )
+        return len(moves)
+
+
+# Общий супервизор процесса
+supervisor = UserbotSupervisor.from_settings()
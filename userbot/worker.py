@@ -2,18 +2,31 @@
 import asyncio
 import json
 import logging
-from typing import Optional
+import random
+import time
+from datetime import datetime, timedelta
+from html import escape
+from typing import Dict, Optional, Tuple
 from telethon import TelegramClient, events, functions
 from telethon.tl.types import Channel, Chat as TelegramChat
 from telethon.errors import FloodWaitError, ChannelPrivateError
-from aiogram import Bot
 
 from config import settings
 from database.database import async_session_maker
-from database.models import Chat, Project, KeywordType
-from database.crud import ChatCRUD, ProjectCRUD, KeywordCRUD, LeadMatchCRUD
-from userbot.matching import MatchingEngine
-from utils.cache import CacheService
+from database.models import Chat, Project, Filter, KeywordType, NotificationMode
+from database.crud import ChatCRUD, ProjectCRUD, KeywordCRUD
+from database.lead_writer import lead_writer
+from userbot.matching import MatchingEngine, ChatMatchIndex, FilterSyntaxError
+from userbot.ingest import MessageQueue
+from userbot.catchup import MessageCursor
+from userbot.chat_load import ChatLoadTracker
+from userbot.backfill import HistoryBackfill
+from userbot.preclassifier import LeadPreclassifier
+from userbot.routing import ChatRoutingTable, ChatRoute, ProjectRoute
+from userbot.supervisor import supervisor
+from utils.cache import CacheService, CacheKeys
+from utils.metrics import metrics
+from utils.notifier import notifier
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +34,12 @@ logger = logging.getLogger(__name__)
 class UserbotWorker:
     """Воркер юзербота для мониторинга"""
     
+    # Перекрытие окна инкрементальной синхронизации, секунды
+    SYNC_OVERLAP = 10
+    # Задержка повторного вступления после неудачи: растёт вдвое до максимума, секунды
+    JOIN_RETRY_BASE = 300
+    JOIN_RETRY_MAX = 6 * 3600
+    
     def __init__(self, api_id: int, api_hash: str, session_name: str, phone: str):
         self.api_id = api_id
         self.api_hash = api_hash
@@ -28,8 +47,26 @@ class UserbotWorker:
         self.phone = phone
         
         self.client: Optional[TelegramClient] = None
-        self.bot: Optional[Bot] = None
+        self.queue: Optional[MessageQueue] = None
         self.monitored_chats = set()  # Множество chat_id для мониторинга
+        self.project_keywords = {}  # project_id -> (время загрузки, (include, exclude), фильтры)
+        self.chat_indexes = {}  # chat.id -> (время сборки, ChatMatchIndex)
+        self.chat_telegram_ids = {}  # chat.id -> telegram_id (для снятия с мониторинга)
+        self.monitored_peer_ids = frozenset()  # monitored_chats в формате event.chat_id (-100...)
+        self.chats_synced_at: Optional[datetime] = None  # Метка последней синхронизации (Chat.updated_at)
+        self.join_retries: Dict[int, Tuple[int, float]] = {}  # chat.id -> (неудачных попыток, time.monotonic() повтора)
+        self.tombstones_synced_at = datetime.utcnow() - timedelta(days=1)
+        self._sync_lock = asyncio.Lock()
+        self.cursor = MessageCursor()  # Последние обработанные message_id по чатам
+        self._catchup_lock = asyncio.Lock()
+        self.chat_load = ChatLoadTracker(session_name, settings.USERBOT_LOAD_INTERVAL)  # Сообщения и время матчинга по чатам
+        self.backfill = HistoryBackfill(self)  # Сканирование истории по запросу из бота
+        self.preclassifier = LeadPreclassifier(
+            negative_threshold=settings.PRECLASSIFIER_NEGATIVE_THRESHOLD,
+            positive_threshold=settings.PRECLASSIFIER_POSITIVE_THRESHOLD
+        ) if settings.PRECLASSIFIER_ENABLED else None
+        self.routes = ChatRoutingTable()  # normalized chat_id -> чат + проекты
+        self.flood_until = 0.0  # time.monotonic() окончания последнего FloodWait
         
     async def start(self):
         """Запуск юзербота"""
@@ -42,22 +79,53 @@ class UserbotWorker:
             self.api_hash
         )
         
-        # Создаем Bot API клиента для отправки уведомлений
-        self.bot = Bot(token=settings.BOT_TOKEN)
-        
         await self.client.start(phone=self.phone)
         logger.info(f"✅ Юзербот {self.session_name} запущен!")
         
-        # Регистрируем обработчик новых сообщений через add_event_handler
-        self.client.add_event_handler(
-            self.process_message,
-            events.NewMessage()
+        # Очередь сообщений: обработчик Telethon только ставит в неё сообщения
+        self.queue = MessageQueue(
+            name=self.session_name,
+            handler=self.process_message,
+            workers=settings.USERBOT_QUEUE_WORKERS,
+            maxsize=settings.USERBOT_QUEUE_MAXSIZE,
+            overflow=settings.USERBOT_QUEUE_OVERFLOW,
+            fetch_spilled=self.fetch_messages
         )
-        logger.info(f"📡 Обработчик NewMessage зарегистрирован через add_event_handler")
+        self.queue.start()
+        
+        # Регистрируем обработчик новых сообщений через add_event_handler
+        if settings.USERBOT_EVENT_FILTER:
+            # Отбор по чату делает Telethon до создания корутины обработчика
+            self.client.add_event_handler(
+                self.on_new_message,
+                events.NewMessage(incoming=True, func=self.accepts_event)
+            )
+        else:
+            self.client.add_event_handler(
+                self.on_new_message,
+                events.NewMessage()
+            )
+        logger.info(f"📡 Обработчик NewMessage зарегистрирован через add_event_handler "
+                    f"(фильтр по чатам: {'да' if settings.USERBOT_EVENT_FILTER else 'нет'})")
+        
+        # Аренда юзербота; заодно забираем чаты, перенесённые пока нас не было
+        try:
+            await supervisor.renew_lease(self)
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения аренды {self.session_name}: {e}")
+        asyncio.create_task(supervisor.keep_lease(self))
         
         # Загружаем список чатов для мониторинга
         await self.load_chats()
         
+        # Догружаем сообщения, пропущенные пока юзербот был остановлен
+        asyncio.create_task(self.cursor.run_flush_loop())
+        asyncio.create_task(self.chat_load.run_flush_loop(lambda: self.monitored_chats))
+        asyncio.create_task(self.catch_up_missed_messages())
+        asyncio.create_task(self.watch_connection())
+        asyncio.create_task(self.backfill.listen())
+        asyncio.create_task(self.backfill.run())
+        
         # Запускаем фоновую задачу проверки новых чатов
         asyncio.create_task(self.check_new_chats_periodically())
         
@@ -67,6 +135,9 @@ class UserbotWorker:
         # Слушаем команды на немедленную перезагрузку чатов
         asyncio.create_task(self.listen_for_reload_signal())
         
+        # Слушаем изменения ключевых слов (точечная пересборка индексов чатов)
+        asyncio.create_task(self.listen_for_keyword_changes())
+        
         # Запускаем клиента
         await self.client.run_until_disconnected()
     
@@ -78,13 +149,13 @@ class UserbotWorker:
             try:
                 redis_client = redis.from_url(settings.REDIS_URL)
                 pubsub = redis_client.pubsub()
-                await pubsub.subscribe('userbot:reload_chats')
+                await pubsub.subscribe(CacheKeys.reload_chats_channel())
                 logger.info(f"📡 {self.session_name}: Слушаю сигналы на перезагрузку чатов...")
                 
                 async for message in pubsub.listen():
                     if message['type'] == 'message':
-                        logger.info(f"📥 Получен сигнал reload_chats, перезагружаю чаты...")
-                        await self.load_chats()
+                        logger.info(f"📥 Получен сигнал reload_chats, синхронизирую чаты...")
+                        await self.sync_chats()
                         
             except asyncio.CancelledError:
                 logger.info("Pubsub listener cancelled")
@@ -215,65 +286,143 @@ class UserbotWorker:
         return results[:20]
     
     async def check_new_chats_periodically(self):
-        """Периодическая проверка новых чатов (каждые 60 секунд)"""
+        """Периодическая инкрементальная синхронизация чатов (каждые 60 секунд)"""
         while True:
             try:
                 await asyncio.sleep(60)  # Проверяем раз в минуту
-                await self.load_chats()
+                await self.sync_chats()
             except Exception as e:
                 logger.error(f"❌ Ошибка периодической проверки чатов: {e}")
     
     async def load_chats(self):
-        """Загрузка чатов для мониторинга"""
+        """Полная загрузка чатов для мониторинга (при старте)"""
         logger.info("Загрузка чатов для мониторинга...")
+        await self.sync_chats(full=True)
+    
+    async def sync_chats(self, full: bool = False):
+        """
+        Синхронизация набора чатов с БД
         
-        async with async_session_maker() as session:
-            from sqlalchemy import select, update, or_
+        Забирает неназначенные чаты одним UPDATE, затем читает только чаты,
+        изменённые после прошлой синхронизации (Chat.updated_at), свои чаты
+        без вступления и записи об удалённых чатах. Чаты, переназначенные
+        другому юзерботу или удалённые, снимаются с мониторинга. Неудачное
+        вступление повторяется с задержкой (join_retries), пока чат не изменится.
+        """
+        async with self._sync_lock:
+            # Запас на расхождение часов процессов и долгие транзакции
+            overlap = timedelta(seconds=self.SYNC_OVERLAP)
+            since = None if full or self.chats_synced_at is None else self.chats_synced_at - overlap
+            tombstones_since = self.tombstones_synced_at - overlap
+            sync_started_at = datetime.utcnow()
             
-            # Загружаем чаты назначенные этому юзерботу ИЛИ без назначения
-            result = await session.execute(
-                select(Chat).where(
-                    or_(
-                        Chat.assigned_userbot == self.session_name,
-                        Chat.assigned_userbot == None
-                    )
-                )
-            )
-            chats = result.scalars().all()
+            async with async_session_maker() as session:
+                claimed = await ChatCRUD.claim_unassigned(session, self.session_name)
+                if claimed:
+                    logger.info(f"📌 {self.session_name}: забрал {len(claimed)} неназначенных чатов")
+                
+                chats = await ChatCRUD.get_changed_since(session, self.session_name, since)
+                tombstones = await ChatCRUD.get_tombstones_since(session, tombstones_since)
+                
+                # Раз в сутки чистим старые записи об удалённых чатах
+                if full or random.random() < 1 / 1440:
+                    await ChatCRUD.purge_tombstones(session, datetime.utcnow() - timedelta(days=1))
             
-            # Назначаем неназначенные чаты этому юзерботу
-            for chat in chats:
-                if chat.assigned_userbot is None:
-                    await session.execute(
-                        update(Chat).where(Chat.id == chat.id).values(assigned_userbot=self.session_name)
-                    )
-                    logger.info(f"📌 Назначил чат {chat.telegram_link} юзерботу {self.session_name}")
-            await session.commit()
+            if since is None:
+                self.chats_synced_at = sync_started_at
+            elif chats:
+                self.chats_synced_at = max(self.chats_synced_at, chats[-1].updated_at)
+            if tombstones:
+                self.tombstones_synced_at = max(self.tombstones_synced_at, tombstones[-1].deleted_at)
             
-            logger.info(f"📋 Найдено {len(chats)} чатов для {self.session_name}")
+            # Свои чаты без вступления приходят каждую синхронизацию - изменёнными не считаем
+            changed_chats = [chat for chat in chats if since is None or chat.updated_at > since]
+            added = removed = retried = 0
+            changed = bool(changed_chats or tombstones)
+            now = time.monotonic()
             
             for chat in chats:
                 try:
-                    logger.info(f"  📍 Чат: {chat.telegram_link}, telegram_id={chat.telegram_id}, is_joined={chat.is_joined}")
+                    if chat.assigned_userbot != self.session_name:
+                        # Переназначен другому юзерботу
+                        self.join_retries.pop(chat.id, None)
+                        removed += self.forget_chat(chat.id)
+                        continue
                     
-                    # Пытаемся вступить в чат (если еще не вступили)
+                    telegram_id = chat.telegram_id
                     if not chat.is_joined:
-                        await self.join_chat(chat)
-                        # Добавляем в список мониторинга после успешного вступления
-                        if chat.telegram_id:
-                            self.monitored_chats.add(chat.telegram_id)
-                    elif chat.telegram_id and chat.telegram_id not in self.monitored_chats:
-                        # Чат уже подключен, но не в списке мониторинга
-                        self.monitored_chats.add(chat.telegram_id)
-                        logger.info(f"✅ Мониторинг чата: {chat.telegram_link}")
+                        retry = self.join_retries.get(chat.id)
+                        if retry and retry[1] > now and (since is None or chat.updated_at <= since):
+                            continue  # Ждём задержки после неудачного вступления
+                        if retry:
+                            retried += 1
+                        
+                        # Пытаемся вступить в чат (если еще не вступили)
+                        telegram_id = await self.join_chat(chat)
+                        if not telegram_id:
+                            # Не вступили - не мониторим, повторим позже
+                            removed += self.forget_chat(chat.id)
+                            continue
+                        changed = True
                     
+                    if telegram_id:
+                        self.chat_telegram_ids[chat.id] = telegram_id
+                        if telegram_id not in self.monitored_chats:
+                            self.monitored_chats.add(telegram_id)
+                            added += 1
+                            logger.info(f"✅ Мониторинг чата: {chat.telegram_link}")
+                
                 except Exception as e:
                     logger.error(f"❌ Ошибка загрузки чата {chat.telegram_link}: {e}")
+            
+            for tombstone in tombstones:
+                self.join_retries.pop(tombstone.chat_id, None)
+                removed += self.forget_chat(tombstone.chat_id)
+            
+            if changed or full:
+                self.update_event_filter()
+                await self.refresh_routes()
+                self.backfill.resume_deferred()
+            
+            logger.info(
+                f"📡 {self.session_name}: {'полная' if full else 'инкрементальная'} синхронизация - "
+                f"изменено {len(changed_chats)}, удалено {len(tombstones)}, +{added}/-{removed}, "
+                f"повторов вступления {retried}, ожидают вступления {len(self.join_retries)}, "
+                f"мониторинг {len(self.monitored_chats)} чатов"
+            )
+    
+    def forget_chat(self, chat_id: int) -> int:
+        """Снять чат с мониторинга (1 если он был в мониторинге)"""
+        telegram_id = self.chat_telegram_ids.pop(chat_id, None)
+        if telegram_id is None or telegram_id not in self.monitored_chats:
+            return 0
+        self.monitored_chats.discard(telegram_id)
+        self.chat_indexes.pop(chat_id, None)
+        logger.info(f"🚫 Чат {telegram_id} снят с мониторинга")
+        return 1
+    
+    async def refresh_routes(self):
+        """Перестроить таблицу маршрутизации chat_id -> проекты (один запрос)"""
+        if not self.monitored_chats:
+            self.routes.replace([])
+            return
         
-        logger.info(f"📡 Активный мониторинг: {len(self.monitored_chats)} чатов, IDs: {self.monitored_chats}")
+        async with async_session_maker() as session:
+            from sqlalchemy import select
+            from sqlalchemy.orm import selectinload
+            
+            result = await session.execute(
+                select(Chat)
+                .where(Chat.telegram_id.in_(self.monitored_chats))
+                .options(selectinload(Chat.projects).selectinload(Project.user))
+            )
+            chats = result.scalars().all()
+        
+        self.routes.replace(chats)
+        logger.info(f"🗺 Таблица маршрутизации: {len(self.routes)} чатов")
     
-    async def join_chat(self, chat: Chat):
-        """Вступление в чат"""
+    async def join_chat(self, chat: Chat) -> Optional[int]:
+        """Вступление в чат (возвращает telegram_id при успехе)"""
         try:
             logger.info(f"Вступление в чат: {chat.telegram_link}")
             
@@ -299,237 +448,530 @@ class UserbotWorker:
                     await session.commit()
                 
                 logger.info(f"✅ Вступили в чат: {chat.telegram_link}")
+                self.join_retries.pop(chat.id, None)
+                return entity.id
+            
+            self.defer_join(chat.id, self.JOIN_RETRY_MAX)
             
         except FloodWaitError as e:
             logger.warning(f"⏳ FloodWait: нужно подождать {e.seconds} секунд")
+            self.note_flood_wait(e.seconds)
+            self.defer_join(chat.id, e.seconds)
             await asyncio.sleep(e.seconds)
             
         except ChannelPrivateError:
             logger.error(f"❌ Чат приватный или недоступен: {chat.telegram_link}")
+            self.defer_join(chat.id, self.JOIN_RETRY_MAX)
             
         except Exception as e:
             logger.error(f"❌ Ошибка вступления в чат: {e}")
+            self.defer_join(chat.id)
     
-    async def process_message(self, event):
-        """Обработка нового сообщения"""
-        try:
-            chat_id = event.chat_id
-            
-            # Нормализуем chat_id (убираем -100 префикс для супергрупп)
-            normalized_chat_id = chat_id
-            if chat_id and chat_id < 0:
-                # Для супергрупп Telegram возвращает -100XXXXXXXXXX
-                chat_id_str = str(chat_id)
-                if chat_id_str.startswith('-100'):
-                    normalized_chat_id = int(chat_id_str[4:])
-            
-            is_monitored = normalized_chat_id in self.monitored_chats
+    def defer_join(self, chat_id: int, min_delay: float = 0):
+        """Отложить повторное вступление в чат после неудачи"""
+        attempts = self.join_retries.get(chat_id, (0, 0.0))[0] + 1
+        delay = max(min(self.JOIN_RETRY_BASE * 2 ** (attempts - 1), self.JOIN_RETRY_MAX), min_delay)
+        self.join_retries[chat_id] = (attempts, time.monotonic() + delay)
+    
+    def note_flood_wait(self, seconds: int):
+        """Запомнить FloodWait (долгий - повод супервизору перенести наши чаты)"""
+        self.flood_until = max(self.flood_until, time.monotonic() + seconds)
+    
+    @staticmethod
+    def normalize_chat_id(chat_id: Optional[int]) -> Optional[int]:
+        """Нормализуем chat_id (убираем -100 префикс для супергрупп)"""
+        if chat_id and chat_id < 0:
+            # Для супергрупп Telegram возвращает -100XXXXXXXXXX
+            chat_id_str = str(chat_id)
+            if chat_id_str.startswith('-100'):
+                return int(chat_id_str[4:])
+        return chat_id
+    
+    @staticmethod
+    def to_peer_id(telegram_id: int) -> int:
+        """Нормализованный id супергруппы/канала -> event.chat_id (-100XXXXXXXXXX)"""
+        return -(1000000000000 + telegram_id)
+    
+    def update_event_filter(self):
+        """Пересчитать id для фильтра событий (после изменения monitored_chats)"""
+        self.monitored_peer_ids = frozenset(self.to_peer_id(chat_id) for chat_id in self.monitored_chats)
+    
+    def accepts_event(self, event) -> bool:
+        """Фильтр Telethon: только сообщения мониторируемых чатов (без разбора строк)"""
+        if event.chat_id in self.monitored_peer_ids:
+            metrics.incr('updates.accepted')
+            return True
+        metrics.incr('updates.discarded')
+        return False
+    
+    async def on_new_message(self, event):
+        """
+        Обработчик Telethon: только отбор и постановка в очередь
+        
+        Вся тяжёлая работа выполняется обработчиками очереди (process_message),
+        чтобы медленный AI/CRM не тормозил цикл обновлений Telegram.
+        """
+        if not settings.USERBOT_EVENT_FILTER:
+            normalized_chat_id = self.normalize_chat_id(event.chat_id)
             
             # Проверяем, что сообщение из мониторируемого чата
-            if not is_monitored:
+            if normalized_chat_id not in self.monitored_chats:
+                metrics.incr('updates.discarded')
+                return
+            metrics.incr('updates.accepted')
+        
+        # Игнорируем свои сообщения и сообщения без текста
+        if event.message.out or not event.message.message:
+            return
+        
+        self.queue.put_nowait(event.message)
+    
+    async def watch_connection(self):
+        """Следим за переподключением Telethon: после разрыва догружаем пропущенное"""
+        was_connected = True
+        while True:
+            try:
+                await asyncio.sleep(15)
+                connected = self.client.is_connected()
+                if connected and not was_connected:
+                    logger.info(f"🔌 {self.session_name}: соединение восстановлено, догружаем пропущенные сообщения")
+                    asyncio.create_task(self.catch_up_missed_messages())
+                was_connected = connected
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка проверки соединения: {e}")
+    
+    async def catch_up_missed_messages(self):
+        """Догрузить сообщения после последних обработанных во всех мониторируемых чатах"""
+        if self._catchup_lock.locked():
+            return
+        
+        async with self._catchup_lock:
+            try:
+                positions = await self.cursor.load(self.monitored_chats)
+            except Exception as e:
+                logger.error(f"❌ Не удалось загрузить позиции чатов: {e}")
+                return
+            if not positions:
                 return
             
-            # Логируем только сообщения из мониторируемых чатов
-            logger.info(f"🔔 NewMessage: chat_id={chat_id}, normalized={normalized_chat_id}, text='{(event.message.message or '')[:50]}'")
+            started_at = time.monotonic()
+            semaphore = asyncio.Semaphore(settings.USERBOT_CATCHUP_CONCURRENCY)
+            results = await asyncio.gather(
+                *(self.catch_up_chat(chat_id, last_id, semaphore) for chat_id, last_id in positions.items()),
+                return_exceptions=True
+            )
+            
+            total = 0
+            for chat_id, result in zip(positions, results):
+                if isinstance(result, Exception):
+                    logger.error(f"❌ Ошибка догрузки чата {chat_id}: {result}")
+                else:
+                    total += result
+            
+            metrics.incr('userbot.catchup_messages', total)
+            logger.info(f"📚 {self.session_name}: догружено {total} сообщений из {len(positions)} чатов "
+                        f"за {time.monotonic() - started_at:.1f} сек")
+    
+    async def catch_up_chat(self, telegram_id: int, last_id: int, semaphore: asyncio.Semaphore) -> int:
+        """Прогнать через очередь сообщения чата новее last_id (не больше USERBOT_CATCHUP_LIMIT)"""
+        fetched = fed = 0
+        
+        async with semaphore:
+            while fetched < settings.USERBOT_CATCHUP_LIMIT:
+                try:
+                    async for message in self.client.iter_messages(
+                        self.to_peer_id(telegram_id),
+                        min_id=last_id,
+                        reverse=True,
+                        limit=settings.USERBOT_CATCHUP_LIMIT - fetched,
+                        wait_time=1
+                    ):
+                        fetched += 1
+                        last_id = message.id
+                        if message.out or not message.message:
+                            self.cursor.advance(telegram_id, message.id)
+                            continue
+                        await self.queue.put(message)
+                        fed += 1
+                    break
+                except FloodWaitError as e:
+                    # Продолжим с последнего полученного сообщения
+                    logger.warning(f"⏳ FloodWait при догрузке чата {telegram_id}: {e.seconds} сек")
+                    self.note_flood_wait(e.seconds)
+                    await asyncio.sleep(e.seconds)
+        
+        if fetched >= settings.USERBOT_CATCHUP_LIMIT:
+            logger.warning(f"⚠️ Чат {telegram_id}: догрузка ограничена {settings.USERBOT_CATCHUP_LIMIT} сообщениями")
+        return fed
+    
+    async def fetch_messages(self, chat_id: int, message_ids: list) -> list:
+        """Дочитать сообщения по ID (для выгруженных в Redis при переполнении очереди)"""
+        return await self.client.get_messages(chat_id, ids=message_ids)
+    
+    async def process_message(self, message):
+        """Обработка сообщения из очереди"""
+        try:
+            normalized_chat_id = self.normalize_chat_id(message.chat_id)
+            self.cursor.advance(normalized_chat_id, message.id)
+            self.chat_load.count(normalized_chat_id)
             
             # Получаем текст сообщения
-            text = event.message.message
-            if not text:
+            text = message.message
+            if not text or message.out:
                 return
             
-            # Игнорируем свои сообщения
-            is_outgoing = event.message.out
-            logger.info(f"📨 Мониторируемый чат {normalized_chat_id}: '{text[:80]}', out={is_outgoing}")
+            logger.info(f"📨 Мониторируемый чат {normalized_chat_id}: '{text[:80]}'")
             
-            if is_outgoing:
-                logger.info(f"⏭️ Пропускаем свое сообщение")
+            # Проекты чата берём из таблицы маршрутизации (без запроса в БД)
+            chat = self.routes.get(normalized_chat_id)
+            
+            if not chat:
+                logger.warning(f"⚠️ Чат {normalized_chat_id} не найден в таблице маршрутизации")
                 return
             
-            # Получаем все проекты, которые мониторят этот чат
-            async with async_session_maker() as session:
-                from sqlalchemy import select
-                from sqlalchemy.orm import selectinload
-                from database.models import chat_project_association
-                
-                # Находим чат с проектами (используем normalized_chat_id!)
-                result = await session.execute(
-                    select(Chat)
-                    .where(Chat.telegram_id == normalized_chat_id)
-                    .options(selectinload(Chat.projects).selectinload(Project.user))
-                )
-                chat = result.scalar_one_or_none()
-                
-                if not chat:
-                    logger.warning(f"⚠️ Чат {normalized_chat_id} не найден в БД")
-                    return
-                
-                logger.info(f"🔍 Чат {chat.telegram_link} связан с {len(chat.projects)} проектами")
-                
-                # Получаем все проекты этого чата
-                for project in chat.projects:
-                    logger.info(f"🎯 Проверяем проект '{project.name}' (user_id={project.user_id})")
-                    await self.check_project_match(event, text, project, chat)
+            logger.info(f"🔍 Чат {chat.telegram_link} связан с {len(chat.projects)} проектами")
+            
+            # Один проход по тексту для всех проектов чата
+            index = await self.get_chat_index(chat)
+            scan_started = time.perf_counter()
+            matches = index.scan(text)
+            self.chat_load.spend(normalized_chat_id, (time.perf_counter() - scan_started) * 1000)
+            
+            logger.info(f"🔎 Matching result: {len(matches)}/{len(chat.projects)} проектов")
+            
+            if not matches:
+                return
+            
+            # Сообщение могло прийти и живым событием, и при догрузке - обрабатываем один раз
+            if not await MessageCursor.claim(normalized_chat_id, message.id):
+                metrics.incr('userbot.duplicates')
+                logger.info(f"♻️ Сообщение {message.id} в чате {normalized_chat_id} уже обработано")
+                return
+            
+            # Дешёвая локальная оценка - один раз на сообщение для всех проектов
+            precheck = None
+            if self.preclassifier:
+                classify_started = time.perf_counter()
+                sender_messages = self.preclassifier.observe_sender(message.sender_id)
+                precheck = self.preclassifier.classify(text, sender_messages)
+                self.chat_load.spend(normalized_chat_id, (time.perf_counter() - classify_started) * 1000)
+                if precheck:
+                    logger.info(f"🧮 Пред-классификатор: is_lead={precheck['is_lead']}, {precheck['reason']}")
+            
+            checks = []
+            for project in chat.projects:
+                found_keywords = matches.get(project.id)
+                if not found_keywords:
+                    continue
+                logger.info(f"🎯 Совпадение в проекте '{project.name}' (user_id={project.user_id}), "
+                            f"keywords={[k.text for k in found_keywords]}")
+                checks.append(self.check_project_match(message, text, project, chat, found_keywords, precheck))
+            
+            # Проекты проверяем параллельно (AI-вердикты собираются в одну пачку)
+            hits = [hit for hit in await asyncio.gather(*checks) if hit]
+            
+            # Одно уведомление на пользователя, даже если совпало несколько его проектов
+            hits_by_user = {}
+            for hit in hits:
+                hits_by_user.setdefault(hit['project'].user.id, []).append(hit)
+            for user_hits in hits_by_user.values():
+                await self.send_notification(text, chat, user_hits)
         
         except Exception as e:
             logger.error(f"❌ Ошибка обработки сообщения: {e}")
     
-    async def check_project_match(self, event, text: str, project: Project, chat: Chat):
-        """Проверка совпадения для конкретного проекта"""
-        try:
-            async with async_session_maker() as session:
-                # Пробуем взять из кэша
-                cached_keywords = await CacheService.get_project_keywords(project.id)
+    async def get_project_keywords(self, project_id: int) -> tuple:
+        """Ключевые слова, исключения и фильтры проекта (Redis-кэш, затем БД)"""
+        cached_keywords = await CacheService.get_project_keywords(project_id)
+        
+        if cached_keywords:
+            # Восстанавливаем объекты из кэша
+            include_keywords = [
+                type('Keyword', (), kw) for kw in cached_keywords.get('include', [])
+            ]
+            exclude_keywords = [
+                type('Keyword', (), kw) for kw in cached_keywords.get('exclude', [])
+            ]
+            return include_keywords, exclude_keywords, cached_keywords.get('filters', [])
+        
+        # Загружаем из БД
+        async with async_session_maker() as session:
+            from sqlalchemy import select
+            
+            include_keywords = await KeywordCRUD.get_all(session, project_id, KeywordType.INCLUDE)
+            exclude_keywords = await KeywordCRUD.get_all(session, project_id, KeywordType.EXCLUDE)
+            result = await session.execute(
+                select(Filter.logic_string).where(Filter.project_id == project_id)
+            )
+            filters = list(result.scalars().all())
+        
+        # Кэшируем
+        await CacheService.set_project_keywords(project_id, {
+            'include': [{'text': k.text, 'type': k.type.value} for k in include_keywords],
+            'exclude': [{'text': k.text, 'type': k.type.value} for k in exclude_keywords],
+            'filters': filters
+        })
+        return include_keywords, exclude_keywords, filters
+    
+    @staticmethod
+    def compile_project_filters(project_id: int, logic_strings: list) -> list:
+        """Скомпилировать фильтры проекта, пропуская некорректные"""
+        compiled = []
+        for logic_string in logic_strings:
+            try:
+                compiled.append(MatchingEngine.compile_filter(logic_string))
+            except FilterSyntaxError as e:
+                logger.warning(f"⚠️ Проект {project_id}: фильтр '{logic_string}' пропущен: {e}")
+        return compiled
+    
+    async def get_chat_index(self, chat: ChatRoute) -> ChatMatchIndex:
+        """
+        Получить объединённый автомат чата
+        
+        Пересобирается только если изменился состав проектов чата,
+        слова или фильтры одного из проектов (сигнал keywords_changed)
+        или истёк TTL.
+        """
+        project_ids = frozenset(project.id for project in chat.projects)
+        now = time.monotonic()
+        
+        cached = self.chat_indexes.get(chat.id)
+        if cached:
+            built_at, index = cached
+            if index.project_ids == project_ids and now - built_at < CacheService.TTL_KEYWORDS:
+                return index
+        
+        index = await self.build_match_index(project_ids)
+        self.chat_indexes[chat.id] = (now, index)
+        logger.info(f"🧩 Собран индекс чата {chat.telegram_link}: {len(project_ids)} проектов, {len(index.automaton)} паттернов")
+        return index
+    
+    async def build_match_index(self, project_ids) -> ChatMatchIndex:
+        """Автомат по словам и фильтрам проектов (слова проекта кэшируются на TTL)"""
+        now = time.monotonic()
+        project_keywords = {}
+        project_filters = {}
+        for project_id in project_ids:
+            entry = self.project_keywords.get(project_id)
+            if entry is None or now - entry[0] >= CacheService.TTL_KEYWORDS:
+                include_keywords, exclude_keywords, filters = await self.get_project_keywords(project_id)
+                entry = (now, (include_keywords, exclude_keywords), self.compile_project_filters(project_id, filters))
+                self.project_keywords[project_id] = entry
+            project_keywords[project_id] = entry[1]
+            if entry[2]:
+                project_filters[project_id] = entry[2]
+        
+        return ChatMatchIndex(project_keywords, project_filters)
+    
+    def invalidate_project_keywords(self, project_id: int):
+        """Сбросить слова проекта и индексы всех чатов, где он участвует"""
+        self.project_keywords.pop(project_id, None)
+        stale_chats = [
+            chat_id for chat_id, (_, index) in self.chat_indexes.items()
+            if project_id in index.project_ids
+        ]
+        for chat_id in stale_chats:
+            del self.chat_indexes[chat_id]
+        logger.info(f"♻️ Слова проекта {project_id} изменились, сброшено индексов чатов: {len(stale_chats)}")
+    
+    async def listen_for_keyword_changes(self):
+        """Слушаем Redis: изменения ключевых слов проектов и настроек уведомлений"""
+        import redis.asyncio as redis
+        
+        keywords_channel = CacheKeys.keywords_changed_channel()
+        user_settings_channel = CacheKeys.user_settings_changed_channel()
+        
+        while True:
+            try:
+                redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+                pubsub = redis_client.pubsub()
+                await pubsub.subscribe(keywords_channel, user_settings_channel)
                 
-                if cached_keywords:
-                    # Восстанавливаем объекты из кэша
-                    from database.models import Keyword
-                    include_keywords = [
-                        type('Keyword', (), kw) for kw in cached_keywords.get('include', [])
-                    ]
-                    exclude_keywords = [
-                        type('Keyword', (), kw) for kw in cached_keywords.get('exclude', [])
-                    ]
-                else:
-                    # Загружаем из БД
-                    include_keywords = await KeywordCRUD.get_all(
-                        session, project.id, KeywordType.INCLUDE
-                    )
-                    exclude_keywords = await KeywordCRUD.get_all(
-                        session, project.id, KeywordType.EXCLUDE
-                    )
-                    
-                    # Кэшируем
-                    await CacheService.set_project_keywords(project.id, {
-                        'include': [{'text': k.text, 'type': k.type.value} for k in include_keywords],
-                        'exclude': [{'text': k.text, 'type': k.type.value} for k in exclude_keywords]
-                    })
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    if message['channel'] == keywords_channel:
+                        self.invalidate_project_keywords(int(message['data']))
+                    elif message['channel'] == user_settings_channel:
+                        user_id, mode = message['data'].split(':', 1)
+                        self.routes.set_notification_mode(int(user_id), mode)
+                        logger.info(f"🔔 Режим уведомлений пользователя {user_id}: {mode}")
+                        
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка Redis pubsub (keywords): {e}, переподключаюсь через 5 сек...")
+                await asyncio.sleep(5)
+    
+    async def check_project_match(
+        self,
+        message,
+        text: str,
+        project: ProjectRoute,
+        chat: ChatRoute,
+        found_keywords: list,
+        precheck: Optional[dict] = None,
+        historical: bool = False
+    ):
+        """
+        Обработка совпадения проекта: AI-валидация и сохранение лида
+        
+        historical - сообщение из сканирования истории (лид помечается
+        is_historical и не ставится в очередь CRM).
+        
+        Returns:
+            Данные для уведомления или None, если это не лид
+        """
+        try:
+            if precheck is not None:
+                # Очевидный случай - LLM не нужен
+                ai_result = precheck
+                metrics.incr('lead_verdict.preclassifier')
+            else:
+                # AI-валидация intent (проверяем что это реальный лид)
+                # (вердикт кэшируется по содержимому - кросспосты не оплачиваются повторно)
+                from utils.ai_helpers import validate_lead_intent_cached
                 
-                # Проверяем совпадение
-                result = MatchingEngine.process_message(
-                    text=text,
-                    include_keywords=include_keywords,
-                    exclude_keywords=exclude_keywords,
-                    filters=[]  # TODO: Добавить поддержку фильтров
+                matched_kw_texts = [getattr(k, 'text', str(k)) for k in found_keywords]
+                ai_result = await validate_lead_intent_cached(
+                    message_text=text,
+                    matched_keywords=matched_kw_texts,
+                    business_context=project.name  # Название проекта как контекст
                 )
-                
-                logger.info(f"🔎 Matching result: matched={result['matched']}, keywords={[getattr(k, 'text', k) for k in result.get('keywords', [])]}")
-                
-                if result['matched']:
-                    # AI-валидация intent (проверяем что это реальный лид)
-                    from utils.ai_helpers import validate_lead_intent
-                    
-                    matched_kw_texts = [getattr(k, 'text', str(k)) for k in result['keywords']]
-                    ai_result = await validate_lead_intent(
-                        message_text=text,
-                        matched_keywords=matched_kw_texts,
-                        business_context=project.name  # Название проекта как контекст
-                    )
-                    
-                    logger.info(f"🤖 AI validation: is_lead={ai_result['is_lead']}, intent={ai_result['intent']}, reason={ai_result['reason']}")
-                    
-                    # Если AI считает что это не лид - пропускаем
-                    if not ai_result['is_lead']:
-                        logger.info(f"⏭️ Пропускаем - AI определил как не лид: {ai_result['reason']}")
-                        return
-                    
-                    message_link = self.get_message_link(event)
-                    
-                    # Получаем информацию об отправителе
-                    sender = await event.get_sender()
-                    sender_username = getattr(sender, 'username', None)
-                    sender_id = getattr(sender, 'id', None)
-                    
-                    # Сохраняем лид в БД
-                    keywords_json = json.dumps([kw.text for kw in result['keywords'][:10]])
-                    
-                    lead_match = await LeadMatchCRUD.create(
-                        session=session,
-                        user_id=project.user_id,
-                        project_id=project.id,
-                        chat_id=chat.id,
-                        message_text=text[:2000],  # Ограничиваем длину
-                        message_link=message_link,
-                        matched_keywords=keywords_json,
-                        telegram_message_id=event.message.id,
-                        sender_username=sender_username,
-                        sender_id=sender_id
-                    )
-                    
-                    # Отправляем в AmoCRM если настроено
-                    try:
-                        from utils.amocrm import send_lead_to_amocrm
-                        await send_lead_to_amocrm(session, project.user_id, lead_match)
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки в AmoCRM: {e}")
-                    
-                    # Отправляем уведомление пользователю
-                    await self.send_notification(
-                        user_telegram_id=project.user.telegram_id,
-                        message_text=text,
-                        keywords=result['keywords'],
-                        chat=chat,
-                        message_link=message_link,
-                        sender_username=sender_username
-                    )
+                metrics.incr('lead_verdict.llm')
+            
+            logger.info(f"🤖 AI validation: is_lead={ai_result['is_lead']}, intent={ai_result['intent']}, reason={ai_result['reason']}")
+            
+            # Если AI считает что это не лид - пропускаем
+            if not ai_result['is_lead']:
+                logger.info(f"⏭️ Пропускаем - AI определил как не лид: {ai_result['reason']}")
+                return
+            
+            message_link = self.get_message_link(message, chat)
+            
+            # Получаем информацию об отправителе
+            sender = await message.get_sender()
+            sender_username = getattr(sender, 'username', None)
+            sender_id = getattr(sender, 'id', None)
+            
+            # Сохраняем лид в БД пачкой с другими лидами
+            # (в той же транзакции он попадает в очередь доставки в CRM)
+            await lead_writer.write(
+                user_id=project.user_id,
+                project_id=project.id,
+                chat_id=chat.id,
+                message_text=text[:2000],  # Ограничиваем длину
+                message_link=message_link,
+                matched_keywords=json.dumps([kw.text for kw in found_keywords[:10]]),
+                telegram_message_id=message.id,
+                sender_username=sender_username,
+                sender_id=sender_id,
+                is_historical=historical
+            )
+            
+            return {
+                'project': project,
+                'keywords': found_keywords,
+                'message_link': message_link,
+                'sender_username': sender_username,
+            }
         
         except Exception as e:
             logger.error(f"❌ Ошибка проверки проекта: {e}")
+            return None
     
-    async def send_notification(
-        self,
-        user_telegram_id: int,
-        message_text: str,
-        keywords: list,
-        chat: Chat,
-        message_link: str,
-        sender_username: str = None
-    ):
-        """Отправка уведомления пользователю"""
+    async def send_notification(self, message_text: str, chat: ChatRoute, hits: list):
+        """
+        Уведомить пользователя о лиде с учётом его режима уведомлений
+        
+        hits - совпадения одного сообщения в проектах одного пользователя,
+        они объединяются в одно уведомление.
+        """
         try:
+            user = hits[0]['project'].user
+            mode = user.notification_mode or NotificationMode.ALL.value
+            
+            if len(hits) > 1:
+                metrics.incr('notify.coalesced', len(hits) - 1)
+            
+            if mode == NotificationMode.OFF.value:
+                metrics.incr('notify.suppressed')
+                return
+            
+            # Ключевые слова всех проектов без повторов
+            keywords = []
+            for hit in hits:
+                for kw in hit['keywords']:
+                    if kw.text not in keywords:
+                        keywords.append(kw.text)
+            projects_text = ', '.join(escape(hit['project'].name) for hit in hits)
+            chat_title = escape(chat.title or chat.telegram_link or '')
+            message_link = hits[0]['message_link']
+            sender_username = hits[0]['sender_username']
+            
+            if mode == NotificationMode.DIGEST.value:
+                # Короткая запись в периодическую сводку
+                short_text = message_text if len(message_text) <= 150 else message_text[:150] + '...'
+                sender_info = f" (@{sender_username})" if sender_username else ""
+                entry = (
+                    f"💬 <b>{chat_title}</b>{sender_info} · 📁 {projects_text}\n"
+                    f"{escape(short_text)}\n"
+                    f"🔗 <a href=\"{message_link}\">Перейти к сообщению</a>"
+                )
+                await notifier.add_to_digest(user.telegram_id, entry)
+                return
+            
             # Обрезаем текст если он слишком длинный
             if len(message_text) > 500:
                 message_text = message_text[:500] + '...'
             
             # Форматируем ключевые слова
-            keywords_text = ', '.join([kw.text for kw in keywords[:5]])
+            keywords_text = escape(', '.join(keywords[:5]))
             
             # Информация об отправителе
             sender_info = f"👤 <b>Отправитель:</b> @{sender_username}\n" if sender_username else ""
+            projects_label = 'Проекты' if len(hits) > 1 else 'Проект'
             
             # Формируем сообщение
             notification = f"""🔔 <b>Найдено совпадение!</b>
 
-💬 <b>Чат:</b> {chat.title or chat.telegram_link}
+💬 <b>Чат:</b> {chat_title}
+📁 <b>{projects_label}:</b> {projects_text}
 🔑 <b>Ключевые слова:</b> {keywords_text}
 {sender_info}
 📝 <b>Текст сообщения:</b>
-{message_text}
+{escape(message_text)}
 
 🔗 <a href="{message_link}">Перейти к сообщению</a>
 """
             
-            await self.bot.send_message(
-                chat_id=user_telegram_id,
+            # Отправка через общий диспетчер (лимиты Telegram, повторы) - матчинг не ждёт
+            notifier.enqueue(
+                chat_id=user.telegram_id,
                 text=notification,
                 parse_mode='HTML',
                 disable_web_page_preview=True
             )
-            
-            logger.info(f"✅ Уведомление отправлено пользователю {user_telegram_id}")
         
         except Exception as e:
-            logger.error(f"❌ Ошибка отправки уведомления: {e}")
+            logger.error(f"❌ Ошибка постановки уведомления в очередь: {e}")
     
-    def get_message_link(self, event) -> str:
+    def get_message_link(self, message, chat_route: ChatRoute = None) -> str:
         """Получение ссылки на сообщение"""
         try:
-            chat = event.chat
-            message_id = event.message.id
+            chat = message.chat
+            message_id = message.id
             
             if hasattr(chat, 'username') and chat.username:
                 return f"https://t.me/{chat.username}/{message_id}"
-            else:
+            elif chat is not None:
                 # Приватный чат
                 return f"https://t.me/c/{chat.id}/{message_id}"
+            elif chat_route is not None:
+                # Сущность чата не в кэше (сообщение дочитано по ID)
+                return f"https://t.me/c/{chat_route.telegram_id}/{message_id}"
+            return "#"
         except:
             return "#"
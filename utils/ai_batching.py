@@ -0,0 +1,115 @@
+"""Микро-батчинг запросов к AI: несколько кандидатов - один вызов модели"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# (текст сообщения, найденные слова, контекст бизнеса)
+IntentItem = Tuple[str, List[str], str]
+
+
+class IntentBatcher:
+    """
+    Собирает кандидатов в пачку на короткое окно (или до max_size штук),
+    классифицирует их одним запросом и раздаёт вердикты ожидающим корутинам.
+
+    batch_fn(items) возвращает список вердиктов той же длины (None - модель
+    не ответила по элементу). Если пачка упала целиком или по элементу нет
+    ответа, для него вызывается single_fn - как без батчинга.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[IntentItem]], Awaitable[List[Optional[Dict[str, Any]]]]],
+        single_fn: Callable[[str, List[str], str], Awaitable[Dict[str, Any]]],
+        window_ms: int = 300,
+        max_size: int = 10
+    ):
+        self.batch_fn = batch_fn
+        self.single_fn = single_fn
+        self.window = max(0, window_ms) / 1000
+        self.max_size = max(1, max_size)
+
+        self._pending: List[Tuple[IntentItem, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 1 and self.window > 0
+
+    async def validate(
+        self,
+        message_text: str,
+        matched_keywords: List[str],
+        business_context: str = ""
+    ) -> Dict[str, Any]:
+        """Вердикт по одному кандидату (ожидает сборки и обработки пачки)"""
+        if not self.enabled:
+            return await self.single_fn(message_text, matched_keywords, business_context)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((message_text, matched_keywords, business_context), future))
+
+        if len(self._pending) >= self.max_size:
+            self._flush_now()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+
+        return await future
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window)
+        self._flush_task = None
+        self._flush_now()
+
+    def _flush_now(self):
+        """Забрать накопленную пачку и обработать её в фоне"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.create_task(self._process(batch))
+
+    async def _process(self, batch: List[Tuple[IntentItem, asyncio.Future]]):
+        items = [item for item, _ in batch]
+        metrics.observe('ai.batch.size', len(items))
+
+        verdicts: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        if len(items) > 1:
+            started_at = time.monotonic()
+            try:
+                results = await self.batch_fn(items)
+                for i, verdict in enumerate(results[:len(items)]):
+                    verdicts[i] = verdict
+                metrics.incr('ai.batch.calls')
+            except Exception as e:
+                metrics.incr('ai.batch.errors')
+                logger.error(f"❌ Ошибка пакетной AI-валидации ({len(items)} шт.), проверяем по одному: {e}")
+            finally:
+                metrics.observe('ai.batch.latency_ms', (time.monotonic() - started_at) * 1000)
+
+        # По элементам без ответа - одиночные запросы параллельно
+        missing = [i for i, verdict in enumerate(verdicts) if verdict is None]
+        if missing:
+            if len(items) > 1:
+                metrics.incr('ai.batch.fallback_items', len(missing))
+            singles = await asyncio.gather(
+                *(self.single_fn(*items[i]) for i in missing),
+                return_exceptions=True
+            )
+            for i, verdict in zip(missing, singles):
+                verdicts[i] = verdict
+
+        for (_, future), verdict in zip(batch, verdicts):
+            if future.done():
+                continue
+            if isinstance(verdict, BaseException):
+                future.set_exception(verdict)
+            else:
+                future.set_result(verdict)
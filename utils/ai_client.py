@@ -0,0 +1,167 @@
+"""Общий OpenAI клиент процесса: пул соединений, лимит параллельности и бюджет RPM/TPM"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from config import settings
+from utils.metrics import metrics
+from utils.throttling import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class AIClientManager:
+    """
+    Один AsyncOpenAI на процесс
+
+    - httpx-клиент с keep-alive пулом (без TLS-рукопожатия на каждый запрос)
+    - семафор на количество запросов в полёте
+    - бюджеты запросов и токенов в минуту (token bucket)
+
+    Клиент создаётся лениво при первом запросе и закрывается через close()
+    при остановке процесса.
+    """
+
+    # Грубая оценка токенов по длине промпта (для бюджета TPM до ответа)
+    CHARS_PER_TOKEN = 3
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        rpm_limit: int = 0,
+        tpm_limit: int = 0,
+        max_connections: int = 20,
+        timeout: float = 30.0
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_connections = max(1, max_connections)
+        self.timeout = timeout
+
+        self._client: Optional[AsyncOpenAI] = None
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._requests_budget = TokenBucket.per_minute(rpm_limit)
+        self._tokens_budget = TokenBucket.per_minute(tpm_limit)
+        self._in_flight = 0
+
+    @classmethod
+    def from_settings(cls) -> 'AIClientManager':
+        return cls(
+            max_concurrency=settings.OPENAI_MAX_CONCURRENCY,
+            rpm_limit=settings.OPENAI_RPM_LIMIT,
+            tpm_limit=settings.OPENAI_TPM_LIMIT,
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            timeout=settings.OPENAI_TIMEOUT
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.OPENAI_API_KEY)
+
+    def get_client(self) -> Optional[AsyncOpenAI]:
+        """Общий AsyncOpenAI (None если ключ не настроен)"""
+        if not self.enabled:
+            return None
+
+        if self._client is None:
+            # Явный httpx клиент без proxies - избегаем конфликта версий
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                ),
+                timeout=self.timeout
+            )
+            self._client = AsyncOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                http_client=self._http_client
+            )
+            logger.info(
+                f"🤖 OpenAI клиент создан: {self.max_concurrency} запросов в полёте, "
+                f"пул {self.max_connections} соединений"
+            )
+        return self._client
+
+    def estimate_tokens(self, messages: List[Dict[str, str]], max_tokens: int) -> int:
+        """Оценка токенов запроса: промпт по длине + максимум ответа"""
+        prompt_chars = sum(len(message.get('content') or '') for message in messages)
+        return prompt_chars // self.CHARS_PER_TOKEN + max_tokens
+
+    async def chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "gpt-4o-mini",
+        max_tokens: int = 300,
+        **kwargs: Any
+    ):
+        """
+        chat.completions.create с учётом лимитов
+
+        Raises:
+            ValueError: если OpenAI ключ не настроен
+        """
+        client = self.get_client()
+        if client is None:
+            raise ValueError("OpenAI API key не настроен")
+
+        estimated_tokens = self.estimate_tokens(messages, max_tokens)
+
+        started_at = time.monotonic()
+        await self._requests_budget.acquire(1)
+        await self._tokens_budget.acquire(estimated_tokens)
+
+        async with self._semaphore:
+            metrics.observe('ai.wait_ms', (time.monotonic() - started_at) * 1000)
+            self._in_flight += 1
+            metrics.gauge('ai.in_flight', self._in_flight)
+
+            request_started_at = time.monotonic()
+            try:
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    **kwargs
+                )
+            except Exception:
+                metrics.incr('ai.errors')
+                raise
+            finally:
+                self._in_flight -= 1
+                metrics.gauge('ai.in_flight', self._in_flight)
+                metrics.observe('ai.latency_ms', (time.monotonic() - request_started_at) * 1000)
+
+        metrics.incr('ai.requests')
+
+        # Корректируем бюджет по фактическому расходу
+        usage = getattr(response, 'usage', None)
+        if usage is not None and usage.total_tokens:
+            metrics.incr('ai.tokens', usage.total_tokens)
+            difference = estimated_tokens - usage.total_tokens
+            if difference > 0:
+                self._tokens_budget.refund(difference)
+            else:
+                self._tokens_budget.charge(-difference)
+
+        return response
+
+    async def close(self):
+        """Закрыть пул соединений"""
+        client, self._client = self._client, None
+        http_client, self._http_client = self._http_client, None
+
+        if client is not None:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка закрытия OpenAI клиента: {e}")
+        if http_client is not None and not http_client.is_closed:
+            await http_client.aclose()
+
+
+# Общий менеджер процесса
+ai_client = AIClientManager.from_settings()
@@ -2,14 +2,18 @@
 import aiohttp
 import re
 import logging
-import httpx
 import asyncio
 import json
 import uuid
+import hashlib
 from openai import AsyncOpenAI
 from typing import List, Optional, Dict, Any
 import redis.asyncio as redis
 from config import settings
+from utils.ai_client import ai_client
+from utils.ai_batching import IntentBatcher, IntentItem
+from utils.cache import CacheService, CacheKeys, LocalCache
+from utils.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -81,15 +85,8 @@ async def search_telegram_chats(query: str, limit: int = 30) -> List[Dict[str, A
 
 
 def get_openai_client() -> Optional[AsyncOpenAI]:
-    """Создаёт OpenAI клиент по требованию (избегаем проблем с глобальным клиентом)"""
-    if settings.OPENAI_API_KEY:
-        # Создаём httpx клиент без proxies для избежания конфликта версий
-        http_client = httpx.AsyncClient()
-        return AsyncOpenAI(
-            api_key=settings.OPENAI_API_KEY,
-            http_client=http_client
-        )
-    return None
+    """Общий OpenAI клиент процесса (пул соединений, None если ключ не настроен)"""
+    return ai_client.get_client()
 
 
 async def validate_lead_intent(
@@ -114,9 +111,7 @@ async def validate_lead_intent(
             'reason': str
         }
     """
-    client = get_openai_client()
-    
-    if not client:
+    if not ai_client.enabled:
         # Если нет OpenAI ключа - пропускаем валидацию
         return {
             'is_lead': True,
@@ -148,7 +143,7 @@ async def validate_lead_intent(
     "reason": "краткое объяснение на русском"
 }}"""
 
-        response = await client.chat.completions.create(
+        response = await ai_client.chat_completion(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "Ты аналитик лидов. Отвечай ТОЛЬКО JSON без markdown."},
@@ -182,6 +177,173 @@ async def validate_lead_intent(
         }
 
 
+async def validate_lead_intents_batch(items: List[IntentItem]) -> List[Optional[Dict[str, Any]]]:
+    """
+    AI-валидация нескольких кандидатов одним запросом
+    
+    Args:
+        items: Список (текст сообщения, найденные слова, контекст бизнеса)
+        
+    Returns:
+        Вердикты в том же порядке (формат как у validate_lead_intent);
+        None - модель не вернула корректный вердикт по элементу
+    """
+    candidates = []
+    for i, (message_text, matched_keywords, business_context) in enumerate(items, 1):
+        candidates.append(
+            f"""[{i}]
+Сообщение: "{message_text}"
+Найденные ключевые слова: {', '.join(matched_keywords)}
+{f"Контекст бизнеса: {business_context}" if business_context else ""}""".strip()
+        )
+    
+    prompt = f"""Проанализируй сообщения из чатов и для КАЖДОГО определи intent автора.
+
+{chr(10).join(candidates)}
+
+Для каждого сообщения определи:
+1. Автор ИЩЕТ услугу/товар (потенциальный клиент)?
+2. Или он ПРЕДЛАГАЕТ услугу (конкурент)?
+3. Или просто ОБСУЖДАЕТ тему (не лид)?
+4. Или уже ПОЛУЧИЛ услугу (поздно)?
+5. Или это СПАМ/реклама?
+
+Ответь ТОЛЬКО JSON-массивом, по одному объекту на сообщение:
+[
+    {{
+        "id": номер сообщения,
+        "is_lead": true/false,
+        "confidence": 0.0-1.0,
+        "intent": "searching" | "offering" | "discussing" | "completed" | "spam",
+        "reason": "краткое объяснение на русском"
+    }}
+]"""
+
+    response = await ai_client.chat_completion(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "Ты аналитик лидов. Отвечай ТОЛЬКО JSON без markdown."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.1,
+        max_tokens=80 * len(items) + 50
+    )
+    
+    result_text = response.choices[0].message.content.strip()
+    
+    # Убираем markdown если есть
+    if result_text.startswith('```'):
+        result_text = re.sub(r'^```\w*\n?', '', result_text)
+        result_text = re.sub(r'\n?```$', '', result_text)
+    
+    results = json.loads(result_text)
+    if isinstance(results, dict):
+        results = results.get('results', [])
+    
+    verdicts: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    for result in results:
+        try:
+            index = int(result['id']) - 1
+            verdict = {
+                'is_lead': bool(result['is_lead']),
+                'confidence': float(result['confidence']),
+                'intent': str(result['intent']),
+                'reason': str(result.get('reason', ''))
+            }
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= index < len(items):
+            verdicts[index] = verdict
+    
+    logger.info(f"AI batch intent validation: {sum(v is not None for v in verdicts)}/{len(items)} verdicts")
+    return verdicts
+
+
+# Пакетная валидация: кандидаты за короткое окно уходят одним запросом
+intent_batcher = IntentBatcher(
+    batch_fn=validate_lead_intents_batch,
+    single_fn=validate_lead_intent,
+    window_ms=settings.AI_BATCH_WINDOW_MS,
+    max_size=settings.AI_BATCH_MAX_SIZE
+)
+
+
+# Кэш вердиктов AI: один и тот же текст (спам, кросспосты) приходит во многие чаты
+_verdict_cache = LocalCache(maxsize=10000, ttl=CacheService.TTL_AI_VERDICT)
+_verdict_in_flight: Dict[str, asyncio.Future] = {}
+
+
+def lead_verdict_key(message_text: str, matched_keywords: List[str], business_context: str = "") -> str:
+    """Хэш нормализованного текста, найденных слов и контекста бизнеса"""
+    normalized_text = ' '.join(message_text.lower().split())
+    keywords = '\x1f'.join(sorted(kw.lower() for kw in matched_keywords))
+    payload = '\x1e'.join((normalized_text, keywords, business_context.strip().lower()))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _record_verdict_lookup(outcome: str):
+    """Счётчики попаданий и доля попаданий кэша вердиктов"""
+    metrics.incr(f'ai.verdict_cache.{outcome}')
+    hits = metrics.counter('ai.verdict_cache.hit_local') + metrics.counter('ai.verdict_cache.hit_redis')
+    total = hits + metrics.counter('ai.verdict_cache.miss')
+    if total:
+        metrics.gauge('ai.verdict_cache.hit_ratio', round(hits / total, 3))
+
+
+async def validate_lead_intent_cached(
+    message_text: str,
+    matched_keywords: List[str],
+    business_context: str = ""
+) -> Dict[str, Any]:
+    """
+    validate_lead_intent с двухуровневым кэшем (LRU в процессе + Redis)
+    
+    Одинаковые запросы, пришедшие одновременно, ждут один вызов OpenAI.
+    Вердикты-заглушки (AI выключен или ошибка) не кэшируются.
+    """
+    digest = lead_verdict_key(message_text, matched_keywords, business_context)
+    
+    verdict = _verdict_cache.get(digest)
+    if verdict is not None:
+        _record_verdict_lookup('hit_local')
+        return verdict
+    
+    in_flight = _verdict_in_flight.get(digest)
+    if in_flight is not None:
+        _record_verdict_lookup('hit_local')
+        return await asyncio.shield(in_flight)
+    
+    future = asyncio.get_running_loop().create_future()
+    _verdict_in_flight[digest] = future
+    try:
+        verdict = await CacheService.get(CacheKeys.ai_verdict(digest))
+        if verdict is not None:
+            _record_verdict_lookup('hit_redis')
+        else:
+            _record_verdict_lookup('miss')
+            if ai_client.enabled:
+                verdict = await intent_batcher.validate(message_text, matched_keywords, business_context)
+            else:
+                verdict = await validate_lead_intent(message_text, matched_keywords, business_context)
+            if verdict.get('intent') != 'unknown':
+                await CacheService.set(CacheKeys.ai_verdict(digest), verdict, CacheService.TTL_AI_VERDICT)
+        
+        if verdict.get('intent') != 'unknown':
+            _verdict_cache.set(digest, verdict)
+        future.set_result(verdict)
+        return verdict
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Исключение забирают ожидающие; если их нет - не шумим в лог
+        future.exception()
+        raise
+    finally:
+        _verdict_in_flight.pop(digest, None)
+
+
 # База данных пуста - все чаты ищутся через Telegram API
 CHAT_DATABASE = {}
 
@@ -445,8 +607,7 @@ async def generate_keywords(niche: str) -> List[str]:
     Returns:
         Список ключевых слов и фраз
     """
-    client = get_openai_client()
-    if not client:
+    if not ai_client.enabled:
         raise ValueError("OpenAI API key не настроен")
     
     try:
@@ -481,7 +642,7 @@ async def generate_keywords(niche: str) -> List[str]:
 
         logger.info(f"Generating keywords for: '{niche[:100]}...'")
         
-        response = await client.chat.completions.create(
+        response = await ai_client.chat_completion(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "Ты - эксперт по лидогенерации. Генерируй только фразы которые клиент ПИШЕТ когда ИЩЕТ услугу."},
@@ -503,11 +664,6 @@ async def generate_keywords(niche: str) -> List[str]:
     except Exception as e:
         logger.error(f"Error generating keywords: {e}", exc_info=True)
         raise
-    finally:
-        try:
-            await client.close()
-        except Exception:
-            pass  # Игнорируем ошибки закрытия
 
 
 async def generate_exclude_words(niche: str) -> List[str]:
@@ -520,8 +676,7 @@ async def generate_exclude_words(niche: str) -> List[str]:
     Returns:
         Список исключающих слов
     """
-    client = get_openai_client()
-    if not client:
+    if not ai_client.enabled:
         raise ValueError("OpenAI API key не настроен")
     
     try:
@@ -540,7 +695,7 @@ async def generate_exclude_words(niche: str) -> List[str]:
 
         logger.info(f"Generating exclude words for niche: '{niche}'")
         
-        response = await client.chat.completions.create(
+        response = await ai_client.chat_completion(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "Ты - помощник для генерации исключающих слов."},
@@ -559,11 +714,6 @@ async def generate_exclude_words(niche: str) -> List[str]:
     except Exception as e:
         logger.error(f"Error generating exclude words: {e}", exc_info=True)
         raise
-    finally:
-        try:
-            await client.close()
-        except Exception:
-            pass  # Игнорируем ошибки закрытия
 
 
 async def suggest_chats(niche: str, min_subscribers: int = 100) -> List[dict]:
@@ -653,8 +803,7 @@ async def suggest_chat_names_ai(niche: str) -> List[str]:
     Returns:
         Список предполагаемых названий чатов
     """
-    client = get_openai_client()
-    if not client:
+    if not ai_client.enabled:
         return []
     
     try:
@@ -669,7 +818,7 @@ async def suggest_chat_names_ai(niche: str) -> List[str]:
 
 Верни ТОЛЬКО список названий, каждое с новой строки, без @, без пояснений."""
 
-        response = await client.chat.completions.create(
+        response = await ai_client.chat_completion(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "Ты - помощник для поиска Telegram-чатов."},
@@ -686,11 +835,6 @@ async def suggest_chat_names_ai(niche: str) -> List[str]:
     except Exception as e:
         logger.error(f"Error in suggest_chat_names_ai: {e}")
         return []
-    finally:
-        try:
-            await client.close()
-        except Exception:
-            pass
 
 
 async def generate_filters(niche: str, keywords: List[str]) -> List[str]:
@@ -704,8 +848,7 @@ async def generate_filters(niche: str, keywords: List[str]) -> List[str]:
     Returns:
         Список логических фильтров
     """
-    client = get_openai_client()
-    if not client:
+    if not ai_client.enabled:
         raise ValueError("OpenAI API key не настроен")
     
     try:
@@ -731,7 +874,7 @@ async def generate_filters(niche: str, keywords: List[str]) -> List[str]:
 
         logger.info(f"Generating filters for niche: '{niche}'")
         
-        response = await client.chat.completions.create(
+        response = await ai_client.chat_completion(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "Ты - помощник для создания поисковых фильтров."},
@@ -750,8 +893,3 @@ async def generate_filters(niche: str, keywords: List[str]) -> List[str]:
     except Exception as e:
         logger.error(f"Error generating filters: {e}", exc_info=True)
         raise
-    finally:
-        try:
-            await client.close()
-        except Exception:
-            pass
@@ -1,26 +1,103 @@
 """Утилиты для интеграции с AmoCRM"""
+import asyncio
 import logging
 import aiohttp
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Iterable, List, Union
 from datetime import datetime, timedelta
-from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
 
 from config import settings
+from utils.cache import LocalCache, CacheKeys, CacheService, get_redis
+from utils.throttling import RedisTokenBucket, TokenBucket
 
 logger = logging.getLogger(__name__)
 
 
+class AmoCRMError(Exception):
+    """Ошибка доставки в AmoCRM"""
+    pass
+
+
+class AmoCRMSessionPool:
+    """
+    Долгоживущие HTTP-сессии и лимиты запросов по поддоменам AmoCRM
+    
+    Одна aiohttp-сессия (keep-alive пул соединений) и один token bucket
+    на аккаунт: клиенты одного аккаунта делят соединения и лимит API
+    (7 запросов в секунду), сколько бы их ни было создано. Ведро - в
+    Redis, лимит общий и для нескольких процессов.
+    """
+    
+    def __init__(self, max_connections: int = 20, rps: float = 5.0):
+        self.max_connections = max(1, max_connections)
+        self.rps = rps
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._limiters: Dict[str, RedisTokenBucket] = {}
+    
+    @classmethod
+    def from_settings(cls) -> 'AmoCRMSessionPool':
+        return cls(
+            max_connections=settings.CRM_MAX_CONNECTIONS,
+            rps=settings.CRM_ACCOUNT_RPS
+        )
+    
+    def session(self, subdomain: str) -> aiohttp.ClientSession:
+        """Сессия аккаунта (создаётся при первом запросе)"""
+        session = self._sessions.get(subdomain)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+            self._sessions[subdomain] = session
+        return session
+    
+    def limiter(self, subdomain: str) -> RedisTokenBucket:
+        """Лимит запросов аккаунта"""
+        limiter = self._limiters.get(subdomain)
+        if limiter is None:
+            limiter = RedisTokenBucket(CacheKeys.amocrm_rate_limit(subdomain), rate=self.rps, capacity=self.rps)
+            self._limiters[subdomain] = limiter
+        return limiter
+    
+    async def close(self):
+        """Закрыть все сессии"""
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            if not session.closed:
+                await session.close()
+
+
+# Общий пул процесса
+amocrm_pool = AmoCRMSessionPool.from_settings()
+
+
 class AmoCRMClient:
     """Клиент для работы с AmoCRM API"""
     
     BASE_URL = "https://{subdomain}.amocrm.ru/api/v4"
+    # Максимум сделок в одном запросе /leads/complex
+    COMPLEX_BATCH_SIZE = 50
     
-    def __init__(self, subdomain: str, access_token: str, refresh_token: str = None):
+    def __init__(
+        self,
+        subdomain: str,
+        access_token: str,
+        refresh_token: str = None,
+        http_session: Optional[aiohttp.ClientSession] = None,
+        rate_limiter: Optional[Union[TokenBucket, RedisTokenBucket]] = None
+    ):
+        """
+        Args:
+            http_session: HTTP-сессия (по умолчанию - сессия аккаунта из amocrm_pool)
+            rate_limiter: Лимит запросов (по умолчанию - лимит аккаунта из amocrm_pool)
+        """
         self.subdomain = subdomain
         self.access_token = access_token
         self.refresh_token = refresh_token
         self.base_url = self.BASE_URL.format(subdomain=subdomain)
+        self.http_session = http_session
+        self.rate_limiter = rate_limiter if rate_limiter is not None else amocrm_pool.limiter(subdomain)
     
     async def _request(
         self,
@@ -37,31 +114,44 @@ class AmoCRMClient:
         
         url = f"{self.base_url}{endpoint}"
         
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.request(
-                    method,
-                    url,
-                    json=data,
-                    params=params,
-                    headers=headers
-                ) as response:
-                    if response.status == 401:
-                        logger.error("AmoCRM: Токен истёк или недействителен")
-                        return None
-                    
-                    if response.status >= 400:
-                        error_text = await response.text()
-                        logger.error(f"AmoCRM API error: {response.status} - {error_text}")
-                        return None
-                    
-                    if response.status == 204:
-                        return {}
-                    
-                    return await response.json()
-            except Exception as e:
-                logger.error(f"AmoCRM request error: {e}")
-                return None
+        await self.rate_limiter.acquire()
+        
+        session = self.http_session or amocrm_pool.session(self.subdomain)
+        return await self._send(session, method, url, data, params, headers)
+    
+    @staticmethod
+    async def _send(
+        session: aiohttp.ClientSession,
+        method: str,
+        url: str,
+        data: Optional[Dict],
+        params: Optional[Dict],
+        headers: Dict
+    ) -> Optional[Dict]:
+        try:
+            async with session.request(
+                method,
+                url,
+                json=data,
+                params=params,
+                headers=headers
+            ) as response:
+                if response.status == 401:
+                    logger.error("AmoCRM: Токен истёк или недействителен")
+                    return None
+                
+                if response.status >= 400:
+                    error_text = await response.text()
+                    logger.error(f"AmoCRM API error: {response.status} - {error_text}")
+                    return None
+                
+                if response.status == 204:
+                    return {}
+                
+                return await response.json()
+        except Exception as e:
+            logger.error(f"AmoCRM request error: {e}")
+            return None
     
     async def get_account_info(self) -> Optional[Dict]:
         """Получить информацию об аккаунте"""
@@ -134,14 +224,26 @@ class AmoCRMClient:
         
         return None
     
-    async def create_contact(
-        self,
+    async def create_leads_complex(self, leads: List[Dict]) -> Optional[List[Dict]]:
+        """
+        Создать до COMPLEX_BATCH_SIZE сделок со встроенными контактами одним запросом
+        
+        Returns:
+            [{"id", "contact_id", "request_id", ...}] или None при ошибке
+        """
+        result = await self._request("POST", "/leads/complex", data=leads)
+        if isinstance(result, list):
+            return result
+        return None
+    
+    @staticmethod
+    def contact_payload(
         name: str,
         phone: str = None,
         telegram: str = None,
         responsible_user_id: int = None
-    ) -> Optional[Dict]:
-        """Создать контакт"""
+    ) -> Dict:
+        """Данные контакта для /contacts и /leads/complex"""
         contact_data = {
             "name": name
         }
@@ -165,6 +267,18 @@ class AmoCRMClient:
         if custom_fields:
             contact_data["custom_fields_values"] = custom_fields
         
+        return contact_data
+    
+    async def create_contact(
+        self,
+        name: str,
+        phone: str = None,
+        telegram: str = None,
+        responsible_user_id: int = None
+    ) -> Optional[Dict]:
+        """Создать контакт"""
+        contact_data = self.contact_payload(name, phone, telegram, responsible_user_id)
+        
         result = await self._request("POST", "/contacts", data=[contact_data])
         
         if result and "_embedded" in result:
@@ -200,105 +314,305 @@ class AmoCRMClient:
             return result["_embedded"]["notes"][0]
         
         return None
+    
+    async def add_notes_to_leads(self, notes: List[tuple]) -> Optional[List[Dict]]:
+        """Добавить примечания к нескольким сделкам одним запросом ([(lead_id, текст)])"""
+        note_data = [
+            {
+                "entity_id": lead_id,
+                "note_type": "common",
+                "params": {
+                    "text": text
+                }
+            }
+            for lead_id, text in notes
+        ]
+        
+        result = await self._request("POST", "/leads/notes", data=note_data)
+        
+        if result and "_embedded" in result:
+            return result["_embedded"]["notes"]
+        
+        return None
+
 
+def build_lead_note(lead_match) -> str:
+    """Текст примечания к сделке"""
+    return f"""📱 Лид из GetLead Bot
 
-async def send_lead_to_amocrm(
-    session: AsyncSession,
-    user_id: int,
-    lead_match
-) -> bool:
+🔑 Ключевые слова: {lead_match.matched_keywords}
+
+💬 Текст сообщения:
+{lead_match.message_text}
+
+🔗 Ссылка: {lead_match.message_link}
+"""
+
+
+def _request_key(request_id) -> Optional[str]:
+    """request_id из ответа /leads/complex (AmoCRM возвращает его массивом)"""
+    if isinstance(request_id, list):
+        request_id = request_id[0] if request_id else None
+    return None if request_id is None else str(request_id)
+
+
+async def push_leads_to_amocrm(
+    client: AmoCRMClient,
+    integration,
+    items: List[tuple]
+) -> Dict[str, Optional[int]]:
     """
-    Отправить найденный лид в AmoCRM пользователя
+    Создать в AmoCRM сделки по пачке лидов одной интеграции
+    
+    Сделки с контактами создаются через /leads/complex (до 50 за запрос),
+    примечания - одним запросом /leads/notes на каждую пачку: 2 запроса
+    на 50 лидов вместо 3-4 на каждый.
     
     Args:
-        session: Сессия БД
-        user_id: ID пользователя
-        lead_match: Объект LeadMatch
+        client: Клиент аккаунта интеграции
+        integration: Объект AmoCRMIntegration
+        items: [(ключ, LeadMatch, название чата)] - ключ возвращается в ответе
         
     Returns:
-        True если успешно отправлено
+        {ключ: ID созданной сделки} - для всех лидов принятых пачек; None -
+        сделка создана, но AmoCRM не вернул её ключ (повторять нельзя - дубль)
+        
+    Raises:
+        AmoCRMError: если не удалось создать ни одной пачки сделок
     """
-    from database.models import AmoCRMIntegration, User
-    
-    # Получаем интеграцию пользователя
-    result = await session.execute(
-        select(AmoCRMIntegration)
-        .where(AmoCRMIntegration.user_id == user_id, AmoCRMIntegration.is_active == True)
-    )
-    integration = result.scalar_one_or_none()
-    
-    if not integration:
-        logger.debug(f"AmoCRM не настроен для пользователя {user_id}")
-        return False
-    
-    # Проверяем срок действия токена
-    if integration.token_expires_at < datetime.utcnow():
-        logger.warning(f"Токен AmoCRM истёк для пользователя {user_id}")
-        # TODO: Обновление токена через refresh_token
-        return False
-    
-    # Создаём клиента
-    client = AmoCRMClient(
-        subdomain=integration.subdomain,
-        access_token=integration.access_token,
-        refresh_token=integration.refresh_token
-    )
+    created: Dict[str, Optional[int]] = {}
+    errors = 0
     
-    try:
-        # Формируем название сделки
-        lead_name = f"Лид из Telegram: {lead_match.chat.title or 'Чат'}"
-        
-        # Создаём контакт если есть username
-        contact = None
-        if lead_match.sender_username:
-            contact = await client.create_contact(
-                name=f"@{lead_match.sender_username}",
-                telegram=f"@{lead_match.sender_username}",
-                responsible_user_id=integration.responsible_user_id
-            )
+    for offset in range(0, len(items), AmoCRMClient.COMPLEX_BATCH_SIZE):
+        chunk = items[offset:offset + AmoCRMClient.COMPLEX_BATCH_SIZE]
         
-        # Создаём сделку
-        lead = await client.create_lead(
-            name=lead_name,
-            pipeline_id=integration.pipeline_id,
-            status_id=integration.status_id,
-            responsible_user_id=integration.responsible_user_id,
-            tags=["GetLead", "Telegram"],
-            contacts=[contact] if contact else None
-        )
+        leads_data = []
+        for key, lead_match, chat_title in chunk:
+            lead_data = {
+                "name": f"Лид из Telegram: {chat_title or 'Чат'}",
+                "price": 0,
+                "request_id": str(key),
+                "_embedded": {"tags": [{"name": "GetLead"}, {"name": "Telegram"}]}
+            }
+            if integration.pipeline_id:
+                lead_data["pipeline_id"] = integration.pipeline_id
+            if integration.status_id:
+                lead_data["status_id"] = integration.status_id
+            if integration.responsible_user_id:
+                lead_data["responsible_user_id"] = integration.responsible_user_id
+            if lead_match.sender_username:
+                lead_data["_embedded"]["contacts"] = [
+                    AmoCRMClient.contact_payload(
+                        name=f"@{lead_match.sender_username}",
+                        telegram=f"@{lead_match.sender_username}",
+                        responsible_user_id=integration.responsible_user_id
+                    )
+                ]
+            leads_data.append(lead_data)
         
-        if not lead:
-            logger.error(f"Не удалось создать сделку в AmoCRM для пользователя {user_id}")
-            return False
+        results = await client.create_leads_complex(leads_data)
+        if results is None:
+            errors += 1
+            continue
         
-        # Добавляем примечание с текстом сообщения
-        note_text = f"""📱 Лид из GetLead Bot
-
-🔑 Ключевые слова: {lead_match.matched_keywords}
+        notes = []
+        lead_matches = {str(key): lead_match for key, lead_match, _ in chunk}
+        for index, result in enumerate(results):
+            key = _request_key(result.get("request_id"))
+            if key not in lead_matches and len(results) == len(chunk):
+                # Ответ идёт в порядке запроса
+                key = str(chunk[index][0])
+            if key in lead_matches and key not in created and result.get("id"):
+                created[key] = result["id"]
+                notes.append((result["id"], build_lead_note(lead_matches[key])))
+        
+        # Пачка принята - повтор создал бы дубли сделок, даже если ответ неполный
+        unmatched = [key for key in lead_matches if key not in created]
+        if unmatched:
+            logger.warning(
+                f"⚠️ AmoCRM {integration.subdomain}: пачка принята, но для {len(unmatched)} лидов "
+                f"не удалось сопоставить сделку (ключи {', '.join(unmatched)}), повторно не отправляем"
+            )
+            for key in unmatched:
+                created[key] = None
+        
+        # Сделки уже созданы - ошибку примечаний не повторяем, чтобы не плодить дубли
+        if notes and await client.add_notes_to_leads(notes) is None:
+            logger.warning(f"⚠️ AmoCRM {integration.subdomain}: не удалось добавить {len(notes)} примечаний")
+    
+    if errors and not created:
+        raise AmoCRMError(f"Не удалось создать сделки в {integration.subdomain}.amocrm.ru")
+    return created
 
-💬 Текст сообщения:
-{lead_match.message_text}
 
-🔗 Ссылка: {lead_match.message_link}
-"""
+class AmoCRMIntegrationCache:
+    """
+    Интеграции AmoCRM по user_id в памяти процесса доставки
+    
+    - недостающие интеграции загружаются одним запросом на пачку лидов
+    - сбрасываются по сигналу AmoCRMCRUD (канал amocrm_integration_changed),
+      TTL - страховка от пропущенного сигнала
+    - токен с истекающим сроком обновляется одним запросом, сколько бы
+      доставок его ни ждало (single-flight в процессе, блокировка в Redis
+      между процессами); новые токены пишутся одним UPDATE
+    """
+    
+    # Обновляем токен заранее, чтобы он не истёк посреди пачки
+    REFRESH_MARGIN = timedelta(minutes=10)
+    # Сколько ждать, пока токен обновит другой процесс
+    REFRESH_WAIT = 15
+    
+    def __init__(self, ttl: float = 300):
+        self._cache = LocalCache(maxsize=10000, ttl=ttl)
+        self._refreshing: Dict[int, asyncio.Future] = {}
+    
+    async def get_many(self, user_ids: Iterable[int]) -> Dict[int, Any]:
+        """Активные интеграции пользователей (без интеграции - нет в результате)"""
+        found = {}
+        missing = []
+        for user_id in set(user_ids):
+            cached = self._cache.get(str(user_id))
+            if cached is None:
+                missing.append(user_id)
+            elif cached is not False:
+                found[user_id] = cached
         
-        await client.add_note_to_lead(lead["id"], note_text)
+        if missing:
+            from database.database import async_session_maker
+            from database.models import AmoCRMIntegration
+            
+            async with async_session_maker() as session:
+                result = await session.execute(
+                    select(AmoCRMIntegration)
+                    .where(AmoCRMIntegration.user_id.in_(missing), AmoCRMIntegration.is_active == True)
+                )
+                loaded = {integration.user_id: integration for integration in result.scalars().all()}
+            
+            for user_id in missing:
+                # False - «интеграции нет», тоже кэшируем
+                self._cache.set(str(user_id), loaded.get(user_id, False))
+            found.update(loaded)
         
-        # Обновляем статус отправки в БД
-        from database.models import LeadMatch
-        await session.execute(
-            update(LeadMatch)
-            .where(LeadMatch.id == lead_match.id)
-            .values(is_sent_to_crm=True)
-        )
-        await session.commit()
+        return found
+    
+    def invalidate(self, user_id: int):
+        self._cache.delete(str(user_id))
+    
+    async def ensure_token(self, integration):
+        """
+        Интеграция с действующим токеном (при необходимости - после обновления)
         
-        logger.info(f"✅ Лид {lead_match.id} отправлен в AmoCRM пользователя {user_id}")
-        return True
+        Raises:
+            AmoCRMError: токен истёк и обновить его нельзя
+        """
+        if integration.token_expires_at - self.REFRESH_MARGIN > datetime.utcnow():
+            return integration
         
-    except Exception as e:
-        logger.error(f"Ошибка отправки в AmoCRM: {e}")
-        return False
+        if not integration.refresh_token:
+            if integration.token_expires_at > datetime.utcnow():
+                return integration
+            raise AmoCRMError(f"Токен AmoCRM истёк для пользователя {integration.user_id}, нужно переподключение")
+        
+        future = self._refreshing.get(integration.user_id)
+        if future is not None:
+            return await future
+        
+        future = asyncio.get_running_loop().create_future()
+        self._refreshing[integration.user_id] = future
+        try:
+            refreshed = await self._refresh(integration)
+            future.set_result(refreshed)
+            return refreshed
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение получают ожидающие; если их нет - не ругаемся
+            future.exception()
+            raise
+        finally:
+            self._refreshing.pop(integration.user_id, None)
+    
+    async def _refresh(self, integration):
+        from database.database import async_session_maker
+        from database.models import AmoCRMIntegration
+        
+        lock_key = CacheKeys.amocrm_refresh_lock(integration.user_id)
+        try:
+            redis = await get_redis()
+            locked = await redis.set(lock_key, 1, nx=True, ex=30)
+        except Exception as e:
+            logger.warning(f"⚠️ Redis недоступен для блокировки обновления токена: {e}")
+            redis, locked = None, True
+        
+        if not locked:
+            # Токен обновляет другой процесс - ждём новую запись в БД
+            for _ in range(self.REFRESH_WAIT * 2):
+                await asyncio.sleep(0.5)
+                self.invalidate(integration.user_id)
+                fresh = (await self.get_many([integration.user_id])).get(integration.user_id)
+                if fresh and fresh.access_token != integration.access_token:
+                    return fresh
+            raise AmoCRMError(f"Не дождались обновления токена AmoCRM пользователя {integration.user_id}")
+        
+        try:
+            tokens = await refresh_access_token(integration.subdomain, integration.refresh_token)
+            if not tokens:
+                raise AmoCRMError(f"Не удалось обновить токен AmoCRM пользователя {integration.user_id}")
+            
+            expires_at = datetime.utcnow() + timedelta(seconds=tokens["expires_in"])
+            async with async_session_maker() as session:
+                await session.execute(
+                    update(AmoCRMIntegration)
+                    .where(AmoCRMIntegration.id == integration.id)
+                    .values(
+                        access_token=tokens["access_token"],
+                        refresh_token=tokens["refresh_token"],
+                        token_expires_at=expires_at
+                    )
+                )
+                await session.commit()
+            
+            integration.access_token = tokens["access_token"]
+            integration.refresh_token = tokens["refresh_token"]
+            integration.token_expires_at = expires_at
+            self._cache.set(str(integration.user_id), integration)
+            logger.info(f"🔑 Токен AmoCRM пользователя {integration.user_id} обновлён")
+        finally:
+            if redis is not None:
+                try:
+                    await redis.delete(lock_key)
+                except Exception:
+                    pass
+        
+        # Остальные процессы перечитают интеграцию
+        await CacheService.publish_amocrm_integration_changed(integration.user_id)
+        return integration
+    
+    async def listen_for_changes(self):
+        """Слушаем Redis: изменения интеграций (подключение, отключение, новые токены)"""
+        import redis.asyncio as redis
+        
+        while True:
+            try:
+                redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+                pubsub = redis_client.pubsub()
+                await pubsub.subscribe(CacheKeys.amocrm_integration_changed_channel())
+                
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.invalidate(int(message['data']))
+                        
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка Redis pubsub (amocrm): {e}, переподключаюсь через 5 сек...")
+                await asyncio.sleep(5)
+
+
+# Общий кэш процесса
+integration_cache = AmoCRMIntegrationCache()
 
 
 def get_amocrm_oauth_url(client_id: str, redirect_uri: str, state: str) -> str:
@@ -348,3 +662,33 @@ async def exchange_code_for_tokens(
         except Exception as e:
             logger.error(f"AmoCRM token exchange error: {e}")
             return None
+
+
+async def refresh_access_token(subdomain: str, refresh_token: str) -> Optional[Dict]:
+    """Получить новую пару токенов по refresh_token"""
+    url = f"https://{subdomain}.amocrm.ru/oauth2/access_token"
+    
+    data = {
+        "client_id": settings.AMOCRM_CLIENT_ID,
+        "client_secret": settings.AMOCRM_CLIENT_SECRET,
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token,
+        "redirect_uri": settings.AMOCRM_REDIRECT_URI
+    }
+    
+    try:
+        async with amocrm_pool.session(subdomain).post(url, json=data) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error(f"AmoCRM token refresh error: {error_text}")
+                return None
+            
+            tokens = await response.json()
+            return {
+                "access_token": tokens["access_token"],
+                "refresh_token": tokens["refresh_token"],
+                "expires_in": tokens["expires_in"]
+            }
+    except Exception as e:
+        logger.error(f"AmoCRM token refresh error: {e}")
+        return None
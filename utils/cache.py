@@ -1,6 +1,8 @@
 """Утилиты для кэширования данных в Redis"""
 import json
 import logging
+import time
+from collections import OrderedDict
 from typing import Optional, List, Dict, Any
 from redis.asyncio import Redis
 from datetime import timedelta
@@ -21,6 +23,48 @@ async def get_redis() -> Redis:
     return _redis_client
 
 
+class LocalCache:
+    """
+    In-process LRU-кэш с TTL
+
+    Первый уровень перед Redis: горячие ключи не ходят по сети.
+    Не потокобезопасен (рассчитан на один event loop).
+    """
+    
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (истекает в, значение)
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Значение по ключу (None если нет или истёк TTL)"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Сохранить значение, вытеснив самое давнее при переполнении"""
+        self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def delete(self, key: str):
+        self._data.pop(key, None)
+    
+    def clear(self):
+        self._data.clear()
+
+
 class CacheKeys:
     """Ключи для кэширования"""
     
@@ -53,6 +97,106 @@ class CacheKeys:
     def monitored_chats() -> str:
         """Ключ для списка мониторируемых чатов"""
         return "monitored:chats"
+    
+    @staticmethod
+    def ai_verdict(digest: str) -> str:
+        """Ключ для вердикта AI по содержимому сообщения"""
+        return f"ai:verdict:{digest}"
+    
+    @staticmethod
+    def reload_chats_channel() -> str:
+        """Pub/sub канал: перезагрузить чаты и таблицу маршрутизации юзерботов"""
+        return "userbot:reload_chats"
+    
+    @staticmethod
+    def user_settings_changed_channel() -> str:
+        """Pub/sub канал: изменились настройки уведомлений (payload - 'user_id:mode')"""
+        return "userbot:user_settings_changed"
+    
+    @staticmethod
+    def notification_digest(user_telegram_id: int) -> str:
+        """Список накопленных записей сводки пользователя"""
+        return f"notifications:digest:{user_telegram_id}"
+    
+    @staticmethod
+    def notification_digest_users() -> str:
+        """Множество пользователей с непустой сводкой"""
+        return "notifications:digest:users"
+    
+    @staticmethod
+    def notification_digest_lock() -> str:
+        """Блокировка сброса сводок (один процесс за период)"""
+        return "notifications:digest:lock"
+    
+    @staticmethod
+    def notification_rate_limit() -> str:
+        """Общее ведро лимита Bot API для всех процессов"""
+        return "notifications:rate"
+    
+    @staticmethod
+    def amocrm_rate_limit(subdomain: str) -> str:
+        """Общее ведро лимита запросов аккаунта AmoCRM для всех процессов"""
+        return f"amocrm:rate:{subdomain}"
+    
+    @staticmethod
+    def keywords_changed_channel() -> str:
+        """Pub/sub канал: изменились ключевые слова проекта (payload - project_id)"""
+        return "userbot:keywords_changed"
+    
+    @staticmethod
+    def user_profile(telegram_id: int) -> str:
+        """Профиль пользователя бота (язык, тариф, срок подписки)"""
+        return f"user:profile:{telegram_id}"
+    
+    @staticmethod
+    def amocrm_integration_changed_channel() -> str:
+        """Pub/sub канал: изменилась интеграция AmoCRM (payload - user_id)"""
+        return "amocrm:integration_changed"
+    
+    @staticmethod
+    def amocrm_refresh_lock(user_id: int) -> str:
+        """Блокировка обновления токена AmoCRM (один процесс на интеграцию)"""
+        return f"amocrm:refresh:{user_id}"
+    
+    @staticmethod
+    def backfill_channel() -> str:
+        """Pub/sub канал: просканировать историю (payload - 'project_id:chat_id', 0 - все чаты)"""
+        return "userbot:backfill"
+    
+    @staticmethod
+    def backfill_progress(project_id: int) -> str:
+        """Хэш прогресса сканирования истории проекта"""
+        return f"backfill:progress:{project_id}"
+    
+    @staticmethod
+    def userbot_load() -> str:
+        """Хэш нагрузки юзерботов: '<session_name>:chats' и '<session_name>:users'"""
+        return "userbot:load"
+    
+    @staticmethod
+    def chat_rates() -> str:
+        """Хэш измеренной нагрузки чатов: '<telegram_id>:msgs' и '<telegram_id>:cpu'"""
+        return "userbot:chat_rates"
+    
+    @staticmethod
+    def userbot_rates() -> str:
+        """Хэш измеренной нагрузки юзерботов: '<session_name>:msgs' и '<session_name>:cpu'"""
+        return "userbot:rates"
+    
+    @staticmethod
+    def userbot_lease(session_name: str) -> str:
+        """Аренда юзербота: есть ключ - юзербот жив и мониторит свои чаты"""
+        return f"userbot:lease:{session_name}"
+    
+    @staticmethod
+    def userbot_failover(session_name: str) -> str:
+        """Множество ID чатов, перенесённых с недоступного юзербота"""
+        return f"userbot:failover:{session_name}"
+    
+    @staticmethod
+    def userbot_supervisor_lock() -> str:
+        """Блокировка супервизора (один проход проверки аренд на кластер)"""
+        return "userbot:supervisor"
 
 
 class CacheService:
@@ -62,6 +206,9 @@ class CacheService:
     TTL_KEYWORDS = 300  # 5 минут
     TTL_CHATS = 60  # 1 минута
     TTL_STATS = 120  # 2 минуты
+    TTL_AI_VERDICT = 6 * 3600  # 6 часов
+    TTL_BACKFILL_PROGRESS = 24 * 3600  # 1 день
+    TTL_USERBOT_LOAD = 60  # 1 минута
     
     @staticmethod
     async def get(key: str) -> Optional[Any]:
@@ -127,9 +274,142 @@ class CacheService:
     
     @staticmethod
     async def invalidate_project_keywords(project_id: int) -> bool:
-        """Инвалидировать кэш ключевых слов проекта"""
+        """Инвалидировать кэш ключевых слов проекта и уведомить юзерботы"""
         key = CacheKeys.project_keywords_pattern(project_id)
-        return await CacheService.delete(key)
+        deleted = await CacheService.delete(key)
+        try:
+            redis = await get_redis()
+            await redis.publish(CacheKeys.keywords_changed_channel(), project_id)
+        except Exception as e:
+            logger.error(f"Cache publish error: {e}")
+        return deleted
+    
+    @staticmethod
+    async def publish_reload_chats() -> bool:
+        """Попросить юзерботы перезагрузить чаты (изменились чаты или их проекты)"""
+        try:
+            redis = await get_redis()
+            await redis.publish(CacheKeys.reload_chats_channel(), 'reload')
+            return True
+        except Exception as e:
+            logger.error(f"Cache publish error: {e}")
+            return False
+    
+    @staticmethod
+    async def publish_user_settings_changed(user_id: int, notification_mode: str) -> bool:
+        """Сообщить юзерботам новый режим уведомлений пользователя"""
+        try:
+            redis = await get_redis()
+            await redis.publish(CacheKeys.user_settings_changed_channel(), f"{user_id}:{notification_mode}")
+            return True
+        except Exception as e:
+            logger.error(f"Cache publish error: {e}")
+            return False
+    
+    @staticmethod
+    async def publish_amocrm_integration_changed(user_id: int) -> bool:
+        """Сбросить закэшированную интеграцию AmoCRM во всех процессах"""
+        try:
+            redis = await get_redis()
+            await redis.publish(CacheKeys.amocrm_integration_changed_channel(), user_id)
+            return True
+        except Exception as e:
+            logger.error(f"Cache publish error: {e}")
+            return False
+    
+    @staticmethod
+    async def request_backfill(project_id: int, chat_id: int = 0) -> bool:
+        """
+        Попросить юзерботы просканировать историю чатов проекта
+        
+        chat_id - только один чат (ID в БД), 0 - все чаты проекта.
+        """
+        try:
+            redis = await get_redis()
+            progress_key = CacheKeys.backfill_progress(project_id)
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.delete(progress_key)
+                pipe.hset(progress_key, mapping={'requested_at': int(time.time())})
+                pipe.expire(progress_key, CacheService.TTL_BACKFILL_PROGRESS)
+                pipe.publish(CacheKeys.backfill_channel(), f"{project_id}:{chat_id}")
+                await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Cache publish error: {e}")
+            return False
+    
+    @staticmethod
+    async def get_backfill_progress(project_id: int) -> Optional[Dict[str, int]]:
+        """Прогресс сканирования истории проекта (None если не запускалось)"""
+        try:
+            redis = await get_redis()
+            progress = await redis.hgetall(CacheKeys.backfill_progress(project_id))
+            if not progress:
+                return None
+            return {field: int(value) for field, value in progress.items()}
+        except Exception as e:
+            logger.error(f"Cache get error: {e}")
+            return None
+    
+    @staticmethod
+    async def get_userbot_load() -> Optional[Dict[str, int]]:
+        """Закэшированная нагрузка юзерботов (None если кэша нет)"""
+        try:
+            redis = await get_redis()
+            load = await redis.hgetall(CacheKeys.userbot_load())
+            if not load:
+                return None
+            return {field: int(value) for field, value in load.items()}
+        except Exception as e:
+            logger.error(f"Cache get error: {e}")
+            return None
+    
+    @staticmethod
+    async def set_userbot_load(load: Dict[str, int]) -> bool:
+        """Сохранить нагрузку юзерботов целиком"""
+        try:
+            redis = await get_redis()
+            key = CacheKeys.userbot_load()
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.delete(key)
+                if load:
+                    pipe.hset(key, mapping=load)
+                    pipe.expire(key, CacheService.TTL_USERBOT_LOAD)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Cache set error: {e}")
+            return False
+    
+    @staticmethod
+    async def invalidate_userbot_load() -> bool:
+        """Сбросить кэш нагрузки юзерботов (массовое переназначение чатов)"""
+        return await CacheService.delete(CacheKeys.userbot_load())
+    
+    @staticmethod
+    async def move_userbot_chat(new_userbot: str, old_userbot: Optional[str] = None) -> bool:
+        """
+        Учесть переназначение чата в закэшированной нагрузке
+        
+        Счётчики пользователей не меняются - они уточнятся при пересчёте
+        после истечения TTL.
+        """
+        try:
+            redis = await get_redis()
+            key = CacheKeys.userbot_load()
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.hincrby(key, f"{new_userbot}:chats", 1)
+                if old_userbot:
+                    pipe.hincrby(key, f"{old_userbot}:chats", -1)
+                pipe.ttl(key)
+                results = await pipe.execute()
+            # Кэш уже истёк - неполный хэш не должен жить без TTL
+            if results[-1] == -1:
+                await redis.expire(key, CacheService.TTL_USERBOT_LOAD)
+            return True
+        except Exception as e:
+            logger.error(f"Cache set error: {e}")
+            return False
     
     @staticmethod
     async def get_chat_projects(chat_telegram_id: int) -> Optional[List[Dict]]:
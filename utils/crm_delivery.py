@@ -0,0 +1,190 @@
+"""Доставка лидов в AmoCRM из очереди crm_outbox (вне горячего пути матчинга)"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+
+from config import settings
+from database.database import async_session_maker
+from database.crud import CRMOutboxCRUD
+from database.models import AmoCRMIntegration, Chat, LeadMatch
+from utils.amocrm import AmoCRMClient, amocrm_pool, integration_cache, push_leads_to_amocrm
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class CRMDeliveryWorker:
+    """
+    Фоновая доставка лидов в CRM
+
+    - записи очереди забираются пачкой с арендой (SKIP LOCKED), поэтому
+      доставщиков может быть несколько в разных процессах
+    - лиды одной интеграции отправляются пачкой (/leads/complex и
+      /leads/notes), HTTP-сессия и лимит запросов - общие на аккаунт
+      (amocrm_pool)
+    - ошибка - повтор с экспоненциальной задержкой, после max_attempts
+      запись помечается failed
+    - после доставки лид отмечается is_sent_to_crm
+    - интеграции берутся из integration_cache, истекающий токен
+      обновляется автоматически
+    """
+
+    # Аренда записи: за это время доставка должна завершиться
+    LEASE_SECONDS = 300
+
+    def __init__(
+        self,
+        poll_interval: float = 2.0,
+        batch_size: int = 50,
+        max_attempts: int = 8,
+        retry_base_delay: float = 30.0
+    ):
+        self.poll_interval = poll_interval
+        self.batch_size = max(1, batch_size)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base_delay = retry_base_delay
+
+        self._task: Optional[asyncio.Task] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_settings(cls) -> 'CRMDeliveryWorker':
+        return cls(
+            poll_interval=settings.CRM_OUTBOX_POLL_INTERVAL,
+            batch_size=settings.CRM_OUTBOX_BATCH_SIZE,
+            max_attempts=settings.CRM_MAX_ATTEMPTS,
+            retry_base_delay=settings.CRM_RETRY_BASE_DELAY
+        )
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        self._listener = asyncio.create_task(integration_cache.listen_for_changes())
+        logger.info(f"📤 Доставка в CRM запущена: пачка {self.batch_size}")
+
+    async def stop(self):
+        tasks = [task for task in (self._task, self._listener) if task is not None]
+        self._task = self._listener = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await amocrm_pool.close()
+
+    async def _run(self):
+        while True:
+            try:
+                delivered = await self.deliver_due()
+                # Полная пачка - вероятно, есть ещё; иначе ждём новые записи
+                if delivered < self.batch_size:
+                    await asyncio.sleep(self.poll_interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка доставки в CRM: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def deliver_due(self) -> int:
+        """Доставить одну пачку записей, срок которых подошёл (возвращает размер пачки)"""
+        async with async_session_maker() as session:
+            claimed = await CRMOutboxCRUD.claim_due(session, self.batch_size, self.LEASE_SECONDS)
+            if not claimed:
+                return 0
+
+            lead_ids = [lead_id for _, lead_id, _, _ in claimed]
+            result = await session.execute(
+                select(LeadMatch, Chat.title)
+                .join(Chat, Chat.id == LeadMatch.chat_id)
+                .where(LeadMatch.id.in_(lead_ids))
+            )
+            leads = {lead.id: (lead, chat_title) for lead, chat_title in result.all()}
+
+        integrations = await integration_cache.get_many(user_id for _, _, user_id, _ in claimed)
+
+        # Аккаунты - параллельно, внутри аккаунта - одной пачкой
+        by_user: Dict[int, List[tuple]] = {}
+        for entry in claimed:
+            by_user.setdefault(entry[2], []).append(entry)
+
+        started_at = time.monotonic()
+        await asyncio.gather(*(
+            self._deliver_user(entries, integrations.get(user_id), leads)
+            for user_id, entries in by_user.items()
+        ))
+        metrics.observe('crm.batch_ms', (time.monotonic() - started_at) * 1000)
+        return len(claimed)
+
+    async def _deliver_user(self, entries: List[tuple], integration: Optional[AmoCRMIntegration], leads: dict):
+        """Отправить лиды одной интеграции пачкой"""
+        items = []
+        attempts_by_id = {}
+        for outbox_id, lead_id, user_id, attempts in entries:
+            if integration is None or lead_id not in leads:
+                await self._fail(outbox_id, attempts, "Интеграция отключена или лид удалён", final=True)
+                continue
+            lead_match, chat_title = leads[lead_id]
+            items.append((outbox_id, lead_match, chat_title))
+            attempts_by_id[outbox_id] = attempts
+
+        if not items:
+            return
+
+        try:
+            integration = await integration_cache.ensure_token(integration)
+            client = AmoCRMClient(
+                subdomain=integration.subdomain,
+                access_token=integration.access_token,
+                refresh_token=integration.refresh_token
+            )
+            created = await push_leads_to_amocrm(client, integration, items)
+        except Exception as e:
+            # Возможно, интеграцию переподключили - перечитаем при повторе
+            integration_cache.invalidate(integration.user_id)
+            for outbox_id, _, _ in items:
+                await self._fail(outbox_id, attempts_by_id[outbox_id], str(e))
+            return
+
+        sent_ids = []
+        sent_lead_ids = []
+        for outbox_id, lead_match, _ in items:
+            if str(outbox_id) in created:
+                sent_ids.append(outbox_id)
+                sent_lead_ids.append(lead_match.id)
+            else:
+                await self._fail(outbox_id, attempts_by_id[outbox_id], "AmoCRM не вернул сделку")
+
+        unmatched = sum(1 for amo_id in created.values() if amo_id is None)
+        if unmatched:
+            metrics.incr('crm.unmatched', unmatched)
+
+        if sent_ids:
+            async with async_session_maker() as session:
+                await CRMOutboxCRUD.mark_sent(session, sent_ids, sent_lead_ids)
+            metrics.incr('crm.sent', len(sent_ids))
+            metrics.observe('crm.leads_per_account', len(sent_ids))
+            logger.info(f"✅ {len(sent_ids)} лидов отправлено в AmoCRM {integration.subdomain}")
+
+    async def _fail(self, outbox_id: int, attempts: int, error: str, final: bool = False):
+        """Запланировать повтор с экспоненциальной задержкой или отказаться"""
+        retry_at = None
+        if not final and attempts < self.max_attempts:
+            delay = min(self.retry_base_delay * 2 ** (attempts - 1), 6 * 3600)
+            retry_at = datetime.utcnow() + timedelta(seconds=delay)
+
+        async with async_session_maker() as session:
+            await CRMOutboxCRUD.mark_failed(session, outbox_id, error, retry_at)
+
+        if retry_at is None:
+            metrics.incr('crm.failed')
+            logger.error(f"❌ Запись CRM {outbox_id} не доставлена после {attempts} попыток: {error}")
+        else:
+            metrics.incr('crm.retries')
+            logger.warning(f"⚠️ Запись CRM {outbox_id}: {error}, повтор в {retry_at:%H:%M:%S}")
+
+
+# Общий доставщик процесса
+crm_delivery = CRMDeliveryWorker.from_settings()
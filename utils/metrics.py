@@ -0,0 +1,91 @@
+"""Простые метрики процесса (счётчики, gauge, тайминги) с выгрузкой в Redis"""
+import asyncio
+import json
+import logging
+import os
+import socket
+from collections import defaultdict
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Реестр метрик процесса"""
+
+    def __init__(self):
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[str, list] = {}  # name -> [count, sum, max]
+
+    def incr(self, name: str, value: int = 1):
+        """Увеличить счётчик"""
+        self._counters[name] += value
+
+    def gauge(self, name: str, value: float):
+        """Установить текущее значение (глубина очереди и т.п.)"""
+        self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        """Записать измерение (время ожидания, длительность)"""
+        timing = self._timings.get(name)
+        if timing is None:
+            self._timings[name] = [1, value, value]
+        else:
+            timing[0] += 1
+            timing[1] += value
+            if value > timing[2]:
+                timing[2] = value
+
+    def counter(self, name: str) -> int:
+        """Текущее значение счётчика"""
+        return self._counters.get(name, 0)
+
+    def snapshot(self, reset_timings: bool = True) -> Dict[str, Any]:
+        """
+        Снимок всех метрик
+
+        Счётчики накопительные; тайминги (count/avg/max) считаются
+        за интервал с прошлого снимка, если reset_timings=True.
+        """
+        data: Dict[str, Any] = dict(self._counters)
+        data.update(self._gauges)
+        for name, (count, total, maximum) in self._timings.items():
+            data[f'{name}.count'] = count
+            data[f'{name}.avg'] = round(total / count, 3) if count else 0
+            data[f'{name}.max'] = round(maximum, 3)
+        if reset_timings:
+            self._timings = {}
+        return data
+
+
+# Глобальный реестр метрик процесса
+metrics = Metrics()
+
+
+def metrics_key() -> str:
+    """Ключ Redis для метрик текущего процесса"""
+    return f"metrics:{socket.gethostname()}:{os.getpid()}"
+
+
+async def report_metrics_periodically(interval: int = 60):
+    """Раз в interval секунд логировать метрики и выгружать их в Redis"""
+    from utils.cache import get_redis
+
+    while True:
+        try:
+            await asyncio.sleep(interval)
+            data = metrics.snapshot()
+            if not data:
+                continue
+
+            logger.info(f"📈 Метрики: {json.dumps(data, ensure_ascii=False, sort_keys=True)}")
+
+            redis = await get_redis()
+            key = metrics_key()
+            await redis.hset(key, mapping={name: json.dumps(value) for name, value in data.items()})
+            await redis.expire(key, interval * 5)
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"❌ Ошибка выгрузки метрик: {e}")
@@ -0,0 +1,344 @@
+"""Диспетчер уведомлений пользователям: очередь, лимиты Telegram, повторы"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramServerError,
+)
+
+from config import settings
+from utils.cache import get_redis, CacheKeys
+from utils.metrics import metrics
+from utils.throttling import RedisTokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationDispatcher:
+    """
+    Отправка уведомлений через один Bot на процесс
+
+    - enqueue() только ставит уведомление в очередь (матчинг не ждёт Bot API)
+    - token bucket под глобальный лимит Telegram (~30 сообщений/с) - в
+      Redis, общий для всех процессов с этим ботом
+    - не чаще одного сообщения в per_chat_interval секунд в один чат;
+      сообщение в «занятый» чат откладывается, не блокируя остальные
+    - TelegramRetryAfter - повтор через указанную сервером задержку,
+      сетевые ошибки - повтор с экспоненциальной задержкой
+    - недоставленное (исчерпаны попытки, остановка процесса) сохраняется
+      в Redis и подхватывается при следующем запуске
+    - режим сводки: записи копятся в Redis и раз в digest_interval
+      уходят пользователю одним сообщением; сбрасывает их один процесс
+      за период (блокировка в Redis)
+    """
+
+    UNDELIVERED_KEY = "notifications:undelivered"
+    MAX_MESSAGE_LENGTH = 4000  # Лимит Telegram 4096 с запасом
+
+    def __init__(
+        self,
+        global_rate: float = 25,
+        per_chat_interval: float = 1.0,
+        workers: int = 4,
+        max_attempts: int = 5,
+        digest_interval: int = 3600
+    ):
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.digest_interval = max(60, digest_interval)
+
+        self.bot: Optional[Bot] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._bucket = RedisTokenBucket(CacheKeys.notification_rate_limit(), rate=global_rate, capacity=global_rate)
+        self._chat_next_at: Dict[int, float] = {}  # chat_id -> когда можно писать снова
+        self._chat_waiting: Dict[int, Deque[Dict[str, Any]]] = {}  # chat_id -> отложенные уведомления
+        self._release_handles: Dict[int, asyncio.TimerHandle] = {}
+        self._tasks: list = []
+
+    @classmethod
+    def from_settings(cls) -> 'NotificationDispatcher':
+        return cls(
+            global_rate=settings.NOTIFY_GLOBAL_RATE,
+            per_chat_interval=settings.NOTIFY_PER_CHAT_INTERVAL,
+            workers=settings.NOTIFY_WORKERS,
+            max_attempts=settings.NOTIFY_MAX_ATTEMPTS,
+            digest_interval=settings.NOTIFY_DIGEST_INTERVAL
+        )
+
+    @property
+    def started(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        """Запустить отправителей и подхватить недоставленное с прошлого запуска"""
+        if self.started:
+            return
+
+        self.bot = Bot(token=settings.BOT_TOKEN)
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._send_loop(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._digest_loop()))
+
+        restored = await self._restore_undelivered()
+        logger.info(
+            f"📮 Диспетчер уведомлений запущен: {self.workers} отправителей, "
+            f"{self.global_rate}/с, восстановлено {restored}"
+        )
+
+    async def stop(self):
+        """Остановить отправку; всё, что не ушло, сохранить в Redis"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        for handle in self._release_handles.values():
+            handle.cancel()
+        self._release_handles.clear()
+        pending = [item for waiting in self._chat_waiting.values() for item in waiting]
+        self._chat_waiting.clear()
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for item in pending:
+            item.pop('_released', None)
+            await self._persist(item)
+        if pending:
+            logger.info(f"💾 Сохранено недоставленных уведомлений: {len(pending)}")
+
+        if self.bot is not None:
+            await self.bot.session.close()
+            self.bot = None
+
+    def enqueue(
+        self,
+        chat_id: int,
+        text: str,
+        parse_mode: Optional[str] = 'HTML',
+        disable_web_page_preview: bool = True
+    ):
+        """Поставить уведомление в очередь (не ждёт отправки)"""
+        item = {
+            'chat_id': chat_id,
+            'text': text,
+            'parse_mode': parse_mode,
+            'disable_web_page_preview': disable_web_page_preview,
+            'attempts': 0,
+        }
+        if self._queue is None:
+            # Диспетчер ещё не запущен - сохраняем, отправим после старта
+            asyncio.create_task(self._persist(item))
+            return
+
+        self._queue.put_nowait(item)
+        metrics.incr('notify.enqueued')
+        metrics.gauge('notify.depth', self._queue.qsize())
+
+    async def add_to_digest(self, chat_id: int, entry: str):
+        """Добавить запись в сводку пользователя (Redis - переживает перезапуск)"""
+        try:
+            redis = await get_redis()
+            await redis.rpush(CacheKeys.notification_digest(chat_id), entry)
+            await redis.sadd(CacheKeys.notification_digest_users(), chat_id)
+            metrics.incr('notify.digest_entries')
+        except Exception as e:
+            # Без Redis сводку не собрать - отправляем сразу
+            logger.error(f"❌ Не удалось добавить запись в сводку {chat_id}: {e}")
+            self.enqueue(chat_id, entry)
+
+    async def flush_digests(self):
+        """Отправить все накопленные сводки"""
+        redis = await get_redis()
+        user_ids = await redis.smembers(CacheKeys.notification_digest_users())
+
+        for raw_user_id in user_ids:
+            chat_id = int(raw_user_id)
+            key = CacheKeys.notification_digest(chat_id)
+
+            # Забираем записи атомарно (несколько процессов могут сбрасывать сводки)
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.lrange(key, 0, -1)
+                pipe.delete(key)
+                pipe.srem(CacheKeys.notification_digest_users(), raw_user_id)
+                entries, _, _ = await pipe.execute()
+
+            if not entries:
+                continue
+
+            for text in self._format_digest(entries):
+                self.enqueue(chat_id, text)
+            metrics.incr('notify.digests')
+
+    def _format_digest(self, entries: list) -> list:
+        """Сводка одним сообщением (или несколькими, если не влезает в лимит)"""
+        minutes = self.digest_interval // 60
+        header = f"📬 <b>Сводка лидов за {minutes} мин:</b> {len(entries)}\n\n"
+
+        messages = []
+        current = header
+        for entry in entries:
+            if len(current) + len(entry) + 2 > self.MAX_MESSAGE_LENGTH and current != header:
+                messages.append(current)
+                current = ''
+            current += entry + '\n\n'
+        messages.append(current)
+        return messages
+
+    async def _digest_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(self.digest_interval)
+                # Процессов несколько - сводки за период отправляет первый
+                redis = await get_redis()
+                lock_ttl = max(30, int(self.digest_interval * 0.9))
+                if not await redis.set(CacheKeys.notification_digest_lock(), 1, nx=True, ex=lock_ttl):
+                    continue
+                await self.flush_digests()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ Ошибка отправки сводок: {e}")
+
+    def _defer(self, item: Dict[str, Any], delay: float, front: bool = False):
+        """
+        Отложить уведомление в очередь ожидания его чата
+
+        Уведомления одного чата уходят строго по порядку: пока у чата есть
+        ожидающие, новые встают за ними; повтор встаёт в начало.
+        """
+        chat_id = item['chat_id']
+        waiting = self._chat_waiting.setdefault(chat_id, deque())
+        if front:
+            waiting.appendleft(item)
+        else:
+            waiting.append(item)
+        self._schedule_release(chat_id, delay)
+
+    def _schedule_release(self, chat_id: int, delay: float):
+        """Через delay секунд вернуть в общую очередь следующее уведомление чата"""
+        if chat_id in self._release_handles or chat_id not in self._chat_waiting:
+            return
+        self._release_handles[chat_id] = asyncio.get_running_loop().call_later(
+            max(0.0, delay), self._release, chat_id
+        )
+
+    def _release(self, chat_id: int):
+        self._release_handles.pop(chat_id, None)
+        waiting = self._chat_waiting.get(chat_id)
+        if not waiting:
+            self._chat_waiting.pop(chat_id, None)
+            return
+        item = waiting.popleft()
+        if not waiting:
+            del self._chat_waiting[chat_id]
+        item['_released'] = True
+        self._queue.put_nowait(item)
+
+    async def _send_loop(self, worker_id: int):
+        while True:
+            item = await self._queue.get()
+            metrics.gauge('notify.depth', self._queue.qsize())
+            try:
+                await self._deliver(item)
+            except asyncio.CancelledError:
+                # Прерванную отправку не теряем
+                self._queue.put_nowait(item)
+                raise
+            except Exception as e:
+                logger.error(f"❌ notify#{worker_id}: ошибка отправки уведомления: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, item: Dict[str, Any]):
+        chat_id = item['chat_id']
+        released = item.pop('_released', False)
+        now = time.monotonic()
+
+        # Лимит на чат: не ждём, а откладываем - общая очередь продолжает двигаться
+        wait = self._chat_next_at.get(chat_id, 0) - now
+        if wait > 0 or (chat_id in self._chat_waiting and not released):
+            self._defer(item, wait, front=released)
+            return
+
+        # Занимаем слот чата до ожидания общего лимита (параллельные отправители)
+        if len(self._chat_next_at) > 10000:
+            self._chat_next_at = {cid: at for cid, at in self._chat_next_at.items() if at > now}
+        self._chat_next_at[chat_id] = now + self.per_chat_interval
+
+        await self._bucket.acquire()
+
+        item['attempts'] += 1
+        try:
+            await self.bot.send_message(
+                chat_id=chat_id,
+                text=item['text'],
+                parse_mode=item['parse_mode'],
+                disable_web_page_preview=item['disable_web_page_preview']
+            )
+            metrics.incr('notify.sent')
+            logger.info(f"✅ Уведомление отправлено пользователю {chat_id}")
+        except TelegramRetryAfter as e:
+            # Flood control: ждём ровно столько, сколько просит Telegram
+            metrics.incr('notify.retry_after')
+            self._chat_next_at[chat_id] = time.monotonic() + e.retry_after
+            logger.warning(f"⏳ Flood control для {chat_id}: повтор через {e.retry_after} сек")
+            item['attempts'] -= 1  # задержка сервера - не неудачная попытка
+            self._defer(item, e.retry_after, front=True)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован / неверный запрос - повтор не поможет
+            metrics.incr('notify.rejected')
+            logger.warning(f"⚠️ Уведомление пользователю {chat_id} отклонено: {e}")
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if item['attempts'] >= self.max_attempts:
+                metrics.incr('notify.undelivered')
+                logger.error(f"❌ Уведомление пользователю {chat_id} не доставлено за {item['attempts']} попыток: {e}")
+                await self._persist(item)
+            else:
+                delay = min(60, 2 ** item['attempts'])
+                metrics.incr('notify.retry')
+                logger.warning(f"🔁 Ошибка сети при отправке {chat_id}, повтор через {delay} сек: {e}")
+                self._chat_next_at[chat_id] = time.monotonic() + delay
+                self._defer(item, delay, front=True)
+        finally:
+            # Следующее уведомление этого чата - когда освободится слот
+            self._schedule_release(chat_id, self._chat_next_at[chat_id] - time.monotonic())
+
+    async def _persist(self, item: Dict[str, Any]):
+        """Сохранить уведомление в Redis до следующего запуска"""
+        try:
+            redis = await get_redis()
+            await redis.rpush(self.UNDELIVERED_KEY, json.dumps(item, ensure_ascii=False))
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить уведомление для {item.get('chat_id')}: {e}")
+
+    async def _restore_undelivered(self) -> int:
+        """Забрать сохранённые уведомления обратно в очередь"""
+        restored = 0
+        try:
+            redis = await get_redis()
+            while True:
+                raw_items = await redis.lpop(self.UNDELIVERED_KEY, 100)
+                if not raw_items:
+                    break
+                for raw in raw_items:
+                    item = json.loads(raw)
+                    item['attempts'] = 0
+                    self._queue.put_nowait(item)
+                    restored += 1
+        except Exception as e:
+            logger.error(f"❌ Ошибка восстановления уведомлений: {e}")
+        return restored
+
+
+# Общий диспетчер процесса
+notifier = NotificationDispatcher.from_settings()
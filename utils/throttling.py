@@ -0,0 +1,164 @@
+"""Ограничение частоты запросов (token bucket)"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Асинхронный token bucket
+
+    Ведро ёмкостью capacity пополняется со скоростью rate токенов в секунду.
+    acquire(n) ждёт, пока в ведре наберётся n токенов. Запросы обслуживаются
+    по очереди (FIFO), чтобы крупный запрос не голодал за мелкими.
+    rate <= 0 отключает ограничение.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, limit: int) -> 'TokenBucket':
+        """Бюджет limit единиц в минуту (limit <= 0 - без ограничения)"""
+        return cls(rate=limit / 60.0, capacity=limit)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """
+        Забрать amount токенов, дождавшись пополнения
+
+        Returns:
+            Сколько секунд пришлось ждать
+        """
+        if not self.enabled:
+            return 0.0
+
+        # Запрос больше ёмкости иначе не выполнится никогда
+        amount = min(amount, self.capacity)
+        waited = 0.0
+
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                delay = (amount - self._tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self._refill()
+            self._tokens -= amount
+
+        return waited
+
+    def try_acquire(self, amount: float = 1.0) -> bool:
+        """Забрать токены без ожидания (False если их недостаточно)"""
+        if not self.enabled:
+            return True
+        if self._lock.locked():
+            return False
+        self._refill()
+        if self._tokens < amount:
+            return False
+        self._tokens -= amount
+        return True
+
+    def refund(self, amount: float):
+        """Вернуть лишние токены (например, если запрос оказался дешевле оценки)"""
+        if not self.enabled or amount <= 0:
+            return
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+    def charge(self, amount: float):
+        """Списать токены задним числом (баланс может уйти в минус)"""
+        if not self.enabled or amount <= 0:
+            return
+        self._refill()
+        self._tokens -= amount
+
+
+class RedisTokenBucket:
+    """
+    Token bucket в Redis, общий для всех процессов
+
+    Нужен для лимитов, которые считает внешний сервис на весь аккаунт
+    (Bot API на токен бота, AmoCRM на поддомен): при N процессах локальные
+    вёдра дали бы N-кратный лимит. Пополнение и списание - один Lua-скрипт
+    по часам Redis. Если Redis недоступен, работает локальное ведро
+    процесса с тем же лимитом.
+    """
+
+    _SCRIPT = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local amount = tonumber(ARGV[3])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local wait = 0
+    if tokens >= amount then
+        tokens = tokens - amount
+    else
+        wait = (amount - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+    return tostring(wait)
+    """
+
+    def __init__(self, key: str, rate: float, capacity: float):
+        self.key = key
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._script = None
+        self._fallback = TokenBucket(rate=rate, capacity=capacity)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    async def _take(self, amount: float) -> float:
+        """Забрать токены, если хватает; иначе - сколько ждать до пополнения"""
+        if self._script is None:
+            from utils.cache import get_redis
+            redis = await get_redis()
+            self._script = redis.register_script(self._SCRIPT)
+        return float(await self._script(keys=[self.key], args=[self.rate, self.capacity, amount]))
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """
+        Забрать amount токенов, дождавшись пополнения
+
+        Returns:
+            Сколько секунд пришлось ждать
+        """
+        if not self.enabled:
+            return 0.0
+
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            try:
+                delay = await self._take(amount)
+            except Exception as e:
+                logger.error(f"❌ Общий лимит {self.key} недоступен, используем локальный: {e}")
+                return waited + await self._fallback.acquire(amount)
+            if delay <= 0:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
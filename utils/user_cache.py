@@ -0,0 +1,140 @@
+"""Кэш профилей пользователей бота (in-process LRU + Redis)"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from database.models import NotificationMode, SubscriptionPlan, User
+from utils.cache import CacheKeys, CacheService, LocalCache, get_redis
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class UserProfile:
+    """
+    Облегчённая запись пользователя для middleware и хендлеров
+
+    Передаётся в хендлеры вместо ORM-объекта User: те же поля, без связей.
+    """
+
+    __slots__ = (
+        'id', 'telegram_id', 'username', 'language', 'notification_mode',
+        'subscription_plan', 'subscription_end_date', 'created_at'
+    )
+
+    def __init__(
+        self,
+        id: int,
+        telegram_id: int,
+        username: Optional[str],
+        language: str,
+        notification_mode: str,
+        subscription_plan: SubscriptionPlan,
+        subscription_end_date: Optional[datetime],
+        created_at: datetime
+    ):
+        self.id = id
+        self.telegram_id = telegram_id
+        self.username = username
+        self.language = language
+        self.notification_mode = notification_mode
+        self.subscription_plan = subscription_plan
+        self.subscription_end_date = subscription_end_date
+        self.created_at = created_at
+
+    @classmethod
+    def from_user(cls, user: User) -> 'UserProfile':
+        return cls(
+            id=user.id,
+            telegram_id=user.telegram_id,
+            username=user.username,
+            language=user.language,
+            notification_mode=user.notification_mode or NotificationMode.ALL.value,
+            subscription_plan=user.subscription_plan,
+            subscription_end_date=user.subscription_end_date,
+            created_at=user.created_at
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'telegram_id': self.telegram_id,
+            'username': self.username,
+            'language': self.language,
+            'notification_mode': self.notification_mode,
+            'subscription_plan': self.subscription_plan.value,
+            'subscription_end_date': self.subscription_end_date.isoformat() if self.subscription_end_date else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'UserProfile':
+        end_date = data.get('subscription_end_date')
+        created_at = data.get('created_at')
+        return cls(
+            id=data['id'],
+            telegram_id=data['telegram_id'],
+            username=data.get('username'),
+            language=data.get('language') or 'ru',
+            notification_mode=data.get('notification_mode') or NotificationMode.ALL.value,
+            subscription_plan=SubscriptionPlan(data['subscription_plan']),
+            subscription_end_date=datetime.fromisoformat(end_date) if end_date else None,
+            created_at=datetime.fromisoformat(created_at) if created_at else None
+        )
+
+    @property
+    def has_active_subscription(self) -> bool:
+        """Платный тариф, срок которого не истёк"""
+        if self.subscription_plan == SubscriptionPlan.FREE:
+            return False
+        return not self.subscription_end_date or self.subscription_end_date >= datetime.utcnow()
+
+
+class UserProfileCache:
+    """
+    Профили по telegram_id: in-process LRU перед Redis
+
+    Локальный TTL короткий - другие процессы бота увидят изменение не позже
+    чем через local_ttl секунд; Redis-запись удаляется сразу при изменении
+    (UserCRUD.update_subscription, set_language, set_notification_mode).
+    """
+
+    def __init__(self, local_ttl: float = 30, redis_ttl: int = 600):
+        self.redis_ttl = redis_ttl
+        self._local = LocalCache(maxsize=10000, ttl=local_ttl)
+
+    async def get(self, telegram_id: int) -> Optional[UserProfile]:
+        profile = self._local.get(str(telegram_id))
+        if profile is not None:
+            metrics.incr('user_cache.hit_local')
+            return profile
+
+        data = await CacheService.get(CacheKeys.user_profile(telegram_id))
+        if data:
+            try:
+                profile = UserProfile.from_dict(data)
+            except (KeyError, ValueError) as e:
+                logger.warning(f"⚠️ Некорректный профиль в кэше {telegram_id}: {e}")
+                return None
+            self._local.set(str(telegram_id), profile)
+            metrics.incr('user_cache.hit_redis')
+            return profile
+
+        metrics.incr('user_cache.miss')
+        return None
+
+    async def set(self, profile: UserProfile):
+        self._local.set(str(profile.telegram_id), profile)
+        await CacheService.set(CacheKeys.user_profile(profile.telegram_id), profile.to_dict(), self.redis_ttl)
+
+    async def invalidate(self, telegram_id: int):
+        self._local.delete(str(telegram_id))
+        try:
+            redis = await get_redis()
+            await redis.delete(CacheKeys.user_profile(telegram_id))
+        except Exception as e:
+            logger.error(f"Cache delete error: {e}")
+
+
+# Общий кэш процесса
+user_cache = UserProfileCache()